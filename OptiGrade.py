@@ -1,11 +1,13 @@
 import cv2
-import numpy as np
-import os
 import time
 from datetime import datetime
 # Assuming database_manager.py exists and handles database operations
 # You would need to ensure this file is present and correctly configured.
 from database_manager import OptiGradeDatabase 
+from omr_detector import (FrameProcessor, assess_confidence, build_detailed_results, grade_answers,
+                          save_result_image, save_review_crop)
+from preview_renderer import PreviewRenderer
+from result_journal import JournalIngester, ResultJournal, max_student_number
 
 class OptiGradeFullyAuto:
     """
@@ -23,6 +25,12 @@ class OptiGradeFullyAuto:
         self.detection_cooldown = 2.0  # Seconds between processing attempts
         self.student_counter = 1  # Auto-incrementing student counter
         self.session_name = ""
+        self.frame_processor = None  # Reused detection buffers, created per scanning session
+        self.camera_source = None
+        self.journal_fsync = 'always'  # Results are journaled before the sheet counts as done
+        self.preview_width = 640  # The window shows a downscaled copy of the frame
+        self.preview_fps = 15
+        self.result_display_seconds = 3.0  # A graded sheet stays on screen without pausing capture
 
     def setup_assignment(self):
         """Setup assignment configuration and save to database"""
@@ -70,13 +78,18 @@ class OptiGradeFullyAuto:
                     print(f"Please enter a valid option ({', '.join(valid_options_chars)}).")
 
         # Save assignment to database
-        self.assignment_id = self.db.save_assignment(self.session_name, self.num_questions, self.answer_key)
+        self.assignment_id = self.db.save_assignment(self.session_name, self.num_questions, self.answer_key,
+                                                     self.num_options)
 
         if self.assignment_id:
             print(f"\nAssignment '{self.session_name}' saved with ID: {self.assignment_id}")
         else:
             print("Error saving assignment to database. Continuing without database storage.")
 
+    def student_id_prefix(self):
+        """Prefix of automatically generated student IDs for today"""
+        return f"STU_{datetime.now().strftime('%Y%m%d')}_"
+
     def setup_camera(self):
         """Setup camera source"""
         print("\nSelect camera source:")
@@ -88,8 +101,10 @@ class OptiGradeFullyAuto:
             print("\nTo use your mobile device, install an IP camera app (e.g., IP Webcam for Android, EpocCam for iOS).\n"
                   "Connect your phone and computer to the same Wi-Fi network. Start the camera server on your phone and enter the video stream URL below (e.g., http://192.168.1.100:8080/video):")
             ip_camera_url = input("Enter the IP camera stream URL: ").strip()
+            self.camera_source = ip_camera_url
             cap = cv2.VideoCapture(ip_camera_url)
         else:
+            self.camera_source = '0'
             cap = cv2.VideoCapture(0)
 
         if not cap.isOpened():
@@ -98,140 +113,38 @@ class OptiGradeFullyAuto:
 
         return cap
 
-    def process_omr_sheet_simplified(self, frame):
+    def process_omr_sheet_simplified(self, frame, confidence=None):
         """
         Process OMR sheet to detect marked answers using simplified logic from OptiGrade.py.
         Returns list of detected answers (A, B, C, D, E, etc.) or None if failed.
+        A dict passed as confidence receives the measurements for assess_confidence.
         """
-        # Convert to grayscale
-        gray = cv2.cvtColor(frame, cv2.COLOR_BGR2GRAY)
-
-        # Apply Gaussian blur to reduce noise
-        blurred = cv2.GaussianBlur(gray, (5, 5), 0)
-
-        # Apply threshold to get binary image
-        _, thresh = cv2.threshold(blurred, 0, 255, cv2.THRESH_BINARY_INV + cv2.THRESH_OTSU)
-
-        # Find contours
-        contours, _ = cv2.findContours(thresh, cv2.RETR_EXTERNAL, cv2.CHAIN_APPROX_SIMPLE)
-
-        # Filter contours to find potential bubbles
-        bubbles = []
-        for contour in contours:
-            area = cv2.contourArea(contour)
-            # Adjust these values based on your OMR sheet and camera setup
-            if 100 < area < 5000: 
-                x, y, w, h = cv2.boundingRect(contour)
-                aspect_ratio = w / float(h)
-                if 0.8 < aspect_ratio < 1.2:  # Roughly circular
-                    bubbles.append((x, y, w, h, area))
-
-        # Check if we found enough bubbles. Allow some tolerance.
-        expected_min_bubbles = int(self.num_questions * self.num_options * 0.8) # 80% of expected
-        if len(bubbles) < expected_min_bubbles:
-            # print(f"Warning: Found {len(bubbles)} bubbles, expected at least {expected_min_bubbles}")
-            return None
-
-        # Sort bubbles by position (top to bottom, then left to right)
-        # This is crucial for grouping bubbles into questions
-        bubbles.sort(key=lambda b: (b[1] // 50, b[0])) # Group by approximate row (y // 50) then x
-
-        # Group bubbles by questions
-        detected_answers = []
-        options_chars = [chr(65 + i) for i in range(self.num_options)]
-
-        for q_idx in range(self.num_questions):
-            # Attempt to get bubbles for the current question
-            # This is a simplified approach and might need refinement for complex layouts
-            question_bubbles_candidates = []
-            
-            # Heuristic: Find bubbles that are roughly on the same 'row' as the first bubble of the question
-            # This part is a simplification and might need to be more robust
-            if q_idx * self.num_options < len(bubbles):
-                first_bubble_y = bubbles[q_idx * self.num_options][1]
-                # Collect bubbles that are within a certain vertical range (e.g., 30 pixels)
-                question_bubbles_candidates = [
-                    b for b in bubbles if abs(b[1] - first_bubble_y) < 30
-                ]
-                # Sort these candidates by x-coordinate to get options in order (A, B, C, D, E)
-                question_bubbles_candidates.sort(key=lambda b: b[0])
-            
-            # Take only the first 'num_options' bubbles for this question
-            question_bubbles = question_bubbles_candidates[:self.num_options]
-
-            if len(question_bubbles) < self.num_options:
-                detected_answers.append('X')  # Not enough options detected for this question
-                continue
-
-            # Find the bubble with the most filled area (darkest) for the current question
-            max_filled_intensity = 256 # Initialize with a value higher than max pixel intensity (255)
-            selected_option_char = 'X'
-
-            for i, (x, y, w, h, area) in enumerate(question_bubbles):
-                if i < len(options_chars):
-                    roi = gray[y:y+h, x:x+w]
-                    if roi.size > 0:
-                        # Calculate the average intensity in the bubble region
-                        # Lower intensity means darker (more filled)
-                        avg_intensity = np.mean(roi)
-                        if avg_intensity < max_filled_intensity:
-                            max_filled_intensity = avg_intensity
-                            selected_option_char = options_chars[i]
-            
-            # A simple threshold to decide if a bubble is truly marked (e.g., avg intensity below 100)
-            if max_filled_intensity < 100: # This threshold might need tuning
-                detected_answers.append(selected_option_char)
-            else:
-                detected_answers.append('X') # Considered unmarked
-
-        return detected_answers
+        if (self.frame_processor is None or self.frame_processor.num_questions != self.num_questions
+                or self.frame_processor.num_options != self.num_options):
+            self.frame_processor = self.create_frame_processor()
+        return self.frame_processor.detect(frame, confidence)
+
+    def create_frame_processor(self):
+        """Create the detection context, using a tuned profile for this camera or assignment if saved"""
+        params = self.db.get_detection_profile(self.assignment_id, self.camera_source)
+        if params:
+            print("[INFO] Using saved detection profile.")
+        return FrameProcessor(self.num_questions, self.num_options, params)
 
     def grade_answers_simplified(self, detected_answers, answer_key):
         """
         Grade the detected answers against the answer key using simplified logic from OptiGrade.py.
         Returns score as percentage and number of correct answers.
         """
-        correct_count = 0
-        total_questions = len(answer_key) # Use the length of the answer key as total questions
-        
-        # Ensure detected_answers has enough elements to compare
-        min_len = min(len(detected_answers), total_questions)
+        return grade_answers(detected_answers, answer_key)
 
-        for i in range(min_len):
-            # Access answer key by index, as it's a list of characters
-            if detected_answers[i] == answer_key[i]:
-                correct_count += 1
-        
-        if total_questions == 0:
-            score = 0.0
-        else:
-            score = (correct_count / float(total_questions)) * 100
-        
-        return score, correct_count
+    def build_detailed_results(self, detected_answers, answer_key):
+        """Build the question-by-question rows stored in detailed_results"""
+        return build_detailed_results(detected_answers, answer_key)
 
     def save_result_image(self, frame, score, student_id):
         """Save the result image with score overlay"""
-        try:
-            # Create images directory if it doesn't exist
-            os.makedirs('images', exist_ok=True)
-
-            # Create a copy to draw on
-            display_image = frame.copy()
-            
-            # Add score text to image
-            cv2.putText(display_image, f"Score: {score:.2f}%", (10, 30), cv2.FONT_HERSHEY_SIMPLEX, 0.9, (0, 0, 255), 2)
-            cv2.putText(display_image, f"Student ID: {student_id}", (10, 70), cv2.FONT_HERSHEY_SIMPLEX, 0.7, (0, 0, 255), 2)
-
-            # Save image with timestamp and student ID
-            timestamp = datetime.now().strftime('%Y%m%d_%H%M%S')
-            image_path = f"images/omr_result_{student_id}_{timestamp}.jpg"
-            cv2.imwrite(image_path, display_image)
-
-            return image_path
-
-        except Exception as e:
-            print(f"Error saving image: {e}")
-            return None
+        return save_result_image(frame, score, student_id)
 
     def auto_scan_loop(self, cap):
         """Main auto-scanning loop - fully automatic"""
@@ -244,109 +157,127 @@ class OptiGradeFullyAuto:
         print("=" * 50)
 
         detection_count = 0
+        self.frame_processor = self.create_frame_processor()
+
+        # Results go to the local journal; a background thread loads them into the database
+        journal = ResultJournal(fsync=self.journal_fsync)
+        ingester = JournalIngester(self.db, journal)
+        ingester.start()
+
+        # Continue numbering after students already scanned today so IDs are not reused; seeded after
+        # the replay above, and results still waiting or quarantined in the journal count as well
+        prefix = self.student_id_prefix()
+        self.student_counter = max(self.db.get_max_student_number(prefix),
+                                   max_student_number(journal.path, prefix, ingester.offset),
+                                   max_student_number(ingester.quarantine_path, prefix)) + 1
+
+        preview = PreviewRenderer('OptiGrade Fully Automatic Scanner', self.preview_width, self.preview_fps,
+                                  self.result_display_seconds)
 
         while True: # Continuous scanning without pause/resume
-            ret, frame = cap.read()
+            # Frames are read into the same buffer every time
+            ret, frame = self.frame_processor.read(cap)
             if not ret:
                 print("[ERROR] Failed to grab frame.")
                 break
 
-            # Create display frame
-            display_frame = frame.copy()
-
-            # Check if enough time has passed since last processing
+            # Check if enough time has passed since last processing; while a result is on
+            # screen the sheet is usually still in view, so it is not detected again
             current_time = time.time()
-            if current_time - self.last_detection_time > self.detection_cooldown:
+            if (current_time - self.last_detection_time > self.detection_cooldown
+                    and not preview.result_active(current_time)):
                 
                 # Use the simplified processing function
-                detected_answers = self.process_omr_sheet_simplified(frame)
+                confidence = {}
+                detected_answers = self.process_omr_sheet_simplified(frame, confidence)
 
                 if detected_answers:
-                    # Check if we have valid answers (not all 'X')
-                    # This threshold can be adjusted
-                    valid_answers_count = sum(1 for ans in detected_answers if ans != 'X')
-                    if valid_answers_count >= self.num_questions * 0.5: # At least 50% of questions answered
-                        detection_count += 1
-                        self.last_detection_time = current_time
-
-                        print(f"\n🎯 OMR Sheet #{detection_count} detected and processed!")
-                        
-                        # Grade the answers using the simplified grading function
-                        # self.answer_key is a dictionary, convert to list of values for simplified grading
-                        answer_key_list = [self.answer_key[i] for i in sorted(self.answer_key.keys())]
-                        score, correct = self.grade_answers_simplified(detected_answers, answer_key_list)
-
-                        # Auto-generate student information
-                        student_name = f"Student_{self.student_counter:03d}"
-                        student_id = f"STU_{datetime.now().strftime('%Y%m%d')}_{self.student_counter:03d}"
-
-                        # Save result image (using the original frame for simplicity)
-                        image_path = self.save_result_image(frame, score, student_id)
-
-                        # Display results (simplified version)
-                        print(f"\n" + "=" * 30)
-                        print("AUTOMATIC GRADING RESULTS")
-                        print("=" * 30)
-                        print(f"Student: {student_name} (ID: {student_id})")
-                        print(f"Score: {score:.2f}%")
-                        print(f"Correct Answers: {correct}/{self.num_questions}")
-                        
-                        # Display simplified detected answers
-                        print("\nFINAL DETECTED ANSWERS:")
-                        print("-" * 30)
-                        for i, answer in enumerate(detected_answers, 1):
-                            print(f"Q{i}: {answer}")
-                        print("-" * 30)
-
-                        # Save to database
-                        if self.assignment_id:
-                            session_id = self.db.save_grading_result(
-                                assignment_id=self.assignment_id,
-                                student_name=student_name,
-                                student_id=student_id,
-                                score=score,
-                                correct_answers=correct,
-                                total_questions=self.num_questions,
-                                image_path=image_path,
-                                # Detailed results are not generated by simplified grading, pass empty list
-                                detailed_results=[] 
-                            )
-
-                            if session_id:
-                                print(f"\nResults saved to database with session ID: {session_id}")
-                            else:
-                                print("\nError saving results to database.")
-
-                        self.student_counter += 1
-                        print(f"\n[SUCCESS] Sheet {detection_count} processed automatically!")
-                        print("Place next sheet or press 'q' to quit.")
-
-                        # Show the frame with results for a short duration
-                        for _ in range(90):  # 3 seconds at ~30 fps
-                            cv2.imshow('OptiGrade Fully Automatic Scanner', display_frame)
-                            if cv2.waitKey(33) & 0xFF == ord('q'):
-                                break
-                    else:
-                        # Draw "No valid OMR detected" on frame if not enough valid answers
-                        cv2.putText(display_frame, "No valid OMR detected", (10, 30),
-                                   cv2.FONT_HERSHEY_SIMPLEX, 0.7, (0, 0, 255), 2)
-                        print("[INFO] No valid OMR detected. Waiting for next frame...")
+                    # Every detected sheet is graded right away; sheets with few answers or
+                    # ambiguous marks are also queued for review instead of being re-presented
+                    detection_count += 1
+                    self.last_detection_time = current_time
+
+                    print(f"\n🎯 OMR Sheet #{detection_count} detected and processed!")
+                    
+                    # Grade the answers using the simplified grading function
+                    # self.answer_key is a dictionary, convert to list of values for simplified grading
+                    answer_key_list = [self.answer_key[i] for i in sorted(self.answer_key.keys())]
+                    score, correct = self.grade_answers_simplified(detected_answers, answer_key_list)
+
+                    # Auto-generate student information
+                    student_name = f"Student_{self.student_counter:03d}"
+                    student_id = f"{self.student_id_prefix()}{self.student_counter:03d}"
+
+                    # Save result image (using the original frame for simplicity)
+                    image_path = self.save_result_image(frame, score, student_id)
+
+                    # Low-confidence sheets get a crop of their bubble area for the review queue
+                    assessment = assess_confidence(detected_answers, confidence, self.frame_processor.params)
+                    review = None
+                    if assessment['needs_review']:
+                        review = {
+                            'reasons': assessment['reasons'],
+                            'questions': assessment['ambiguous_questions'],
+                            'crop_path': save_review_crop(frame, confidence['bounds'], student_id),
+                        }
+
+                    # Display results (simplified version)
+                    print(f"\n" + "=" * 30)
+                    print("AUTOMATIC GRADING RESULTS")
+                    print("=" * 30)
+                    print(f"Student: {student_name} (ID: {student_id})")
+                    print(f"Score: {score:.2f}%")
+                    print(f"Correct Answers: {correct}/{self.num_questions}")
+                    
+                    # Display simplified detected answers
+                    print("\nFINAL DETECTED ANSWERS:")
+                    print("-" * 30)
+                    for i, answer in enumerate(detected_answers, 1):
+                        print(f"Q{i}: {answer}")
+                    print("-" * 30)
+
+                    # Save to the journal, the ingester commits it to the database
+                    if self.assignment_id:
+                        try:
+                            journal.append({
+                                'assignment_id': self.assignment_id,
+                                'student_name': student_name,
+                                'student_id': student_id,
+                                'score': score,
+                                'correct_answers': correct,
+                                'total_questions': self.num_questions,
+                                'image_path': image_path,
+                                'detailed_results': self.build_detailed_results(detected_answers, answer_key_list),
+                                'review': review,
+                            })
+                            print("\nResults saved to the result journal.")
+                        except Exception as e:
+                            print(f"\nError saving results to the result journal: {e}")
+
+                    if review:
+                        print(f"[REVIEW] Sheet queued for review ({', '.join(review['reasons'])})")
+
+                    self.student_counter += 1
+                    print(f"\n[SUCCESS] Sheet {detection_count} processed automatically!")
+                    print("Place next sheet or press 'q' to quit.")
+
+                    # The result stays on the live preview for a few seconds
+                    preview.show_result(frame.shape, confidence.get('question_boxes'), detected_answers,
+                                        answer_key_list, [f"Score: {score:.2f}%", f"Student ID: {student_id}"])
                 else:
-                    # Draw "Looking for OMR..." on frame
-                    cv2.putText(display_frame, "Looking for OMR sheet...", (10, 30),
-                               cv2.FONT_HERSHEY_SIMPLEX, 0.7, (255, 255, 0), 2)
                     print("[INFO] Looking for OMR sheet...")
-            
-            # Show the live frame
-            cv2.imshow("OptiGrade Fully Automatic Scanner", display_frame)
 
-            # Handle key presses
-            key = cv2.waitKey(1) & 0xFF
+            # Show the live frame (downscaled, at most preview_fps times per second)
+            key = preview.render(frame, "Looking for OMR sheet...") & 0xFF
             if key == ord('q'):
                 break
 
         cap.release()
-        cv2.destroyAllWindows()
+        preview.close()
+
+        ingester.stop()
+        journal.close()
+        print(f"[INFO] {ingester.ingested} result(s) loaded into the database.")
         print(f"\n[INFO] Fully automatic scanning completed. Total sheets processed: {detection_count}")
 
     def run_fully_auto_session(self):
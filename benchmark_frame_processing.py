@@ -0,0 +1,131 @@
+#!/usr/bin/env python3
+"""
+Frame processing benchmark for OptiGrade.
+
+Feeds synthetic sheet frames through the scanner's per-frame work twice:
+the original allocating path (frame.copy() + detect_answers) and the
+buffer-reusing FrameProcessor path. Each mode runs in its own process so the
+reported peak RSS is not shared between them.
+
+Usage:
+    python benchmark_frame_processing.py --frames 300 --width 1920 --height 1080
+"""
+
+import argparse
+import multiprocessing as mp
+import resource
+import time
+import tracemalloc
+
+import cv2
+import numpy as np
+
+from omr_detector import FrameProcessor, detect_answers
+
+
+def make_sheet_frame(width, height, num_questions, num_options, seed=0):
+    """Draw a white sheet with a bubble grid and one filled bubble per question"""
+    rng = np.random.default_rng(seed)
+    frame = np.full((height, width, 3), 255, dtype=np.uint8)
+    spacing = min(60, (height - 40) // max(num_questions, 1))
+    radius = max(6, spacing // 3)
+    for q in range(num_questions):
+        y = 40 + q * spacing
+        marked = rng.integers(num_options)
+        for option in range(num_options):
+            x = 100 + option * spacing
+            thickness = -1 if option == marked else 2
+            cv2.circle(frame, (x, y), radius, (0, 0, 0), thickness)
+    return frame
+
+
+class FrameSource:
+    """Stands in for cv2.VideoCapture; read(image) copies into the caller's buffer like OpenCV does"""
+
+    def __init__(self, frames):
+        self.frames = frames
+        self.position = 0
+
+    def read(self, image=None):
+        source = self.frames[self.position % len(self.frames)]
+        self.position += 1
+        if image is None or image.shape != source.shape:
+            return True, source.copy()
+        np.copyto(image, source)
+        return True, image
+
+
+def draw_status(display_frame):
+    """Same status overlay the scanner draws on every frame"""
+    cv2.putText(display_frame, "Looking for OMR sheet...", (10, 30),
+                cv2.FONT_HERSHEY_SIMPLEX, 0.7, (255, 255, 0), 2)
+
+
+def run_mode(mode, frames, num_questions, num_options, num_frames, results):
+    """Process num_frames frames in one mode and report timing and allocation figures"""
+    source = FrameSource(frames)
+    processor = FrameProcessor(num_questions, num_options)
+
+    def step():
+        if mode == 'baseline':
+            _, frame = source.read()
+            display_frame = frame.copy()
+            detect_answers(frame, num_questions, num_options)
+        else:
+            _, frame = processor.read(source)
+            display_frame = frame
+            processor.detect(frame)
+        draw_status(display_frame)
+
+    step()  # warm up buffers and OpenCV internals
+
+    tracemalloc.start()
+    tracemalloc.reset_peak()
+    start = time.perf_counter()
+    allocated = 0
+    for _ in range(num_frames):
+        before, _ = tracemalloc.get_traced_memory()
+        step()
+        after, peak = tracemalloc.get_traced_memory()
+        allocated += max(peak - before, 0)
+        tracemalloc.reset_peak()
+    elapsed = time.perf_counter() - start
+    tracemalloc.stop()
+
+    results.put({
+        'mode': mode,
+        'ms_per_frame': elapsed / num_frames * 1000,
+        'mb_allocated_per_frame': allocated / num_frames / 1e6,
+        'peak_rss_mb': resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024,
+    })
+
+
+def main():
+    """Command line entry point"""
+    parser = argparse.ArgumentParser(description='Benchmark OptiGrade per-frame processing')
+    parser.add_argument('--frames', type=int, default=300)
+    parser.add_argument('--width', type=int, default=1920)
+    parser.add_argument('--height', type=int, default=1080)
+    parser.add_argument('--questions', type=int, default=15)
+    parser.add_argument('--options', type=int, default=5)
+    args = parser.parse_args()
+
+    frames = [make_sheet_frame(args.width, args.height, args.questions, args.options, seed)
+              for seed in range(4)]
+    results = mp.Queue()
+
+    print(f"{args.frames} frames at {args.width}x{args.height}, "
+          f"{args.questions} questions x {args.options} options")
+    print(f"{'mode':<12}{'ms/frame':>10}{'MB alloc/frame':>16}{'peak RSS MB':>14}")
+    for mode in ('baseline', 'reused'):
+        process = mp.Process(target=run_mode,
+                             args=(mode, frames, args.questions, args.options, args.frames, results))
+        process.start()
+        report = results.get()
+        process.join()
+        print(f"{report['mode']:<12}{report['ms_per_frame']:>10.2f}"
+              f"{report['mb_allocated_per_frame']:>16.2f}{report['peak_rss_mb']:>14.1f}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,252 @@
+#!/usr/bin/env python3
+"""
+Answer-similarity (collusion) detection for OptiGrade assignments.
+
+Every student's wrong answers are packed into a bit-vector with one bit per
+(question, option) pair, so the number of identical wrong answers two
+students share is the popcount of the AND of their vectors. Two search
+modes produce the suspicious pairs:
+
+- exact: blocks of rows are compared against all later rows with vectorized
+  popcount, spread over a process pool (O(N^2) but with tiny constants)
+- lsh: MinHash signatures of the wrong-answer sets are split into bands;
+  only students sharing a band bucket become candidates, which are then
+  verified with the same popcount
+
+Pairs are ranked by the rarity of the wrong answers they share (the sum of
+-log2 of each shared wrong option's frequency), so two students picking the
+same unpopular distractor weigh more than a common misconception.
+
+Usage:
+    python collusion_detection.py 3 --min-shared 4 --top 20
+    python collusion_detection.py 3 --mode lsh --bands 16 --rows 4
+    python collusion_detection.py 3 --workers 8
+"""
+
+import argparse
+import os
+from concurrent.futures import ProcessPoolExecutor
+from typing import Dict, List, Tuple
+
+import numpy as np
+
+from item_analysis import BLANK
+
+DEFAULT_MIN_SHARED_WRONG = 3
+DEFAULT_BLOCK_BYTES = 64 * 1024 * 1024  # Memory of one AND block in exact mode
+DEFAULT_MAX_CANDIDATES = 5000  # Pairs with the most shared wrong answers kept per block
+
+# Popcount of every byte, used when NumPy has no bitwise_count (before 2.0)
+_BYTE_POPCOUNT = np.array([bin(i).count('1') for i in range(256)], dtype=np.uint8)
+
+# Packed matrix shared with the worker processes
+_packed = None
+
+
+def popcount_rows(words: np.ndarray) -> np.ndarray:
+    """Number of set bits along the last axis of a uint64 array"""
+    if hasattr(np, 'bitwise_count'):
+        return np.bitwise_count(words).sum(axis=-1, dtype=np.int32)
+    bytes_view = words.view(np.uint8).reshape(*words.shape[:-1], -1)
+    return _BYTE_POPCOUNT[bytes_view].sum(axis=-1, dtype=np.int32)
+
+
+def pack_bits(bits: np.ndarray) -> np.ndarray:
+    """Pack a boolean (rows, bits) matrix into uint64 words per row"""
+    packed = np.packbits(bits, axis=1)
+    padding = -packed.shape[1] % 8
+    if padding:
+        packed = np.pad(packed, ((0, 0), (0, padding)))
+    return np.ascontiguousarray(packed).view(np.uint64)
+
+
+def answered_mask(choices: np.ndarray, num_options: int) -> np.ndarray:
+    """Where a student marked one of the sheet's options (blanks and 'X' are BLANK or out of range)"""
+    return (choices != BLANK) & (choices >= 0) & (choices < num_options)
+
+
+def wrong_answer_bits(choices: np.ndarray, answer_key: np.ndarray, num_options: int) -> np.ndarray:
+    """(students, questions * options) bools, set where a student picked that wrong option; blanks never count"""
+    num_students, num_questions = choices.shape
+    wrong = (choices != answer_key[np.newaxis, :]) & answered_mask(choices, num_options) \
+        & (answer_key[np.newaxis, :] >= 0)
+    bits = np.zeros((num_students, num_questions * num_options), dtype=bool)
+    rows, questions = np.nonzero(wrong)
+    bits[rows, questions * num_options + choices[rows, questions]] = True
+    return bits
+
+
+def _init_worker(packed: np.ndarray):
+    global _packed
+    _packed = packed
+
+
+def strongest(found: np.ndarray, limit: int) -> np.ndarray:
+    """The limit (i, j, shared) rows with the most shared wrong answers"""
+    if len(found) <= limit:
+        return found
+    return found[np.argpartition(-found[:, 2], limit - 1)[:limit]]
+
+
+def _compare_block(task: Tuple[int, int, int, int]) -> np.ndarray:
+    """Shared wrong answers of rows [start, stop) with every later row (runs in a worker)"""
+    start, stop, min_shared, limit = task
+    block = _packed[start:stop]
+    others = _packed[start:]
+    shared = popcount_rows(block[:, np.newaxis, :] & others[np.newaxis, :, :])
+    # Keep the upper triangle only: row start + i against row start + j with j > i
+    shared[np.tril_indices(stop - start, m=len(others))] = 0
+    rows, columns = np.nonzero(shared >= min_shared)
+    return strongest(np.column_stack([rows + start, columns + start, shared[rows, columns]]).astype(np.int64),
+                     limit)
+
+
+def exact_pairs(packed: np.ndarray, min_shared: int, workers: int = None,
+                block_bytes: int = DEFAULT_BLOCK_BYTES, limit: int = DEFAULT_MAX_CANDIDATES) -> np.ndarray:
+    """Pairs sharing at least min_shared wrong answers as (i, j, shared) rows, at most limit per block"""
+    num_students, num_words = packed.shape
+    rows_per_block = max(1, block_bytes // max(1, num_students * num_words * 8))
+    tasks = [(start, min(start + rows_per_block, num_students), min_shared, limit)
+             for start in range(0, num_students, rows_per_block)]
+
+    workers = workers or os.cpu_count() or 1
+    if workers == 1 or len(tasks) == 1:
+        _init_worker(packed)
+        results = [_compare_block(task) for task in tasks]
+    else:
+        with ProcessPoolExecutor(max_workers=workers, initializer=_init_worker, initargs=(packed,)) as pool:
+            results = list(pool.map(_compare_block, tasks))
+
+    if not results:
+        return np.zeros((0, 3), dtype=np.int64)
+    return np.concatenate(results)
+
+
+def minhash_signatures(bits: np.ndarray, num_hashes: int, seed: int = 0) -> np.ndarray:
+    """MinHash of every row's set bits under num_hashes random permutations"""
+    rng = np.random.default_rng(seed)
+    num_students, num_bits = bits.shape
+    signatures = np.empty((num_students, num_hashes), dtype=np.int32)
+    empty = np.int32(num_bits)
+    for h in range(num_hashes):
+        permutation = rng.permutation(num_bits).astype(np.int32)
+        signatures[:, h] = np.where(bits, permutation[np.newaxis, :], empty).min(axis=1, initial=empty)
+    return signatures
+
+
+def lsh_candidates(bits: np.ndarray, min_shared: int, bands: int, rows: int, seed: int = 0) -> np.ndarray:
+    """Candidate pairs whose MinHash signatures agree on at least one band"""
+    # Students with fewer wrong answers than min_shared cannot form a pair
+    eligible = np.flatnonzero(bits.sum(axis=1) >= min_shared)
+    if len(eligible) < 2:
+        return np.zeros((0, 2), dtype=np.int64)
+    signatures = minhash_signatures(bits[eligible], bands * rows, seed)
+
+    candidates = set()
+    for band in range(bands):
+        buckets = {}
+        band_signatures = signatures[:, band * rows:(band + 1) * rows]
+        for index, key in enumerate(map(bytes, band_signatures)):
+            buckets.setdefault(key, []).append(index)
+        for members in buckets.values():
+            for a in range(len(members)):
+                for b in range(a + 1, len(members)):
+                    candidates.add((members[a], members[b]))
+    if not candidates:
+        return np.zeros((0, 2), dtype=np.int64)
+    pairs = np.array(sorted(candidates), dtype=np.int64)
+    return eligible[pairs]
+
+
+def verify_pairs(packed: np.ndarray, pairs: np.ndarray, min_shared: int) -> np.ndarray:
+    """Exact shared wrong answers of candidate pairs, keeping those with at least min_shared"""
+    if not len(pairs):
+        return np.zeros((0, 3), dtype=np.int64)
+    shared = popcount_rows(packed[pairs[:, 0]] & packed[pairs[:, 1]])
+    keep = shared >= min_shared
+    return np.column_stack([pairs[keep], shared[keep]]).astype(np.int64)
+
+
+def find_similar_pairs(choices: np.ndarray, answer_key: np.ndarray, num_options: int = None,
+                       min_shared: int = DEFAULT_MIN_SHARED_WRONG, mode: str = 'exact',
+                       workers: int = None, bands: int = 16, rows: int = 4, top: int = 50,
+                       seed: int = 0) -> List[Dict]:
+    """
+    Rank pairs of students (row indexes of choices) by the wrong answers they share.
+    Returns dicts with both rows, shared wrong and identical answers, each student's
+    wrong count and the rarity score, most suspicious first.
+    """
+    num_students, num_questions = choices.shape
+    if num_options is None:
+        num_options = int(max(choices.max(initial=0), answer_key.max(initial=0))) + 1
+
+    bits = wrong_answer_bits(choices, answer_key, num_options)
+    packed = pack_bits(bits)
+    # Large classes share a few wrong answers by chance everywhere; only the strongest pairs are ranked
+    limit = max(DEFAULT_MAX_CANDIDATES, top * 20)
+    if mode == 'lsh':
+        found = verify_pairs(packed, lsh_candidates(bits, min_shared, bands, rows, seed), min_shared)
+    else:
+        found = exact_pairs(packed, min_shared, workers, limit=limit)
+    found = strongest(found, limit)
+    if not len(found):
+        return []
+
+    # Rarer shared wrong options weigh more: -log2 of how often the option was chosen
+    frequency = bits.mean(axis=0)
+    rarity = -np.log2(np.where(frequency > 0, frequency, 1.0))
+    first, second = found[:, 0], found[:, 1]
+    scores = np.empty(len(found))
+    for start in range(0, len(found), 100000):
+        chunk = slice(start, start + 100000)
+        scores[chunk] = (bits[first[chunk]] & bits[second[chunk]]) @ rarity
+    order = np.lexsort((-found[:, 2], -scores))[:top]
+
+    wrong_counts = bits.sum(axis=1)
+    answered = answered_mask(choices, num_options)  # two blanks are not identical answers
+    pairs = []
+    for index in order:
+        i, j = int(first[index]), int(second[index])
+        pairs.append({
+            'row_a': i,
+            'row_b': j,
+            'shared_wrong': int(found[index, 2]),
+            'identical_answers': int(((choices[i] == choices[j]) & answered[i] & answered[j]).sum()),
+            'wrong_a': int(wrong_counts[i]),
+            'wrong_b': int(wrong_counts[j]),
+            'rarity': float(scores[index]),
+        })
+    return pairs
+
+
+def main():
+    """Command line entry point"""
+    from database_manager import OptiGradeDatabase
+
+    parser = argparse.ArgumentParser(description='Find students with suspiciously similar answers')
+    parser.add_argument('assignment_id', type=int)
+    parser.add_argument('--db', default='data/optigrade.db', help='database path')
+    parser.add_argument('--mode', choices=('exact', 'lsh'), default='exact')
+    parser.add_argument('--min-shared', type=int, default=DEFAULT_MIN_SHARED_WRONG,
+                        help='identical wrong answers needed to report a pair')
+    parser.add_argument('--top', type=int, default=20, help='pairs to show')
+    parser.add_argument('--workers', type=int, default=None, help='processes (default: CPU count)')
+    parser.add_argument('--bands', type=int, default=16, help='LSH bands')
+    parser.add_argument('--rows', type=int, default=4, help='MinHash values per LSH band')
+    args = parser.parse_args()
+
+    db = OptiGradeDatabase(args.db)
+    pairs = db.get_similar_answer_pairs(args.assignment_id, min_shared=args.min_shared, mode=args.mode,
+                                        workers=args.workers, bands=args.bands, rows=args.rows, top=args.top)
+    if not pairs:
+        print("No suspicious pairs found.")
+        return
+    print(f"{'Student A':<22} {'Student B':<22} {'Shared wrong':>14} {'Identical':>10} {'Rarity':>8}")
+    for pair in pairs:
+        shared = f"{pair['shared_wrong']} of {min(pair['wrong_a'], pair['wrong_b'])}"
+        print(f"{pair['student_a']:<22} {pair['student_b']:<22} {shared:>14} "
+              f"{pair['identical_answers']:>10} {pair['rarity']:>8.1f}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,367 @@
+#!/usr/bin/env python3
+"""
+OptiGrade Database Archiving
+Moves old grading data out of the live database into yearly archive databases.
+
+Sessions processed before a cutoff, or belonging to closed assignments, are
+copied together with their detailed results into data/archive/optigrade_archive_<year>.db
+(same schema as the live database, so it can be opened with OptiGradeDatabase)
+and deleted from the live database. Their result images are downscaled and
+recompressed into images/archive and image_path is rewritten accordingly.
+
+The work is done in small batches, each in its own short transaction, with a
+pause in between so scanners keep writing while archiving runs. Freed pages
+are returned to the file system with incremental vacuum after every batch.
+Archives can be sealed with gzip once a year is complete.
+
+Review queue entries, journal bookkeeping and regrade audits of the
+sessions move along with them. Student rollups in the live database are
+recomputed for the affected students in the same transaction, so they
+summarise the sessions that are still live (like every other rollup refresh);
+each archive gets rollups of its own sessions.
+
+Usage:
+    python database_archive.py --older-than 365
+    python database_archive.py --closed --seal
+    python database_archive.py --assignment 4 --assignment 7
+    python database_archive.py --compact-only --full-vacuum
+"""
+
+import argparse
+import gzip
+import os
+import shutil
+import sqlite3
+import time
+from typing import Dict, List, Optional
+
+from database_setup import create_database, refresh_student_rollups
+
+ARCHIVE_DIR = 'data/archive'
+ARCHIVE_IMAGE_DIR = 'images/archive'
+DEFAULT_BATCH_SIZE = 200
+DEFAULT_PAUSE = 0.2  # Seconds between batches, leaves the database to the scanners
+IMAGE_MAX_WIDTH = 800
+IMAGE_JPEG_QUALITY = 60
+VACUUM_PAGES_PER_BATCH = 1000
+
+ASSIGNMENT_COLUMNS = ('id, assignment_name, num_questions, answer_key, created_at, updated_at, closed_at, '
+                      'num_options')
+SESSION_COLUMNS = ('id, assignment_id, student_name, student_id, score, correct_answers, '
+                   'total_questions, image_path, processed_at')
+DETAILED_COLUMNS = 'id, session_id, question_number, correct_answer, student_answer, is_correct'
+REVIEW_COLUMNS = ('session_id, reasons, questions, crop_path, status, resolution_note, created_at, '
+                  'resolved_at')
+JOURNAL_COLUMNS = 'uid, session_id, ingested_at'
+HISTORY_COLUMNS = ('id, assignment_id, old_answer_key, new_answer_key, changed_questions, reason, '
+                   'sessions_regraded, sessions_changed, created_at')
+AUDIT_COLUMNS = ('regrade_id, session_id, old_score, old_correct_answers, new_score, '
+                 'new_correct_answers')
+
+
+def archive_path_for(archive_dir: str, processed_at: Optional[str]) -> str:
+    """Archive database holding sessions processed in the given year"""
+    year = (processed_at or '')[:4]
+    return os.path.join(archive_dir, f"optigrade_archive_{year if year.isdigit() else 'undated'}.db")
+
+
+def seal_archive(path: str) -> Optional[str]:
+    """Compress an archive database with gzip and remove the uncompressed file"""
+    if not os.path.exists(path):
+        return None
+    sealed_path = path + '.gz'
+    with open(path, 'rb') as source, gzip.open(sealed_path, 'wb') as target:
+        shutil.copyfileobj(source, target)
+    os.remove(path)
+    return sealed_path
+
+
+def unseal_archive(path: str) -> bool:
+    """Restore a sealed archive so more sessions can be added or it can be queried"""
+    sealed_path = path + '.gz'
+    if os.path.exists(path) or not os.path.exists(sealed_path):
+        return False
+    with gzip.open(sealed_path, 'rb') as source, open(path, 'wb') as target:
+        shutil.copyfileobj(source, target)
+    os.remove(sealed_path)
+    return True
+
+
+def recompress_image(image_path: str, image_dir: str, max_width: int = IMAGE_MAX_WIDTH,
+                     quality: int = IMAGE_JPEG_QUALITY) -> Optional[str]:
+    """Store a downscaled, recompressed JPEG copy of a result image; returns its path"""
+    import cv2
+
+    image = cv2.imread(image_path)
+    if image is None:
+        return None
+
+    height, width = image.shape[:2]
+    if width > max_width:
+        image = cv2.resize(image, (max_width, round(height * max_width / width)),
+                           interpolation=cv2.INTER_AREA)
+
+    os.makedirs(image_dir, exist_ok=True)
+    name = os.path.splitext(os.path.basename(image_path))[0] + '.jpg'
+    archived_path = os.path.join(image_dir, name)
+    if not cv2.imwrite(archived_path, image, [cv2.IMWRITE_JPEG_QUALITY, quality]):
+        return None
+    return archived_path
+
+
+def _candidate_filter(older_than_days: Optional[int], include_closed: bool,
+                      assignment_ids: Optional[List[int]]):
+    """WHERE clause and parameters selecting the sessions to archive"""
+    conditions = []
+    params = []
+    if older_than_days is not None:
+        conditions.append("gs.processed_at < datetime('now', ?)")
+        params.append(f'-{int(older_than_days)} days')
+    if include_closed:
+        conditions.append('a.closed_at IS NOT NULL')
+    if assignment_ids:
+        conditions.append(f"gs.assignment_id IN ({', '.join('?' * len(assignment_ids))})")
+        params.extend(assignment_ids)
+    return ' OR '.join(conditions), params
+
+
+def _move_batch(conn, archive_path: str, rows: List[sqlite3.Row], image_paths: Dict[int, str]):
+    """Copy one batch of sessions into an archive database and delete them from the live one"""
+    conn.execute('ATTACH DATABASE ? AS archive', (archive_path,))
+    try:
+        conn.execute('BEGIN IMMEDIATE')
+        conn.execute('CREATE TEMP TABLE IF NOT EXISTS archive_batch (id INTEGER PRIMARY KEY)')
+        conn.execute('DELETE FROM archive_batch')
+        conn.executemany('INSERT INTO archive_batch VALUES (?)', [(row['id'],) for row in rows])
+
+        # OR REPLACE and the delete below make a batch safe to repeat after an interruption
+        conn.execute(f'''
+            INSERT OR REPLACE INTO archive.assignments ({ASSIGNMENT_COLUMNS})
+            SELECT {ASSIGNMENT_COLUMNS} FROM main.assignments
+            WHERE id IN (SELECT assignment_id FROM main.grading_sessions
+                         WHERE id IN (SELECT id FROM archive_batch))
+        ''')
+        conn.execute(f'''
+            INSERT OR REPLACE INTO archive.grading_sessions ({SESSION_COLUMNS})
+            SELECT {SESSION_COLUMNS} FROM main.grading_sessions
+            WHERE id IN (SELECT id FROM archive_batch)
+        ''')
+        conn.execute('DELETE FROM archive.detailed_results WHERE session_id IN (SELECT id FROM archive_batch)')
+        conn.execute(f'''
+            INSERT INTO archive.detailed_results ({DETAILED_COLUMNS})
+            SELECT {DETAILED_COLUMNS} FROM main.detailed_results
+            WHERE session_id IN (SELECT id FROM archive_batch)
+        ''')
+        conn.executemany('UPDATE archive.grading_sessions SET image_path = ? WHERE id = ?',
+                         [(path, session_id) for session_id, path in image_paths.items()])
+
+        # Rows that belong to the sessions go with them
+        conn.execute(f'''
+            INSERT OR REPLACE INTO archive.review_queue ({REVIEW_COLUMNS})
+            SELECT {REVIEW_COLUMNS} FROM main.review_queue
+            WHERE session_id IN (SELECT id FROM archive_batch)
+        ''')
+        conn.execute(f'''
+            INSERT OR REPLACE INTO archive.journal_ingested ({JOURNAL_COLUMNS})
+            SELECT {JOURNAL_COLUMNS} FROM main.journal_ingested
+            WHERE session_id IN (SELECT id FROM archive_batch)
+        ''')
+        conn.execute(f'''
+            INSERT OR REPLACE INTO archive.answer_key_history ({HISTORY_COLUMNS})
+            SELECT {HISTORY_COLUMNS} FROM main.answer_key_history
+            WHERE id IN (SELECT regrade_id FROM main.regrade_audit
+                         WHERE session_id IN (SELECT id FROM archive_batch))
+        ''')
+        conn.execute(f'''
+            INSERT OR REPLACE INTO archive.regrade_audit ({AUDIT_COLUMNS})
+            SELECT {AUDIT_COLUMNS} FROM main.regrade_audit
+            WHERE session_id IN (SELECT id FROM archive_batch)
+        ''')
+        student_ids = [row[0] for row in conn.execute('''
+            SELECT DISTINCT student_id FROM main.grading_sessions
+            WHERE id IN (SELECT id FROM archive_batch) AND student_id IS NOT NULL
+        ''')]
+
+        # Cached score distributions of these assignments are no longer valid
+        conn.execute('''
+            UPDATE main.assignments SET scores_version = scores_version + 1
+            WHERE id IN (SELECT assignment_id FROM main.grading_sessions
+                         WHERE id IN (SELECT id FROM archive_batch))
+        ''')
+        for table in ('review_queue', 'journal_ingested', 'regrade_audit', 'detailed_results'):
+            conn.execute(f'DELETE FROM main.{table} WHERE session_id IN (SELECT id FROM archive_batch)')
+        conn.execute('DELETE FROM main.grading_sessions WHERE id IN (SELECT id FROM archive_batch)')
+        # Unqualified names resolve to the live database
+        refresh_student_rollups(conn.cursor(), student_ids)
+        conn.execute('COMMIT')
+    except Exception:
+        conn.execute('ROLLBACK')
+        raise
+    finally:
+        conn.execute('DETACH DATABASE archive')
+
+
+def archive_sessions(db_path: str = 'data/optigrade.db', archive_dir: str = ARCHIVE_DIR,
+                     older_than_days: Optional[int] = None, include_closed: bool = False,
+                     assignment_ids: Optional[List[int]] = None, batch_size: int = DEFAULT_BATCH_SIZE,
+                     pause: float = DEFAULT_PAUSE, image_dir: str = ARCHIVE_IMAGE_DIR,
+                     max_width: int = IMAGE_MAX_WIDTH, quality: int = IMAGE_JPEG_QUALITY,
+                     seal: bool = False) -> Dict:
+    """Move matching sessions into archive databases in small batches; returns run statistics"""
+    where, params = _candidate_filter(older_than_days, include_closed, assignment_ids)
+    stats = {'sessions': 0, 'batches': 0, 'images': 0, 'image_bytes_saved': 0,
+             'pages_freed': 0, 'archives': []}
+    if not where:
+        print("Nothing selected: give --older-than, --closed or --assignment.")
+        return stats
+
+    # Autocommit mode so every batch controls its own short transaction
+    conn = sqlite3.connect(db_path, timeout=30, isolation_level=None)
+    conn.row_factory = sqlite3.Row
+    archives = set()
+    last_id = 0
+
+    try:
+        while True:
+            rows = conn.execute(f'''
+                SELECT gs.id, gs.image_path, gs.processed_at
+                FROM grading_sessions gs
+                LEFT JOIN assignments a ON a.id = gs.assignment_id
+                WHERE gs.id > ? AND ({where})
+                ORDER BY gs.id
+                LIMIT ?
+            ''', (last_id, *params, batch_size)).fetchall()
+            if not rows:
+                break
+            last_id = rows[-1]['id']
+
+            by_archive = {}
+            for row in rows:
+                by_archive.setdefault(archive_path_for(archive_dir, row['processed_at']), []).append(row)
+
+            for archive_path, archive_rows in by_archive.items():
+                if archive_path not in archives:
+                    os.makedirs(archive_dir, exist_ok=True)
+                    unseal_archive(archive_path)
+                    create_database(archive_path, verbose=False)
+                    archives.add(archive_path)
+
+                # Images are recompressed before the transaction so it stays short
+                image_paths = {}
+                for row in archive_rows:
+                    source = row['image_path']
+                    if not source or not os.path.exists(source) or \
+                            os.path.dirname(os.path.abspath(source)) == os.path.abspath(image_dir):
+                        continue
+                    archived = recompress_image(source, image_dir, max_width, quality)
+                    if archived:
+                        image_paths[row['id']] = archived
+
+                _move_batch(conn, archive_path, archive_rows, image_paths)
+
+                # Originals are removed only once the new paths are committed
+                for row in archive_rows:
+                    archived = image_paths.get(row['id'])
+                    if archived and os.path.abspath(archived) != os.path.abspath(row['image_path']):
+                        stats['image_bytes_saved'] += os.path.getsize(row['image_path']) - os.path.getsize(archived)
+                        os.remove(row['image_path'])
+                stats['images'] += len(image_paths)
+                stats['sessions'] += len(archive_rows)
+
+            stats['batches'] += 1
+            stats['pages_freed'] += incremental_vacuum(conn, VACUUM_PAGES_PER_BATCH)
+            print(f"Archived {stats['sessions']} sessions...")
+            time.sleep(pause)
+
+        # Archives are standalone databases, so give them their own rollups
+        for archive_path in sorted(archives):
+            archive_conn = sqlite3.connect(archive_path)
+            refresh_student_rollups(archive_conn.cursor())
+            archive_conn.commit()
+            archive_conn.close()
+            stats['archives'].append(seal_archive(archive_path) if seal else archive_path)
+
+        stats['pages_freed'] += incremental_vacuum(conn)
+        return stats
+
+    except Exception as e:
+        print(f"Error archiving sessions: {e}")
+        return stats
+
+    finally:
+        conn.close()
+
+
+def incremental_vacuum(conn, pages: int = None) -> int:
+    """Release free pages of an auto_vacuum=INCREMENTAL database; returns how many were freed"""
+    if conn.execute('PRAGMA auto_vacuum').fetchone()[0] != 2:
+        return 0
+    before = conn.execute('PRAGMA freelist_count').fetchone()[0]
+    if pages is None:
+        conn.execute('PRAGMA incremental_vacuum').fetchall()
+    else:
+        conn.execute(f'PRAGMA incremental_vacuum({int(pages)})').fetchall()
+    return before - conn.execute('PRAGMA freelist_count').fetchone()[0]
+
+
+def compact_database(db_path: str = 'data/optigrade.db', full: bool = False) -> int:
+    """
+    Return free pages to the file system. A full VACUUM (needed once for databases
+    created before incremental auto-vacuum was enabled) rewrites the whole file and
+    blocks writers while it runs, so it is only done on request.
+    """
+    conn = sqlite3.connect(db_path, timeout=30, isolation_level=None)
+    try:
+        if full:
+            before = conn.execute('PRAGMA page_count').fetchone()[0]
+            conn.execute('PRAGMA auto_vacuum = INCREMENTAL')
+            conn.execute('VACUUM')
+            # Switching to incremental mode adds a few pointer-map pages
+            return max(0, before - conn.execute('PRAGMA page_count').fetchone()[0])
+
+        if conn.execute('PRAGMA auto_vacuum').fetchone()[0] != 2:
+            print("Incremental vacuum is not enabled for this database; run once with --full-vacuum.")
+            return 0
+        return incremental_vacuum(conn)
+
+    finally:
+        conn.close()
+
+
+def main():
+    """Command line entry point"""
+    parser = argparse.ArgumentParser(description='Move old OptiGrade sessions into archive databases')
+    parser.add_argument('--db', default='data/optigrade.db', help='live database path')
+    parser.add_argument('--archive-dir', default=ARCHIVE_DIR, help='where archive databases are kept')
+    parser.add_argument('--image-dir', default=ARCHIVE_IMAGE_DIR, help='where recompressed images are kept')
+    parser.add_argument('--older-than', type=int, metavar='DAYS', help='archive sessions older than DAYS')
+    parser.add_argument('--closed', action='store_true', help='archive sessions of closed assignments')
+    parser.add_argument('--assignment', type=int, action='append', help='archive this assignment (repeatable)')
+    parser.add_argument('--batch-size', type=int, default=DEFAULT_BATCH_SIZE, help='sessions per transaction')
+    parser.add_argument('--pause', type=float, default=DEFAULT_PAUSE, help='seconds between batches')
+    parser.add_argument('--max-width', type=int, default=IMAGE_MAX_WIDTH, help='archived image width')
+    parser.add_argument('--quality', type=int, default=IMAGE_JPEG_QUALITY, help='archived JPEG quality')
+    parser.add_argument('--seal', action='store_true', help='gzip archive databases when done')
+    parser.add_argument('--compact-only', action='store_true', help='only vacuum the live database')
+    parser.add_argument('--full-vacuum', action='store_true',
+                        help='rewrite the live database once to enable incremental vacuum (blocks writers)')
+    args = parser.parse_args()
+
+    if not args.compact_only:
+        stats = archive_sessions(args.db, args.archive_dir, older_than_days=args.older_than,
+                                 include_closed=args.closed, assignment_ids=args.assignment,
+                                 batch_size=args.batch_size, pause=args.pause, image_dir=args.image_dir,
+                                 max_width=args.max_width, quality=args.quality, seal=args.seal)
+        print(f"\nArchived {stats['sessions']} sessions in {stats['batches']} batches")
+        print(f"Recompressed {stats['images']} images ({stats['image_bytes_saved'] / 1024:.1f} KB saved)")
+        print(f"Released {stats['pages_freed']} database pages")
+        for archive in stats['archives']:
+            print(f"Archive: {archive}")
+
+    if args.compact_only or args.full_vacuum:
+        pages = compact_database(args.db, full=args.full_vacuum)
+        print(f"Released {pages} pages from {args.db}")
+
+
+if __name__ == "__main__":
+    main()
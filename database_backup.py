@@ -0,0 +1,352 @@
+#!/usr/bin/env python3
+"""
+OptiGrade Database Backup
+Takes consistent snapshots of the live database while scanners keep writing.
+
+Snapshots are made with SQLite's online backup API, a few hundred pages per
+step with a short pause after each step. In WAL mode (used by station mode,
+see also --wal) the copy reads one snapshot of the database, so writers
+never wait for it and their commits do not restart it. Without WAL every
+commit by another connection restarts the copy; after a few restarts the
+backup gives up instead of copying everything in one step, which would make
+the scanners wait for the whole copy. Switch the database to WAL (--wal) or
+take the snapshot while nothing is being scanned.
+
+Each snapshot is checked with PRAGMA quick_check, optionally gzipped, and
+described by a JSON manifest holding SHA-256 checksums of the database and
+of the stored file. Only the newest --keep snapshots are kept. --verify
+checks a snapshot against its manifest and runs integrity_check on it;
+--restore verifies a snapshot and puts it in place of the database, keeping
+the replaced file as <db>.before-restore.
+
+Usage:
+    python database_backup.py                          # snapshot data/optigrade.db into data/backups
+    python database_backup.py --keep 14 --pages 128 --sleep 0.1
+    python database_backup.py --list
+    python database_backup.py --verify data/backups/optigrade_20251104_180000.db.gz
+    python database_backup.py --restore data/backups/optigrade_20251104_180000.db.gz
+"""
+
+import argparse
+import glob
+import gzip
+import hashlib
+import json
+import os
+import shutil
+import sqlite3
+import time
+from datetime import datetime
+from typing import Dict, List, Optional
+
+BACKUP_DIR = 'data/backups'
+DEFAULT_PAGES_PER_STEP = 256
+DEFAULT_STEP_SLEEP = 0.05  # Seconds between backup steps, leaves the disk to the scanners
+DEFAULT_KEEP = 7
+MAX_RESTARTS = 3  # Restarts caused by other writers before a non-WAL copy gives up
+COPY_CHUNK = 1024 * 1024
+
+
+class BackupRestarted(Exception):
+    """Raised from the progress callback to stop a copy that keeps restarting"""
+
+
+def file_sha256(path: str) -> str:
+    """SHA-256 of a file, read in chunks"""
+    digest = hashlib.sha256()
+    with open(path, 'rb') as source:
+        for chunk in iter(lambda: source.read(COPY_CHUNK), b''):
+            digest.update(chunk)
+    return digest.hexdigest()
+
+
+def manifest_path_for(snapshot_path: str) -> str:
+    return snapshot_path + '.json'
+
+
+def copy_online(db_path: str, target_path: str, pages: int = DEFAULT_PAGES_PER_STEP,
+                sleep: float = DEFAULT_STEP_SLEEP, max_restarts: int = MAX_RESTARTS) -> Dict:
+    """
+    Copy a live database into target_path with the backup API; returns copy statistics.
+    Raises BackupRestarted when other writers restart a non-WAL copy more than max_restarts times.
+    """
+    source = sqlite3.connect(db_path, timeout=30, isolation_level=None)
+    target = sqlite3.connect(target_path)
+    stats = {'steps': 0, 'restarts': 0, 'pages': 0}
+
+    try:
+        wal = source.execute('PRAGMA journal_mode').fetchone()[0] == 'wal'
+        if wal:
+            # The open read transaction pins one snapshot for the whole copy
+            source.execute('BEGIN')
+            source.execute('SELECT COUNT(*) FROM sqlite_master').fetchone()
+
+        remaining_before = None
+
+        def progress(status, remaining, total):
+            nonlocal remaining_before
+            stats['steps'] += 1
+            stats['pages'] = total
+            if remaining_before is not None and remaining > remaining_before:
+                stats['restarts'] += 1
+                if stats['restarts'] > max_restarts:
+                    raise BackupRestarted(
+                        f"the copy was restarted {stats['restarts']} times by other writers; the database is not "
+                        f"in WAL mode, so run the backup with --wal (once) or while no scanner is writing")
+            remaining_before = remaining
+            if sleep:
+                time.sleep(sleep)
+
+        source.backup(target, pages=pages, progress=progress)
+
+        # The copy is a standalone file, it should not expect a -wal file next to it
+        target.execute('PRAGMA journal_mode = DELETE')
+        stats['wal'] = wal
+        return stats
+
+    finally:
+        target.close()
+        source.close()
+
+
+def snapshot_info(path: str) -> Dict:
+    """Row counts and integrity of a database file"""
+    conn = sqlite3.connect(f"file:{os.path.abspath(path)}?mode=ro", uri=True)
+    try:
+        info = {'quick_check': conn.execute('PRAGMA quick_check').fetchone()[0]}
+        tables = [row[0] for row in conn.execute("SELECT name FROM sqlite_master WHERE type = 'table'")]
+        for table in ('assignments', 'grading_sessions', 'detailed_results'):
+            if table in tables:
+                info[table] = conn.execute(f'SELECT COUNT(*) FROM {table}').fetchone()[0]
+        return info
+    finally:
+        conn.close()
+
+
+def compress_file(path: str, target_path: str, level: int = 6):
+    with open(path, 'rb') as source, gzip.open(target_path, 'wb', compresslevel=level) as target:
+        shutil.copyfileobj(source, target, COPY_CHUNK)
+
+
+def rotate_snapshots(backup_dir: str, keep: int, source: str) -> List[str]:
+    """Delete all but the newest keep snapshots of a database; returns the deleted paths"""
+    snapshots = [m for m in list_snapshots(backup_dir) if m.get('source') == source]
+    removed = []
+    for manifest in snapshots[keep:]:
+        for path in (manifest['path'], manifest_path_for(manifest['path'])):
+            if os.path.exists(path):
+                os.remove(path)
+        removed.append(manifest['path'])
+    return removed
+
+
+def backup_database(db_path: str = 'data/optigrade.db', backup_dir: str = BACKUP_DIR,
+                    pages: int = DEFAULT_PAGES_PER_STEP, sleep: float = DEFAULT_STEP_SLEEP,
+                    compress: bool = True, keep: int = DEFAULT_KEEP) -> Optional[Dict]:
+    """Write a checked, optionally compressed snapshot with its manifest; returns the manifest"""
+    if not os.path.exists(db_path):
+        print(f"Error creating backup: {db_path} does not exist")
+        return None
+
+    os.makedirs(backup_dir, exist_ok=True)
+    name = f"{os.path.splitext(os.path.basename(db_path))[0]}_{datetime.now().strftime('%Y%m%d_%H%M%S')}.db"
+    db_copy = os.path.join(backup_dir, name + '.partial')
+    snapshot_path = os.path.join(backup_dir, name + ('.gz' if compress else ''))
+
+    try:
+        started = time.perf_counter()
+        stats = copy_online(db_path, db_copy, pages, sleep)
+        copy_seconds = time.perf_counter() - started
+
+        info = snapshot_info(db_copy)
+        if info['quick_check'] != 'ok':
+            raise ValueError(f"quick_check of the copy failed: {info['quick_check']}")
+
+        manifest = {
+            'path': snapshot_path,
+            'source': os.path.abspath(db_path),
+            'created_at': datetime.now().isoformat(timespec='seconds'),
+            'compressed': compress,
+            'db_bytes': os.path.getsize(db_copy),
+            'db_sha256': file_sha256(db_copy),
+            'pages': stats['pages'],
+            'restarts': stats['restarts'],
+            'wal': stats['wal'],
+            'copy_seconds': round(copy_seconds, 3),
+            'tables': {k: v for k, v in info.items() if k != 'quick_check'},
+        }
+
+        if compress:
+            compress_file(db_copy, snapshot_path + '.partial')
+            os.replace(snapshot_path + '.partial', snapshot_path)
+            os.remove(db_copy)
+        else:
+            os.replace(db_copy, snapshot_path)
+        manifest['stored_bytes'] = os.path.getsize(snapshot_path)
+        manifest['stored_sha256'] = file_sha256(snapshot_path)
+
+        with open(manifest_path_for(snapshot_path), 'w') as manifest_file:
+            json.dump(manifest, manifest_file, indent=2)
+
+        manifest['rotated'] = rotate_snapshots(backup_dir, keep, manifest['source']) if keep else []
+        return manifest
+
+    except Exception as e:
+        print(f"Error creating backup: {e}")
+        for path in (db_copy, snapshot_path + '.partial'):
+            if os.path.exists(path):
+                os.remove(path)
+        return None
+
+
+def list_snapshots(backup_dir: str = BACKUP_DIR) -> List[Dict]:
+    """Manifests of the snapshots in backup_dir, newest first"""
+    manifests = []
+    for path in glob.glob(os.path.join(backup_dir, '*.json')):
+        try:
+            with open(path) as manifest_file:
+                manifest = json.load(manifest_file)
+        except (OSError, ValueError):
+            continue
+        manifest['path'] = path[:-len('.json')]
+        manifests.append(manifest)
+    return sorted(manifests, key=lambda m: (m.get('created_at', ''), m['path']), reverse=True)
+
+
+def _extract(snapshot_path: str, manifest: Dict, target_path: str):
+    """Write the database of a snapshot to target_path"""
+    if manifest.get('compressed'):
+        with gzip.open(snapshot_path, 'rb') as source, open(target_path, 'wb') as target:
+            shutil.copyfileobj(source, target, COPY_CHUNK)
+    else:
+        shutil.copyfile(snapshot_path, target_path)
+
+
+def verify_snapshot(snapshot_path: str, keep_extracted: str = None) -> Dict:
+    """
+    Check a snapshot against its manifest checksums and run integrity_check on it.
+    Returns a dict with 'ok' and the problems found. keep_extracted names a path
+    to leave the verified database at (used by restore).
+    """
+    result = {'path': snapshot_path, 'ok': False, 'problems': []}
+    manifest_path = manifest_path_for(snapshot_path)
+    if not os.path.exists(snapshot_path) or not os.path.exists(manifest_path):
+        result['problems'].append('snapshot or manifest missing')
+        return result
+
+    with open(manifest_path) as manifest_file:
+        manifest = json.load(manifest_file)
+    if file_sha256(snapshot_path) != manifest['stored_sha256']:
+        result['problems'].append('stored file checksum mismatch')
+        return result
+
+    extracted = keep_extracted or snapshot_path + '.verify'
+    try:
+        _extract(snapshot_path, manifest, extracted)
+        if file_sha256(extracted) != manifest['db_sha256']:
+            result['problems'].append('database checksum mismatch')
+        conn = sqlite3.connect(f"file:{os.path.abspath(extracted)}?mode=ro", uri=True)
+        integrity = conn.execute('PRAGMA integrity_check').fetchone()[0]
+        conn.close()
+        if integrity != 'ok':
+            result['problems'].append(f"integrity_check: {integrity}")
+        result['tables'] = snapshot_info(extracted)
+    except Exception as e:
+        result['problems'].append(str(e))
+    finally:
+        if not keep_extracted and os.path.exists(extracted):
+            os.remove(extracted)
+
+    result['ok'] = not result['problems']
+    return result
+
+
+def restore_snapshot(snapshot_path: str, db_path: str = 'data/optigrade.db') -> bool:
+    """
+    Verify a snapshot and replace the database with it. Scanners and other programs
+    using the database must be stopped first.
+    """
+    os.makedirs(os.path.dirname(db_path) or '.', exist_ok=True)
+    staged = db_path + '.restore'
+    result = verify_snapshot(snapshot_path, keep_extracted=staged)
+    if not result['ok']:
+        print(f"Error restoring backup: {'; '.join(result['problems'])}")
+        if os.path.exists(staged):
+            os.remove(staged)
+        return False
+
+    try:
+        if os.path.exists(db_path):
+            # Fold a pending WAL into the old file so the kept copy is complete
+            conn = sqlite3.connect(db_path)
+            conn.execute('PRAGMA wal_checkpoint(TRUNCATE)')
+            conn.close()
+            os.replace(db_path, db_path + '.before-restore')
+        for suffix in ('-wal', '-shm'):
+            if os.path.exists(db_path + suffix):
+                os.remove(db_path + suffix)
+        os.replace(staged, db_path)
+        return True
+
+    except Exception as e:
+        print(f"Error restoring backup: {e}")
+        return False
+
+
+def main():
+    """Command line entry point"""
+    parser = argparse.ArgumentParser(description='Back up the OptiGrade database while it is in use')
+    parser.add_argument('--db', default='data/optigrade.db', help='database path')
+    parser.add_argument('--dir', default=BACKUP_DIR, help='where snapshots are kept')
+    parser.add_argument('--pages', type=int, default=DEFAULT_PAGES_PER_STEP, help='pages copied per step')
+    parser.add_argument('--sleep', type=float, default=DEFAULT_STEP_SLEEP, help='seconds between steps')
+    parser.add_argument('--no-compress', action='store_true', help='store the snapshot uncompressed')
+    parser.add_argument('--keep', type=int, default=DEFAULT_KEEP, help='snapshots to keep (0 keeps all)')
+    parser.add_argument('--wal', action='store_true',
+                        help='switch the database to WAL mode first (persistent; lets writers run during copies)')
+    parser.add_argument('--list', action='store_true', help='list snapshots')
+    parser.add_argument('--verify', metavar='SNAPSHOT', help='check a snapshot ("all" checks every one)')
+    parser.add_argument('--restore', metavar='SNAPSHOT', help='verify a snapshot and restore it to --db')
+    args = parser.parse_args()
+
+    if args.list:
+        snapshots = list_snapshots(args.dir)
+        if not snapshots:
+            print("No snapshots found.")
+        for manifest in snapshots:
+            print(f"{manifest['created_at']}  {manifest['path']}  "
+                  f"{manifest['stored_bytes'] / 1024 / 1024:.1f} MB  "
+                  f"{manifest['tables'].get('grading_sessions', 0)} sessions")
+        return
+
+    if args.verify:
+        paths = [m['path'] for m in list_snapshots(args.dir)] if args.verify == 'all' else [args.verify]
+        for path in paths:
+            result = verify_snapshot(path)
+            print(f"{path}: {'OK' if result['ok'] else 'FAILED - ' + '; '.join(result['problems'])}")
+        return
+
+    if args.restore:
+        if restore_snapshot(args.restore, args.db):
+            print(f"Restored {args.restore} to {args.db} (previous file kept as {args.db}.before-restore)")
+        return
+
+    if args.wal:
+        conn = sqlite3.connect(args.db)
+        conn.execute('PRAGMA journal_mode = WAL')
+        conn.close()
+
+    manifest = backup_database(args.db, args.dir, args.pages, args.sleep, not args.no_compress, args.keep)
+    if manifest:
+        print(f"Snapshot: {manifest['path']}")
+        print(f"Copied {manifest['pages']} pages in {manifest['copy_seconds']:.1f}s "
+              f"({manifest['restarts']} restarts), {manifest['db_bytes'] / 1024 / 1024:.1f} MB -> "
+              f"{manifest['stored_bytes'] / 1024 / 1024:.1f} MB stored")
+        if not manifest['wal']:
+            print("[INFO] The database is not in WAL mode; writers restart the copy (see --wal).")
+        for path in manifest['rotated']:
+            print(f"Removed old snapshot: {path}")
+
+
+if __name__ == "__main__":
+    main()
@@ -1,21 +1,124 @@
 import sqlite3
 import json
 import os
+import threading
+import time
+from collections import OrderedDict
 from datetime import datetime
 from typing import Dict, List, Optional, Tuple
 
+import numpy as np
+
+from collusion_detection import DEFAULT_MIN_SHARED_WRONG, find_similar_pairs
+from item_analysis import analyze_responses, load_response_matrix
+from matrix_export import MATRIX_EXPORT_DIR, update_matrix_export
+from score_distribution import DEFAULT_GRADE_BANDS, ScoreDistribution
+
+# Number of decoded assignments kept in memory by default
+DEFAULT_ASSIGNMENT_CACHE_SIZE = 128
+# Cached assignments older than this are checked against the database, which other processes may change
+DEFAULT_CACHE_REVALIDATE_SECONDS = 2.0
+
+# Trend and per-period queries run over a "student_sessions" relation holding
+# (id, assignment_id, assignment_name, score, processed_at) for one student
+STUDENT_TREND_SQL = '''
+    SELECT id AS session_id, assignment_id, assignment_name, score, processed_at,
+           AVG(score) OVER (ORDER BY processed_at, id
+                            ROWS BETWEEN ? PRECEDING AND CURRENT ROW) AS moving_average,
+           score - LAG(score) OVER (ORDER BY processed_at, id) AS change,
+           score - FIRST_VALUE(score) OVER (ORDER BY processed_at, id) AS improvement
+    FROM student_sessions
+    ORDER BY processed_at, id
+'''
+
+STUDENT_PERIOD_SQL = '''
+    SELECT strftime(?, processed_at) AS period,
+           COUNT(*) AS attempts,
+           AVG(score) AS average_score,
+           MAX(score) AS best_score,
+           MIN(score) AS worst_score
+    FROM student_sessions
+    GROUP BY period
+    ORDER BY period
+'''
+
+# Highest numeric suffix among student IDs sharing a prefix (e.g. 'STU_20240101_')
+MAX_STUDENT_NUMBER_SQL = '''
+    SELECT MAX(CAST(substr(student_id, length(:prefix) + 1) AS INTEGER))
+    FROM grading_sessions
+    WHERE substr(student_id, 1, length(:prefix)) = :prefix
+      AND substr(student_id, length(:prefix) + 1) GLOB '[0-9]*'
+      AND substr(student_id, length(:prefix) + 1) NOT GLOB '*[^0-9]*'
+'''
+
+# Review queue entries joined with their session; parameters are (status, limit)
+REVIEW_QUEUE_SQL = '''
+    SELECT rq.*, gs.student_name, gs.student_id, gs.score, gs.assignment_id, a.assignment_name
+    FROM review_queue rq
+    JOIN grading_sessions gs ON gs.id = rq.session_id
+    JOIN assignments a ON a.id = gs.assignment_id
+    WHERE rq.status = ?
+    ORDER BY rq.created_at, rq.session_id
+    LIMIT ?
+'''
+
+PERIOD_FORMATS = {'day': '%Y-%m-%d', 'week': '%Y-W%W', 'month': '%Y-%m', 'year': '%Y'}
+
+
+def compile_answer_key(answer_key: Dict, num_questions: int) -> np.ndarray:
+    """
+    Convert a decoded answer key into an array of option indices (0 = A).
+    Keys may be ints or JSON strings, values option indices or letters.
+    Questions without a key entry are marked with -1.
+    """
+    key_array = np.full(num_questions, -1, dtype=np.int8)
+    for question, answer in answer_key.items():
+        index = int(question)
+        if not 0 <= index < num_questions:
+            continue
+        if isinstance(answer, str):
+            answer = ord(answer.strip().upper()) - 65
+        key_array[index] = int(answer)
+    key_array.setflags(write=False)
+    return key_array
+
+
+def decode_review_row(row) -> Dict:
+    """Turn a review queue row into a dict with its JSON columns decoded"""
+    entry = dict(row)
+    entry['reasons'] = json.loads(entry['reasons'])
+    entry['questions'] = json.loads(entry['questions'])
+    return entry
+
+
 class OptiGradeDatabase:
     """Database manager for OptiGrade application"""
     
-    def __init__(self, db_path: str = 'data/optigrade.db'):
+    def __init__(self, db_path: str = 'data/optigrade.db',
+                 cache_size: int = DEFAULT_ASSIGNMENT_CACHE_SIZE,
+                 cache_revalidate_seconds: float = DEFAULT_CACHE_REVALIDATE_SECONDS):
         self.db_path = db_path
         self._ensure_database_exists()
+        
+        # LRU cache of decoded assignments: id -> (assignment dict, answer key array, version, checked at)
+        self.cache_size = cache_size
+        self.cache_revalidate_seconds = cache_revalidate_seconds
+        self._assignment_cache = OrderedDict()
+        self._cache_lock = threading.Lock()
+        # Bumped by invalidate_assignment so a load that raced with it is not cached
+        self._cache_generation = 0
+        self._assignment_generations = {}
+        self.cache_hits = 0
+        self.cache_misses = 0
+        
+        # Sorted score lists per assignment, see get_score_distribution
+        self._distributions = {}
+        self._distribution_lock = threading.Lock()
     
     def _ensure_database_exists(self):
-        """Ensure database and tables exist"""
-        if not os.path.exists(self.db_path):
-            from database_setup import create_database
-            create_database()
+        """Ensure database and tables exist (adding tables introduced since it was created)"""
+        from database_setup import create_database
+        create_database(self.db_path, verbose=not os.path.exists(self.db_path))
     
     def _get_connection(self):
         """Get database connection with proper configuration"""
@@ -23,7 +126,16 @@ class OptiGradeDatabase:
         conn.row_factory = sqlite3.Row  # Enable column access by name
         return conn
     
-    def save_assignment(self, assignment_name: str, num_questions: int, answer_key: Dict[int, int]) -> int:
+    def _connection_for_assignment(self, assignment_id: int):
+        """Get a connection to the database holding the given assignment"""
+        return self._get_connection()
+    
+    def _connection_for_session(self, session_id: int):
+        """Get a connection to the database holding the given grading session"""
+        return self._get_connection()
+    
+    def save_assignment(self, assignment_name: str, num_questions: int, answer_key: Dict[int, int],
+                        num_options: int = 5) -> int:
         """Save a new assignment configuration"""
         try:
             conn = self._get_connection()
@@ -33,9 +145,9 @@ class OptiGradeDatabase:
             answer_key_json = json.dumps(answer_key)
             
             cursor.execute('''
-                INSERT INTO assignments (assignment_name, num_questions, answer_key)
-                VALUES (?, ?, ?)
-            ''', (assignment_name, num_questions, answer_key_json))
+                INSERT INTO assignments (assignment_name, num_questions, answer_key, num_options)
+                VALUES (?, ?, ?, ?)
+            ''', (assignment_name, num_questions, answer_key_json, num_options))
             
             assignment_id = cursor.lastrowid
             conn.commit()
@@ -50,45 +162,572 @@ class OptiGradeDatabase:
     
     def save_grading_result(self, assignment_id: int, student_name: str, student_id: str,
                           score: float, correct_answers: int, total_questions: int,
-                          image_path: str = None, detailed_results: List[Dict] = None) -> int:
-        """Save a grading session result"""
+                          image_path: str = None, detailed_results: List[Dict] = None,
+                          review: Dict = None) -> int:
+        """
+        Save a grading session result. A review dict ({'reasons', 'questions', 'crop_path'})
+        also puts the session in the review queue.
+        """
+        try:
+            conn = self._connection_for_assignment(assignment_id)
+            cursor = conn.cursor()
+            
+            session_id = self._insert_grading_result(cursor, assignment_id, student_name, student_id,
+                                                     score, correct_answers, total_questions,
+                                                     image_path, detailed_results, review)
+            
+            conn.commit()
+            conn.close()
+            
+            print(f"Grading result saved for student {student_name} (ID: {student_id})")
+            return session_id
+            
+        except Exception as e:
+            print(f"Error saving grading result: {e}")
+            return None
+    
+    def save_grading_results(self, results: List[Dict]) -> List[int]:
+        """
+        Save several grading results with one transaction per assignment.
+        Each dict takes the keyword arguments of save_grading_result.
+        Returns the new session IDs in input order (None where saving failed).
+        """
+        session_ids = [None] * len(results)
+        by_assignment = {}
+        for index, result in enumerate(results):
+            by_assignment.setdefault(result['assignment_id'], []).append(index)
+        
+        for assignment_id, indexes in by_assignment.items():
+            conn = None
+            try:
+                conn = self._connection_for_assignment(assignment_id)
+                cursor = conn.cursor()
+                
+                batch_ids = []
+                for index in indexes:
+                    result = results[index]
+                    batch_ids.append(self._insert_grading_result(
+                        cursor, assignment_id, result.get('student_name'), result.get('student_id'),
+                        result['score'], result['correct_answers'], result['total_questions'],
+                        result.get('image_path'), result.get('detailed_results'), result.get('review'),
+                        result.get('processed_at'), result.get('journal_uid')))
+                
+                conn.commit()
+                conn.close()
+                
+                for index, session_id in zip(indexes, batch_ids):
+                    session_ids[index] = session_id
+                
+            except Exception as e:
+                print(f"Error saving grading results for assignment {assignment_id}: {e}")
+                if conn:
+                    conn.close()  # Rolls back; a leaked connection would keep the write lock until collected
+        
+        return session_ids
+    
+    def apply_redetected_answers(self, updates: List[Dict]) -> int:
+        """
+        Store answers re-read from archived sheet images, one transaction per assignment.
+        Each dict has assignment_id, session_id, student_id, score, correct_answers and
+        detailed_results holding only the changed questions (build_detailed_results rows).
+        Questions without a stored row (sessions saved without detailed results) are inserted.
+        Returns the number of sessions updated.
+        """
+        from database_setup import refresh_student_rollups
+        
+        by_assignment = {}
+        for update in updates:
+            by_assignment.setdefault(update['assignment_id'], []).append(update)
+        
+        updated = 0
+        for assignment_id, group in by_assignment.items():
+            conn = None
+            try:
+                conn = self._connection_for_assignment(assignment_id)
+                cursor = conn.cursor()
+                
+                rows = [{'session_id': update['session_id'], 'question_number': row['question_number'],
+                         'correct_answer': row['correct_answer'], 'student_answer': row['student_answer'],
+                         'is_correct': row['is_correct']}
+                        for update in group for row in update['detailed_results']]
+                cursor.executemany('''
+                    UPDATE detailed_results
+                    SET student_answer = :student_answer, is_correct = :is_correct
+                    WHERE session_id = :session_id AND question_number = :question_number
+                ''', rows)
+                cursor.executemany('''
+                    INSERT INTO detailed_results (session_id, question_number, correct_answer, student_answer, is_correct)
+                    SELECT :session_id, :question_number, :correct_answer, :student_answer, :is_correct
+                    WHERE NOT EXISTS (SELECT 1 FROM detailed_results
+                                      WHERE session_id = :session_id AND question_number = :question_number)
+                ''', rows)
+                cursor.executemany('UPDATE grading_sessions SET score = ?, correct_answers = ? WHERE id = ?',
+                                   [(update['score'], update['correct_answers'], update['session_id'])
+                                    for update in group])
+                cursor.execute('UPDATE assignments SET scores_version = scores_version + 1 WHERE id = ?',
+                               (assignment_id,))
+                refresh_student_rollups(cursor, {update['student_id'] for update in group
+                                                 if update['student_id'] is not None})
+                
+                conn.commit()
+                conn.close()
+                updated += len(group)
+                
+            except Exception as e:
+                print(f"Error applying re-detected answers for assignment {assignment_id}: {e}")
+                if conn:
+                    conn.close()
+        
+        return updated
+    
+    def get_journal_checkpoint(self, journal: str) -> int:
+        """Get the byte offset up to which a result journal has been ingested"""
         try:
             conn = self._get_connection()
+            row = conn.execute('SELECT byte_offset FROM journal_checkpoints WHERE journal = ?',
+                               (journal,)).fetchone()
+            conn.close()
+            
+            return row[0] if row else 0
+            
+        except Exception as e:
+            print(f"Error retrieving journal checkpoint: {e}")
+            return 0
+    
+    def save_journal_checkpoint(self, journal: str, byte_offset: int) -> bool:
+        """Record how far a result journal has been ingested"""
+        try:
+            conn = self._get_connection()
+            conn.execute('''
+                INSERT INTO journal_checkpoints (journal, byte_offset) VALUES (?, ?)
+                ON CONFLICT (journal) DO UPDATE SET
+                    byte_offset = excluded.byte_offset,
+                    updated_at = CURRENT_TIMESTAMP
+            ''', (journal, byte_offset))
+            conn.commit()
+            conn.close()
+            
+            return True
+            
+        except Exception as e:
+            print(f"Error saving journal checkpoint: {e}")
+            return False
+    
+    def _insert_grading_result(self, cursor, assignment_id: int, student_name: str, student_id: str,
+                               score: float, correct_answers: int, total_questions: int,
+                               image_path: str = None, detailed_results: List[Dict] = None,
+                               review: Dict = None, processed_at: str = None, journal_uid: str = None) -> int:
+        """
+        Insert one session, its detailed results, review entry and rollup update without committing.
+        A result replayed from the journal (journal_uid) is inserted only once.
+        """
+        if journal_uid:
+            cursor.execute('SELECT session_id FROM journal_ingested WHERE uid = ?', (journal_uid,))
+            row = cursor.fetchone()
+            if row:
+                return row[0]
+        
+        # Save main grading session
+        cursor.execute('''
+            INSERT INTO grading_sessions 
+            (assignment_id, student_name, student_id, score, correct_answers, total_questions, image_path,
+             processed_at)
+            VALUES (?, ?, ?, ?, ?, ?, ?, COALESCE(?, CURRENT_TIMESTAMP))
+        ''', (assignment_id, student_name, student_id, score, correct_answers, total_questions, image_path,
+              processed_at))
+        
+        session_id = cursor.lastrowid
+        
+        if journal_uid:
+            cursor.execute('INSERT INTO journal_ingested (uid, session_id) VALUES (?, ?)',
+                           (journal_uid, session_id))
+        
+        # Save detailed results if provided
+        if detailed_results:
+            cursor.executemany('''
+                INSERT INTO detailed_results 
+                (session_id, question_number, correct_answer, student_answer, is_correct)
+                VALUES (?, ?, ?, ?, ?)
+            ''', [(session_id, result['question_number'], result['correct_answer'],
+                  result['student_answer'], result['is_correct']) for result in detailed_results])
+        
+        if review:
+            cursor.execute('''
+                INSERT INTO review_queue (session_id, reasons, questions, crop_path)
+                VALUES (?, ?, ?, ?)
+            ''', (session_id, json.dumps(review.get('reasons', [])),
+                  json.dumps(review.get('questions', [])), review.get('crop_path')))
+        
+        self._update_student_rollup(cursor, session_id, student_id, student_name, score)
+        return session_id
+    
+    def _update_student_rollup(self, cursor, session_id: int, student_id: str, student_name: str,
+                               score: float):
+        """Fold one new score into the student's rollup row (same transaction as the insert)"""
+        if not student_id:
+            return
+        
+        from database_setup import ROLLUP_RECENT_SCORES
+        
+        # Order by the session's own processed_at, which for a replayed journal
+        # record is when it was graded rather than when it was ingested
+        cursor.execute('SELECT processed_at FROM grading_sessions WHERE id = ?', (session_id,))
+        processed_at = cursor.fetchone()[0]
+        cursor.execute('SELECT recent_scores, last_processed_at FROM student_rollups WHERE student_id = ?',
+                       (student_id,))
+        row = cursor.fetchone()
+        is_latest = not row or row[1] is None or processed_at >= row[1]
+        if is_latest:
+            recent_scores = json.loads(row[0]) if row else []
+            recent_scores = ([float(score)] + recent_scores)[:ROLLUP_RECENT_SCORES]
+        else:
+            # An older record lands somewhere inside the list; reread it from the index
+            cursor.execute('''
+                SELECT score FROM grading_sessions WHERE student_id = ?
+                ORDER BY processed_at DESC, id DESC LIMIT ?
+            ''', (student_id, ROLLUP_RECENT_SCORES))
+            recent_scores = [r[0] for r in cursor.fetchall()]
+        
+        # mean_score holds the new score in "excluded", so the running mean is
+        # mean + (score - mean) / (count + 1). The name follows the latest session.
+        cursor.execute('''
+            INSERT INTO student_rollups
+            (student_id, student_name, attempt_count, mean_score, best_score, worst_score,
+             recent_scores, last_processed_at)
+            VALUES (:student_id, :student_name, 1, :score, :score, :score, :recent_scores, :processed_at)
+            ON CONFLICT(student_id) DO UPDATE SET
+                student_name = CASE WHEN :is_latest THEN excluded.student_name ELSE student_name END,
+                attempt_count = attempt_count + 1,
+                mean_score = mean_score + (excluded.mean_score - mean_score) / (attempt_count + 1),
+                best_score = MAX(best_score, excluded.best_score),
+                worst_score = MIN(worst_score, excluded.worst_score),
+                recent_scores = excluded.recent_scores,
+                last_processed_at = MAX(COALESCE(last_processed_at, excluded.last_processed_at),
+                                        excluded.last_processed_at)
+        ''', {'student_id': student_id, 'student_name': student_name, 'score': score,
+              'recent_scores': json.dumps(recent_scores), 'processed_at': processed_at,
+              'is_latest': is_latest})
+    
+    def rebuild_student_rollups(self, student_ids: List[str] = None) -> bool:
+        """Recompute rollups from grading_sessions for all students or only the given ones"""
+        try:
+            from database_setup import refresh_student_rollups
+            
+            conn = self._get_connection()
+            refresh_student_rollups(conn.cursor(), student_ids)
+            conn.commit()
+            conn.close()
+            return True
+            
+        except Exception as e:
+            print(f"Error rebuilding student rollups: {e}")
+            return False
+    
+    def update_assignment(self, assignment_id: int, assignment_name: str = None,
+                          num_questions: int = None, answer_key: Dict[int, int] = None) -> bool:
+        """Update assignment fields and drop the cached copy"""
+        fields = []
+        values = []
+        if assignment_name is not None:
+            fields.append('assignment_name = ?')
+            values.append(assignment_name)
+        if num_questions is not None:
+            fields.append('num_questions = ?')
+            values.append(num_questions)
+        if answer_key is not None:
+            fields.append('answer_key = ?')
+            values.append(json.dumps(answer_key))
+        if not fields:
+            return False
+        
+        try:
+            conn = self._connection_for_assignment(assignment_id)
+            cursor = conn.cursor()
+            
+            cursor.execute(f'''
+                UPDATE assignments
+                SET {', '.join(fields)}, updated_at = CURRENT_TIMESTAMP
+                WHERE id = ?
+            ''', (*values, assignment_id))
+            
+            updated = cursor.rowcount > 0
+            conn.commit()
+            conn.close()
+            
+            self.invalidate_assignment(assignment_id)
+            return updated
+            
+        except Exception as e:
+            print(f"Error updating assignment: {e}")
+            return False
+    
+    def update_answer_key(self, assignment_id: int, answer_key: Dict[int, str],
+                          reason: str = None) -> Optional[Dict]:
+        """
+        Replace an assignment's answer key and regrade every session from its stored
+        answers in one transaction. The old key is kept in answer_key_history and the
+        previous score of every changed session in regrade_audit.
+        Returns a summary of the regrade or None on failure.
+        """
+        conn = None
+        try:
+            from database_setup import refresh_student_rollups
+            
+            started = time.perf_counter()
+            conn = self._connection_for_assignment(assignment_id)
             cursor = conn.cursor()
+            cursor.execute('BEGIN IMMEDIATE')
+            
+            cursor.execute('SELECT num_questions, num_options, answer_key FROM assignments WHERE id = ?',
+                           (assignment_id,))
+            assignment = cursor.fetchone()
+            if not assignment:
+                conn.rollback()
+                conn.close()
+                return None
+            
+            num_questions = assignment['num_questions']
+            num_options = assignment['num_options']
+            old_key = compile_answer_key(json.loads(assignment['answer_key']), num_questions)
+            new_key = compile_answer_key(answer_key, num_questions)
+            if (new_key < 0).any():
+                raise ValueError("the new answer key must have an answer for every question")
+            if (new_key >= num_options).any():
+                raise ValueError(f"answers must be between A and {chr(64 + num_options)}")
+            new_letters = [chr(65 + int(option)) for option in new_key]
+            changed_questions = [int(q) + 1 for q in np.flatnonzero(new_key != old_key)]
+            
+            # Rescore all sessions at once from their stored answers
+            session_ids, choices = load_response_matrix(conn, assignment_id, num_questions, num_options=num_options)
+            correct = (choices == new_key[np.newaxis, :]).sum(axis=1)
+            
+            cursor.execute('''
+                SELECT id, student_id, score, correct_answers, total_questions
+                FROM grading_sessions WHERE assignment_id = ? ORDER BY id
+            ''', (assignment_id,))
+            sessions = cursor.fetchall()
+            all_ids = np.fromiter((row['id'] for row in sessions), dtype=np.int64, count=len(sessions))
+            rows = np.searchsorted(all_ids, session_ids)
+            old_scores = np.array([sessions[i]['score'] for i in rows], dtype=np.float64)
+            old_correct = np.array([sessions[i]['correct_answers'] for i in rows], dtype=np.int64)
+            totals = np.array([sessions[i]['total_questions'] for i in rows], dtype=np.int64)
+            new_scores = np.divide(correct * 100.0, totals, out=np.zeros(len(rows)), where=totals > 0)
+            changed = np.flatnonzero((correct != old_correct) | ~np.isclose(new_scores, old_scores))
             
-            # Save main grading session
             cursor.execute('''
-                INSERT INTO grading_sessions 
-                (assignment_id, student_name, student_id, score, correct_answers, total_questions, image_path)
+                INSERT INTO answer_key_history
+                (assignment_id, old_answer_key, new_answer_key, changed_questions, reason,
+                 sessions_regraded, sessions_changed)
                 VALUES (?, ?, ?, ?, ?, ?, ?)
-            ''', (assignment_id, student_name, student_id, score, correct_answers, total_questions, image_path))
+            ''', (assignment_id, assignment['answer_key'], json.dumps(answer_key), json.dumps(changed_questions),
+                  reason, len(session_ids), len(changed)))
+            regrade_id = cursor.lastrowid
             
-            session_id = cursor.lastrowid
+            # Only the corrected questions change in detailed_results
+            if changed_questions:
+                cursor.execute('''
+                    UPDATE detailed_results
+                    SET correct_answer = json_extract(:key, '$[' || (question_number - 1) || ']'),
+                        is_correct = (student_answer = json_extract(:key, '$[' || (question_number - 1) || ']'))
+                    WHERE session_id IN (SELECT id FROM grading_sessions WHERE assignment_id = :assignment_id)
+                      AND question_number IN (SELECT value FROM json_each(:questions))
+                ''', {'key': json.dumps(new_letters), 'questions': json.dumps(changed_questions),
+                      'assignment_id': assignment_id})
             
-            # Save detailed results if provided
-            if detailed_results:
-                for result in detailed_results:
-                    cursor.execute('''
-                        INSERT INTO detailed_results 
-                        (session_id, question_number, correct_answer, student_answer, is_correct)
-                        VALUES (?, ?, ?, ?, ?)
-                    ''', (session_id, result['question_number'], result['correct_answer'], 
-                         result['student_answer'], result['is_correct']))
+            cursor.executemany('''
+                INSERT INTO regrade_audit
+                (regrade_id, session_id, old_score, old_correct_answers, new_score, new_correct_answers)
+                VALUES (?, ?, ?, ?, ?, ?)
+            ''', [(regrade_id, int(session_ids[i]), float(old_scores[i]), int(old_correct[i]),
+                   float(new_scores[i]), int(correct[i])) for i in changed])
+            cursor.executemany('UPDATE grading_sessions SET score = ?, correct_answers = ? WHERE id = ?',
+                               [(float(new_scores[i]), int(correct[i]), int(session_ids[i])) for i in changed])
+            
+            cursor.execute('''
+                UPDATE assignments
+                SET answer_key = ?, scores_version = scores_version + 1, updated_at = CURRENT_TIMESTAMP
+                WHERE id = ?
+            ''', (json.dumps(answer_key), assignment_id))
+            
+            refresh_student_rollups(cursor, {sessions[rows[i]]['student_id'] for i in changed
+                                             if sessions[rows[i]]['student_id'] is not None})
             
             conn.commit()
             conn.close()
             
-            print(f"Grading result saved for student {student_name} (ID: {student_id})")
-            return session_id
+            self.invalidate_assignment(assignment_id)
+            summary = {
+                'regrade_id': regrade_id,
+                'changed_questions': changed_questions,
+                'sessions_regraded': len(session_ids),
+                'sessions_changed': len(changed),
+                # Sessions without stored answers (detailed_results) keep their old score
+                'sessions_not_regraded': len(sessions) - len(session_ids),
+                'seconds': time.perf_counter() - started,
+            }
+            print(f"Assignment {assignment_id} regraded: {len(changed)} of {len(session_ids)} sessions changed")
+            if summary['sessions_not_regraded']:
+                print(f"Warning: {summary['sessions_not_regraded']} sessions have no stored answers "
+                      f"and could not be regraded")
+            return summary
             
         except Exception as e:
-            print(f"Error saving grading result: {e}")
+            print(f"Error updating answer key: {e}")
+            if conn:
+                conn.close()  # Rolls back and releases the write lock right away
+            return None
+    
+    def get_answer_key_history(self, assignment_id: int) -> List[Dict]:
+        """Get the answer-key corrections of an assignment, newest first"""
+        try:
+            conn = self._connection_for_assignment(assignment_id)
+            cursor = conn.cursor()
+            
+            cursor.execute('''
+                SELECT * FROM answer_key_history
+                WHERE assignment_id = ?
+                ORDER BY id DESC
+            ''', (assignment_id,))
+            
+            history = []
+            for row in cursor.fetchall():
+                entry = dict(row)
+                entry['old_answer_key'] = json.loads(entry['old_answer_key'])
+                entry['new_answer_key'] = json.loads(entry['new_answer_key'])
+                entry['changed_questions'] = json.loads(entry['changed_questions'])
+                history.append(entry)
+            conn.close()
+            
+            return history
+            
+        except Exception as e:
+            print(f"Error retrieving answer key history: {e}")
+            return []
+    
+    def close_assignment(self, assignment_id: int) -> bool:
+        """Mark an assignment as finished so its sessions can be archived"""
+        try:
+            conn = self._connection_for_assignment(assignment_id)
+            cursor = conn.cursor()
+            
+            cursor.execute('''
+                UPDATE assignments
+                SET closed_at = CURRENT_TIMESTAMP, updated_at = CURRENT_TIMESTAMP
+                WHERE id = ? AND closed_at IS NULL
+            ''', (assignment_id,))
+            
+            closed = cursor.rowcount > 0
+            conn.commit()
+            conn.close()
+            
+            self.invalidate_assignment(assignment_id)
+            return closed
+            
+        except Exception as e:
+            print(f"Error closing assignment: {e}")
+            return False
+    
+    def _assignment_version(self, assignment_id: int) -> Optional[Tuple]:
+        """(updated_at, scores_version) of an assignment row; every key correction changes it"""
+        try:
+            conn = self._connection_for_assignment(assignment_id)
+            row = conn.execute('SELECT updated_at, scores_version FROM assignments WHERE id = ?',
+                               (assignment_id,)).fetchone()
+            conn.close()
+            
+            return tuple(row) if row else None
+            
+        except Exception as e:
+            print(f"Error checking assignment version: {e}")
             return None
     
+    def _cache_lookup(self, assignment_id: int) -> Optional[Tuple[Dict, np.ndarray]]:
+        """
+        Return the cached (assignment, answer key array, ...) entry, loading it on a miss.
+        Entries older than cache_revalidate_seconds are reloaded if another process
+        changed the assignment meanwhile.
+        """
+        with self._cache_lock:
+            entry = self._assignment_cache.get(assignment_id)
+            if entry is not None and time.monotonic() - entry[3] < self.cache_revalidate_seconds:
+                self._assignment_cache.move_to_end(assignment_id)
+                self.cache_hits += 1
+                return entry
+            generation = (self._cache_generation, self._assignment_generations.get(assignment_id, 0))
+        
+        if entry is not None:
+            if self._assignment_version(assignment_id) == entry[2]:
+                entry = entry[:3] + (time.monotonic(),)
+                with self._cache_lock:
+                    if generation == (self._cache_generation, self._assignment_generations.get(assignment_id, 0)):
+                        self._assignment_cache[assignment_id] = entry
+                        self._assignment_cache.move_to_end(assignment_id)
+                    self.cache_hits += 1
+                return entry
+        
+        with self._cache_lock:
+            self.cache_misses += 1
+        assignment = self._load_assignment(assignment_id)
+        if assignment is None:
+            return None
+        
+        entry = (assignment, compile_answer_key(assignment['answer_key'], assignment['num_questions']),
+                 (assignment.get('updated_at'), assignment.get('scores_version')), time.monotonic())
+        if self.cache_size > 0:
+            with self._cache_lock:
+                # An invalidation during the load means the row read may already be stale
+                if generation != (self._cache_generation, self._assignment_generations.get(assignment_id, 0)):
+                    return entry
+                self._assignment_cache[assignment_id] = entry
+                while len(self._assignment_cache) > self.cache_size:
+                    self._assignment_cache.popitem(last=False)
+        return entry
+    
+    def invalidate_assignment(self, assignment_id: int = None):
+        """Drop one assignment from the cache, or all of them when no ID is given"""
+        with self._cache_lock:
+            if assignment_id is None:
+                self._cache_generation += 1
+                self._assignment_generations.clear()
+                self._assignment_cache.clear()
+            else:
+                self._assignment_generations[assignment_id] = self._assignment_generations.get(assignment_id, 0) + 1
+                self._assignment_cache.pop(assignment_id, None)
+    
+    def get_cache_stats(self) -> Dict:
+        """Get assignment cache size and hit/miss counters"""
+        with self._cache_lock:
+            lookups = self.cache_hits + self.cache_misses
+            return {
+                'size': len(self._assignment_cache),
+                'capacity': self.cache_size,
+                'hits': self.cache_hits,
+                'misses': self.cache_misses,
+                'hit_rate': self.cache_hits / lookups if lookups else 0.0,
+            }
+    
     def get_assignment(self, assignment_id: int) -> Optional[Dict]:
         """Retrieve assignment by ID"""
+        entry = self._cache_lookup(assignment_id)
+        if entry is None:
+            return None
+        
+        # Hand out copies so callers cannot modify the cached entry
+        assignment = dict(entry[0])
+        assignment['answer_key'] = dict(assignment['answer_key'])
+        return assignment
+    
+    def get_answer_key_array(self, assignment_id: int) -> Optional[np.ndarray]:
+        """Get the answer key as a read-only array of option indices (0 = A, -1 = unset)"""
+        entry = self._cache_lookup(assignment_id)
+        if entry is None:
+            return None
+        return entry[1]
+    
+    def _load_assignment(self, assignment_id: int) -> Optional[Dict]:
+        """Load and decode an assignment row from the database"""
         try:
-            conn = self._get_connection()
+            conn = self._connection_for_assignment(assignment_id)
             cursor = conn.cursor()
             
             cursor.execute('SELECT * FROM assignments WHERE id = ?', (assignment_id,))
@@ -109,7 +748,7 @@ class OptiGradeDatabase:
     def get_grading_session(self, session_id: int) -> Optional[Dict]:
         """Retrieve grading session by ID"""
         try:
-            conn = self._get_connection()
+            conn = self._connection_for_session(session_id)
             cursor = conn.cursor()
             
             cursor.execute('''
@@ -156,7 +795,7 @@ class OptiGradeDatabase:
     def get_assignment_results(self, assignment_id: int) -> List[Dict]:
         """Get all results for a specific assignment"""
         try:
-            conn = self._get_connection()
+            conn = self._connection_for_assignment(assignment_id)
             cursor = conn.cursor()
             
             cursor.execute('''
@@ -179,7 +818,7 @@ class OptiGradeDatabase:
     def get_detailed_results(self, session_id: int) -> List[Dict]:
         """Get detailed question-by-question results for a session"""
         try:
-            conn = self._get_connection()
+            conn = self._connection_for_session(session_id)
             cursor = conn.cursor()
             
             cursor.execute('''
@@ -197,10 +836,71 @@ class OptiGradeDatabase:
             print(f"Error retrieving detailed results: {e}")
             return []
     
+    def get_assignments(self) -> List[Dict]:
+        """Get all assignments with their number of grading sessions"""
+        try:
+            conn = self._get_connection()
+            cursor = conn.cursor()
+            
+            cursor.execute('''
+                SELECT id, assignment_name, num_questions, created_at,
+                       (SELECT COUNT(*) FROM grading_sessions WHERE assignment_id = assignments.id) as session_count
+                FROM assignments
+                ORDER BY created_at DESC
+            ''')
+            
+            results = [dict(row) for row in cursor.fetchall()]
+            conn.close()
+            
+            return results
+            
+        except Exception as e:
+            print(f"Error retrieving assignments: {e}")
+            return []
+    
+    def get_recent_sessions(self, limit: int = 10) -> List[Dict]:
+        """Get the most recently processed grading sessions"""
+        try:
+            conn = self._get_connection()
+            cursor = conn.cursor()
+            
+            cursor.execute('''
+                SELECT gs.*, a.assignment_name
+                FROM grading_sessions gs
+                JOIN assignments a ON gs.assignment_id = a.id
+                ORDER BY gs.processed_at DESC
+                LIMIT ?
+            ''', (limit,))
+            
+            results = [dict(row) for row in cursor.fetchall()]
+            conn.close()
+            
+            return results
+            
+        except Exception as e:
+            print(f"Error retrieving recent sessions: {e}")
+            return []
+    
+    def get_max_student_number(self, prefix: str) -> int:
+        """Get the highest number used in auto-generated student IDs '<prefix><number>' (0 if none)"""
+        try:
+            conn = self._get_connection()
+            row = conn.execute(MAX_STUDENT_NUMBER_SQL, {'prefix': prefix}).fetchone()
+            conn.close()
+            
+            return row[0] or 0
+            
+        except Exception as e:
+            print(f"Error retrieving student numbers: {e}")
+            return 0
+    
     def get_statistics(self, assignment_id: int = None) -> Dict:
         """Get grading statistics"""
         try:
-            conn = self._get_connection()
+            if assignment_id:
+                conn = self._connection_for_assignment(assignment_id)
+            else:
+                conn = self._get_connection()
             cursor = conn.cursor()
             
             if assignment_id:
@@ -244,6 +944,346 @@ class OptiGradeDatabase:
             print(f"Error retrieving statistics: {e}")
             return {}
     
+    def get_score_distribution(self, assignment_id: int) -> Optional[ScoreDistribution]:
+        """
+        Get the cached score distribution of an assignment. Sessions inserted since the
+        last call are merged in; a changed scores_version (regrade, review, archiving)
+        reloads it from the (assignment_id, score) index.
+        """
+        try:
+            conn = self._connection_for_assignment(assignment_id)
+            cursor = conn.cursor()
+            
+            cursor.execute('SELECT scores_version FROM assignments WHERE id = ?', (assignment_id,))
+            row = cursor.fetchone()
+            if not row:
+                conn.close()
+                return None
+            
+            with self._distribution_lock:
+                distribution = self._distributions.get(assignment_id)
+                if distribution is None or distribution.version != row['scores_version']:
+                    cursor.execute('''
+                        SELECT score, MAX(id) OVER () FROM grading_sessions
+                        WHERE assignment_id = ? ORDER BY score
+                    ''', (assignment_id,))
+                    rows = cursor.fetchall()
+                    distribution = ScoreDistribution(assignment_id, [r[0] for r in rows],
+                                                     rows[0][1] if rows else 0, row['scores_version'])
+                    self._distributions[assignment_id] = distribution
+                else:
+                    cursor.execute('''
+                        SELECT id, score FROM grading_sessions
+                        WHERE assignment_id = ? AND id > ?
+                    ''', (assignment_id, distribution.last_session_id))
+                    rows = cursor.fetchall()
+                    if rows:
+                        distribution.add([r['score'] for r in rows], max(r['id'] for r in rows))
+            conn.close()
+            
+            return distribution
+            
+        except Exception as e:
+            print(f"Error retrieving score distribution: {e}")
+            return None
+    
+    def get_session_standing(self, session_id: int, bands=DEFAULT_GRADE_BANDS) -> Optional[Dict]:
+        """Rank, percentile rank and grade of a session within its assignment"""
+        session = self.get_grading_session(session_id)
+        if not session:
+            return None
+        distribution = self.get_score_distribution(session['assignment_id'])
+        if distribution is None:
+            return None
+        
+        return {
+            'score': session['score'],
+            'rank': distribution.rank(session['score']),
+            'out_of': len(distribution),
+            'percentile_rank': distribution.percentile_rank(session['score']),
+            'grade': distribution.grade_for(session['score'], bands),
+        }
+    
+    def get_student_rollup(self, student_id: str) -> Optional[Dict]:
+        """Get a student's precomputed summary and rank by mean score"""
+        try:
+            conn = self._get_connection()
+            cursor = conn.cursor()
+            
+            cursor.execute('SELECT * FROM student_rollups WHERE student_id = ?', (student_id,))
+            row = cursor.fetchone()
+            if not row:
+                conn.close()
+                return None
+            
+            rollup = dict(row)
+            rollup['recent_scores'] = json.loads(rollup['recent_scores'])
+            
+            # Both counts are answered from idx_rollups_mean
+            cursor.execute('SELECT COUNT(*) FROM student_rollups WHERE mean_score > ?', (rollup['mean_score'],))
+            rollup['rank'] = cursor.fetchone()[0] + 1
+            cursor.execute('SELECT COUNT(*) FROM student_rollups WHERE mean_score IS NOT NULL')
+            rollup['ranked_students'] = cursor.fetchone()[0]
+            
+            conn.close()
+            return rollup
+            
+        except Exception as e:
+            print(f"Error retrieving student rollup: {e}")
+            return None
+    
+    def get_student_trend(self, student_id: str, window: int = 3) -> List[Dict]:
+        """Get a student's scores in time order with moving average and change over time"""
+        try:
+            conn = self._get_connection()
+            cursor = conn.cursor()
+            
+            cursor.execute(f'''
+                WITH student_sessions AS (
+                    SELECT gs.id, gs.assignment_id, a.assignment_name, gs.score, gs.processed_at
+                    FROM grading_sessions gs
+                    JOIN assignments a ON gs.assignment_id = a.id
+                    WHERE gs.student_id = ?
+                )
+                {STUDENT_TREND_SQL}
+            ''', (student_id, max(window, 1) - 1))
+            
+            results = [dict(row) for row in cursor.fetchall()]
+            conn.close()
+            
+            return results
+            
+        except Exception as e:
+            print(f"Error retrieving student trend: {e}")
+            return []
+    
+    def get_student_period_summary(self, student_id: str, period: str = 'month') -> List[Dict]:
+        """Get a student's attempts and average score per day, week, month or year"""
+        try:
+            conn = self._get_connection()
+            cursor = conn.cursor()
+            
+            cursor.execute(f'''
+                WITH student_sessions AS (
+                    SELECT score, processed_at FROM grading_sessions WHERE student_id = ?
+                )
+                {STUDENT_PERIOD_SQL}
+            ''', (student_id, PERIOD_FORMATS[period]))
+            
+            results = [dict(row) for row in cursor.fetchall()]
+            conn.close()
+            
+            return results
+            
+        except Exception as e:
+            print(f"Error retrieving student period summary: {e}")
+            return []
+    
+    def get_item_analysis(self, assignment_id: int, num_options: int = None) -> Optional[Dict]:
+        """
+        Get per-question difficulty, discrimination and distractor counts plus KR-20.
+        num_options defaults to the assignment's sheet layout.
+        """
+        try:
+            assignment = self.get_assignment(assignment_id)
+            if not assignment:
+                return None
+            answer_key = self.get_answer_key_array(assignment_id)
+            num_options = num_options or assignment['num_options']
+            
+            conn = self._connection_for_assignment(assignment_id)
+            session_ids, choices = load_response_matrix(conn, assignment_id, assignment['num_questions'],
+                                                        num_options=num_options)
+            conn.close()
+            
+            analysis = analyze_responses(choices, answer_key, num_options)
+            analysis['assignment_id'] = assignment_id
+            analysis['assignment_name'] = assignment['assignment_name']
+            return analysis
+            
+        except Exception as e:
+            print(f"Error computing item analysis: {e}")
+            return None
+
+    def get_similar_answer_pairs(self, assignment_id: int, min_shared: int = DEFAULT_MIN_SHARED_WRONG,
+                                 mode: str = 'exact', num_options: int = None, top: int = 50,
+                                 **options) -> List[Dict]:
+        """
+        Rank pairs of sessions of an assignment by the identical wrong answers they share
+        (see collusion_detection.find_similar_pairs for mode and options)
+        """
+        try:
+            assignment = self.get_assignment(assignment_id)
+            if not assignment:
+                return []
+            answer_key = self.get_answer_key_array(assignment_id)
+            num_options = num_options or assignment['num_options']
+            
+            conn = self._connection_for_assignment(assignment_id)
+            session_ids, choices = load_response_matrix(conn, assignment_id, assignment['num_questions'],
+                                                        num_options=num_options)
+            students = dict(conn.execute('SELECT id, student_id FROM grading_sessions WHERE assignment_id = ?',
+                                         (assignment_id,)).fetchall())
+            conn.close()
+            
+            pairs = find_similar_pairs(choices, answer_key, num_options, min_shared=min_shared, mode=mode,
+                                       top=top, **options)
+            for pair in pairs:
+                pair['session_a'] = int(session_ids[pair.pop('row_a')])
+                pair['session_b'] = int(session_ids[pair.pop('row_b')])
+                pair['student_a'] = students.get(pair['session_a'])
+                pair['student_b'] = students.get(pair['session_b'])
+            return pairs
+            
+        except Exception as e:
+            print(f"Error computing answer similarity: {e}")
+            return []
+    
+    def get_review_queue(self, status: str = 'pending', limit: int = 50) -> List[Dict]:
+        """Get review queue entries (oldest first) with their session details"""
+        try:
+            conn = self._get_connection()
+            cursor = conn.cursor()
+            
+            cursor.execute(REVIEW_QUEUE_SQL, (status, limit))
+            results = [decode_review_row(row) for row in cursor.fetchall()]
+            conn.close()
+            
+            return results
+            
+        except Exception as e:
+            print(f"Error retrieving review queue: {e}")
+            return []
+    
+    def resolve_review(self, session_id: int, corrected_answers: Dict[int, str] = None,
+                       note: str = None) -> Optional[Dict]:
+        """
+        Close a review entry, optionally correcting answers first ({question_number: letter},
+        'X' for blank). The session score and the student's rollup are recomputed.
+        Returns the updated session or None on failure.
+        """
+        try:
+            from database_setup import refresh_student_rollups
+            
+            conn = self._connection_for_session(session_id)
+            cursor = conn.cursor()
+            
+            cursor.execute('SELECT assignment_id, student_id, total_questions FROM grading_sessions WHERE id = ?',
+                           (session_id,))
+            session = cursor.fetchone()
+            if not session:
+                conn.close()
+                return None
+            
+            if corrected_answers:
+                cursor.executemany('''
+                    UPDATE detailed_results
+                    SET student_answer = ?, is_correct = (correct_answer = ?)
+                    WHERE session_id = ? AND question_number = ?
+                ''', [(answer, answer, session_id, int(question))
+                      for question, answer in corrected_answers.items()])
+                
+                cursor.execute('SELECT COUNT(*) FROM detailed_results WHERE session_id = ? AND is_correct',
+                               (session_id,))
+                correct = cursor.fetchone()[0]
+                score = correct / session['total_questions'] * 100 if session['total_questions'] else 0.0
+                cursor.execute('UPDATE grading_sessions SET score = ?, correct_answers = ? WHERE id = ?',
+                               (score, correct, session_id))
+                cursor.execute('UPDATE assignments SET scores_version = scores_version + 1 WHERE id = ?',
+                               (session['assignment_id'],))
+                refresh_student_rollups(cursor, [session['student_id']])
+            
+            cursor.execute('''
+                UPDATE review_queue
+                SET status = 'resolved', resolution_note = ?, resolved_at = CURRENT_TIMESTAMP
+                WHERE session_id = ?
+            ''', (note, session_id))
+            
+            conn.commit()
+            conn.close()
+            
+            return self.get_grading_session(session_id)
+            
+        except Exception as e:
+            print(f"Error resolving review: {e}")
+            return None
+    
+    def export_response_matrices(self, assignment_id: int, export_dir: str = MATRIX_EXPORT_DIR) -> Optional[Dict]:
+        """Bring the assignment's memory-mappable .npy export up to date (see matrix_export)"""
+        try:
+            assignment = self.get_assignment(assignment_id)
+            if not assignment:
+                return None
+            answer_key = self.get_answer_key_array(assignment_id)
+            
+            conn = self._connection_for_assignment(assignment_id)
+            meta = update_matrix_export(conn, assignment, answer_key, export_dir)
+            conn.close()
+            
+            return meta
+            
+        except Exception as e:
+            print(f"Error exporting response matrices: {e}")
+            return None
+    
+    def save_detection_profile(self, scope: str, scope_key, params: Dict,
+                               accuracy: float = None, ms_per_sheet: float = None) -> bool:
+        """Store tuned detection parameters for an assignment or a camera ('assignment' / 'camera' scope)"""
+        if scope not in ('assignment', 'camera'):
+            print(f"Unknown detection profile scope: {scope}")
+            return False
+        try:
+            conn = self._get_connection()
+            cursor = conn.cursor()
+            
+            cursor.execute('''
+                INSERT INTO detection_profiles (scope, scope_key, params, accuracy, ms_per_sheet)
+                VALUES (?, ?, ?, ?, ?)
+                ON CONFLICT (scope, scope_key) DO UPDATE SET
+                    params = excluded.params,
+                    accuracy = excluded.accuracy,
+                    ms_per_sheet = excluded.ms_per_sheet,
+                    updated_at = CURRENT_TIMESTAMP
+            ''', (scope, str(scope_key), json.dumps(params), accuracy, ms_per_sheet))
+            
+            conn.commit()
+            conn.close()
+            
+            return True
+            
+        except Exception as e:
+            print(f"Error saving detection profile: {e}")
+            return False
+    
+    def get_detection_profile(self, assignment_id: int = None, camera=None) -> Optional[Dict]:
+        """
+        Get the detection parameters to scan with: a camera profile wins over an
+        assignment profile. Returns None when neither exists (use the defaults).
+        """
+        candidates = []
+        if camera is not None:
+            candidates.append(('camera', str(camera)))
+        if assignment_id is not None:
+            candidates.append(('assignment', str(assignment_id)))
+        try:
+            conn = self._get_connection()
+            cursor = conn.cursor()
+            
+            for scope, scope_key in candidates:
+                cursor.execute('SELECT params FROM detection_profiles WHERE scope = ? AND scope_key = ?',
+                               (scope, scope_key))
+                row = cursor.fetchone()
+                if row:
+                    conn.close()
+                    return json.loads(row['params'])
+            
+            conn.close()
+            return None
+            
+        except Exception as e:
+            print(f"Error retrieving detection profile: {e}")
+            return None
+    
     def export_results_csv(self, assignment_id: int, filename: str = None) -> str:
         """Export assignment results to CSV"""
         try:
@@ -257,7 +1297,7 @@ class OptiGradeDatabase:
             with open(filename, 'w', newline='') as csvfile:
                 fieldnames = ['student_id', 'student_name', 'score', 'correct_answers', 
                              'total_questions', 'processed_at', 'assignment_name']
-                writer = csv.DictWriter(csvfile, fieldnames=fieldnames)
+                writer = csv.DictWriter(csvfile, fieldnames=fieldnames, extrasaction='ignore')
                 
                 writer.writeheader()
                 for result in results:
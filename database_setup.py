@@ -2,15 +2,88 @@ import sqlite3
 import os
 from datetime import datetime
 
-def create_database():
+# Number of most recent scores kept in each student rollup
+ROLLUP_RECENT_SCORES = 10
+
+def refresh_student_rollups(cursor, student_ids=None):
+    """Recompute student rollups from grading_sessions (all students or the given IDs)"""
+    if student_ids is not None:
+        student_ids = list(student_ids)
+        if not student_ids:
+            return
+        cursor.execute('CREATE TEMP TABLE IF NOT EXISTS rollup_targets (student_id TEXT PRIMARY KEY)')
+        cursor.execute('DELETE FROM rollup_targets')
+        cursor.executemany('INSERT OR IGNORE INTO rollup_targets VALUES (?)', [(s,) for s in student_ids])
+        cursor.execute('DELETE FROM student_rollups WHERE student_id IN (SELECT student_id FROM rollup_targets)')
+        target_filter = 'AND gs.student_id IN (SELECT student_id FROM rollup_targets)'
+    else:
+        cursor.execute('DELETE FROM student_rollups')
+        target_filter = ''
+    
+    cursor.execute(f'''
+        INSERT INTO student_rollups
+        (student_id, student_name, attempt_count, mean_score, best_score, worst_score,
+         recent_scores, last_processed_at)
+        SELECT gs.student_id,
+               (SELECT student_name FROM grading_sessions l
+                WHERE l.student_id = gs.student_id
+                ORDER BY l.processed_at DESC, l.id DESC LIMIT 1),
+               COUNT(*), AVG(gs.score), MAX(gs.score), MIN(gs.score),
+               (SELECT json_group_array(score) FROM (
+                    SELECT r.score FROM grading_sessions r
+                    WHERE r.student_id = gs.student_id
+                    ORDER BY r.processed_at DESC, r.id DESC LIMIT {ROLLUP_RECENT_SCORES})),
+               MAX(gs.processed_at)
+        FROM grading_sessions gs
+        WHERE gs.student_id IS NOT NULL {target_filter}
+        GROUP BY gs.student_id
+    ''')
+
+def create_detection_profiles_table(cursor):
+    """Create the table of tuned detection parameters (per assignment or per camera)"""
+    cursor.execute('''
+        CREATE TABLE IF NOT EXISTS detection_profiles (
+            scope TEXT NOT NULL,  -- 'assignment' or 'camera'
+            scope_key TEXT NOT NULL,  -- Assignment ID or camera index/URL
+            params TEXT NOT NULL,  -- JSON object of detection parameters
+            accuracy REAL,  -- Answer accuracy measured by the tuner
+            ms_per_sheet REAL,  -- Detection latency measured by the tuner
+            updated_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+            PRIMARY KEY (scope, scope_key)
+        )
+    ''')
+
+def create_journal_tables(cursor):
+    """Create the tables that make result journal ingestion idempotent and resumable"""
+    cursor.execute('''
+        CREATE TABLE IF NOT EXISTS journal_ingested (
+            uid TEXT PRIMARY KEY,  -- Journal record ID
+            session_id INTEGER NOT NULL,
+            ingested_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
+        )
+    ''')
+    cursor.execute('''
+        CREATE TABLE IF NOT EXISTS journal_checkpoints (
+            journal TEXT PRIMARY KEY,  -- Absolute journal file path
+            byte_offset INTEGER NOT NULL,  -- Everything before this offset is ingested
+            updated_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
+        )
+    ''')
+    # Archiving removes the entries of the sessions it moves
+    cursor.execute('CREATE INDEX IF NOT EXISTS idx_journal_ingested_session ON journal_ingested(session_id)')
+
+def create_database(db_path='data/optigrade.db', verbose=True):
     """Create the OptiGrade database with necessary tables"""
     
     # Create database directory if it doesn't exist
-    os.makedirs('data', exist_ok=True)
+    os.makedirs(os.path.dirname(db_path) or '.', exist_ok=True)
     
-    conn = sqlite3.connect('data/optigrade.db')
+    conn = sqlite3.connect(db_path)
     cursor = conn.cursor()
     
+    # Let archiving return freed pages to the OS (takes effect on new databases only)
+    cursor.execute('PRAGMA auto_vacuum = INCREMENTAL')
+    
     # Create assignments table
     cursor.execute('''
         CREATE TABLE IF NOT EXISTS assignments (
@@ -19,9 +92,20 @@ def create_database():
             num_questions INTEGER NOT NULL,
             answer_key TEXT NOT NULL,  -- JSON string of answer key
             created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
-            updated_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
+            updated_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+            closed_at TIMESTAMP,  -- Set once grading is finished; closed assignments can be archived
+            scores_version INTEGER NOT NULL DEFAULT 0,  -- Bumped whenever existing scores change
+            num_options INTEGER NOT NULL DEFAULT 5  -- Options per question on the sheet (5 = A-E)
         )
     ''')
+    cursor.execute('PRAGMA table_info(assignments)')
+    columns = [column[1] for column in cursor.fetchall()]
+    if 'closed_at' not in columns:
+        cursor.execute('ALTER TABLE assignments ADD COLUMN closed_at TIMESTAMP')
+    if 'scores_version' not in columns:
+        cursor.execute('ALTER TABLE assignments ADD COLUMN scores_version INTEGER NOT NULL DEFAULT 0')
+    if 'num_options' not in columns:
+        cursor.execute('ALTER TABLE assignments ADD COLUMN num_options INTEGER NOT NULL DEFAULT 5')
     
     # Create grading_sessions table
     cursor.execute('''
@@ -52,19 +136,103 @@ def create_database():
         )
     ''')
     
+    # Create student_rollups table, maintained incrementally on every saved result
+    cursor.execute("SELECT 1 FROM sqlite_master WHERE type = 'table' AND name = 'student_rollups'")
+    backfill_rollups = cursor.fetchone() is None
+    cursor.execute('''
+        CREATE TABLE IF NOT EXISTS student_rollups (
+            student_id TEXT PRIMARY KEY,
+            student_name TEXT,
+            attempt_count INTEGER NOT NULL DEFAULT 0,
+            mean_score REAL NOT NULL DEFAULT 0,
+            best_score REAL,
+            worst_score REAL,
+            recent_scores TEXT NOT NULL DEFAULT '[]',  -- JSON list of latest scores, newest first
+            last_processed_at TIMESTAMP
+        )
+    ''')
+    
+    # Create detection_profiles table
+    create_detection_profiles_table(cursor)
+    
+    # Create review_queue table for sheets that were graded with low confidence
+    cursor.execute('''
+        CREATE TABLE IF NOT EXISTS review_queue (
+            session_id INTEGER PRIMARY KEY,
+            reasons TEXT NOT NULL,  -- JSON list, e.g. ["few_answers", "ambiguous_marks"]
+            questions TEXT NOT NULL DEFAULT '[]',  -- JSON list of flagged question numbers
+            crop_path TEXT,  -- Cropped image of the bubble area
+            status TEXT NOT NULL DEFAULT 'pending',  -- 'pending' or 'resolved'
+            resolution_note TEXT,
+            created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+            resolved_at TIMESTAMP,
+            FOREIGN KEY (session_id) REFERENCES grading_sessions (id)
+        )
+    ''')
+    
+    # Create result journal bookkeeping tables
+    create_journal_tables(cursor)
+    
+    # Create answer_key_history table, one row per answer-key correction
+    cursor.execute('''
+        CREATE TABLE IF NOT EXISTS answer_key_history (
+            id INTEGER PRIMARY KEY AUTOINCREMENT,
+            assignment_id INTEGER NOT NULL,
+            old_answer_key TEXT NOT NULL,  -- JSON, as stored in assignments before the change
+            new_answer_key TEXT NOT NULL,
+            changed_questions TEXT NOT NULL,  -- JSON list of question numbers
+            reason TEXT,
+            sessions_regraded INTEGER NOT NULL DEFAULT 0,
+            sessions_changed INTEGER NOT NULL DEFAULT 0,
+            created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+            FOREIGN KEY (assignment_id) REFERENCES assignments (id)
+        )
+    ''')
+    
+    # Create regrade_audit table with the previous score of every session a regrade changed
+    cursor.execute('''
+        CREATE TABLE IF NOT EXISTS regrade_audit (
+            regrade_id INTEGER NOT NULL,
+            session_id INTEGER NOT NULL,
+            old_score REAL NOT NULL,
+            old_correct_answers INTEGER NOT NULL,
+            new_score REAL NOT NULL,
+            new_correct_answers INTEGER NOT NULL,
+            PRIMARY KEY (regrade_id, session_id),
+            FOREIGN KEY (regrade_id) REFERENCES answer_key_history (id)
+        )
+    ''')
+    
     # Create indexes for better performance
     cursor.execute('CREATE INDEX IF NOT EXISTS idx_sessions_assignment ON grading_sessions(assignment_id)')
+    cursor.execute('CREATE INDEX IF NOT EXISTS idx_sessions_assignment_score ON grading_sessions(assignment_id, score)')
     cursor.execute('CREATE INDEX IF NOT EXISTS idx_sessions_student ON grading_sessions(student_id)')
     cursor.execute('CREATE INDEX IF NOT EXISTS idx_detailed_session ON detailed_results(session_id)')
+    cursor.execute('CREATE INDEX IF NOT EXISTS idx_sessions_student_time ON grading_sessions(student_id, processed_at)')
+    cursor.execute('CREATE INDEX IF NOT EXISTS idx_rollups_mean ON student_rollups(mean_score)')
+    cursor.execute('CREATE INDEX IF NOT EXISTS idx_review_status ON review_queue(status, created_at)')
+    cursor.execute('CREATE INDEX IF NOT EXISTS idx_key_history_assignment ON answer_key_history(assignment_id)')
+    
+    # Databases created before rollups existed get them computed once
+    if backfill_rollups:
+        refresh_student_rollups(cursor)
     
     conn.commit()
     conn.close()
     
+    if not verbose:
+        return
+    
     print("Database created successfully!")
     print("Tables created:")
     print("- assignments: Store assignment configurations")
     print("- grading_sessions: Store grading session results")
     print("- detailed_results: Store individual question results")
+    print("- student_rollups: Store per-student performance summaries")
+    print("- detection_profiles: Store tuned detection parameters")
+    print("- review_queue: Store low-confidence sheets awaiting review")
+    print("- journal_ingested, journal_checkpoints: Track result journal ingestion")
+    print("- answer_key_history, regrade_audit: Track answer-key corrections and regrades")
 
 if __name__ == "__main__":
     create_database() 
\ No newline at end of file
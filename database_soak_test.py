@@ -0,0 +1,343 @@
+#!/usr/bin/env python3
+"""
+Concurrency soak test for OptiGradeDatabase.
+
+Builds (or reuses) a synthetic database, then runs writer and reader workers
+as threads or processes for a fixed time. Writers save grading results the
+way the scanner does; readers run a weighted mix of statistics, student
+lookups and CSV exports the way database_viewer users do.
+
+Every worker uses OptiGradeDatabase unchanged except for its connections:
+they are opened without SQLite's built-in busy timeout and retry busy
+statements themselves, so each wait for a lock is counted and timed. A
+statement still locked after --busy-timeout seconds fails with 'database is
+locked', exactly like a normal connection would.
+
+Usage:
+    python database_soak_test.py --sessions 50000 --writers 2 --readers 6 --duration 30
+    python database_soak_test.py --mode process --wal --mix stats=5,student=4,export=1
+"""
+
+import argparse
+import contextlib
+import io
+import multiprocessing as mp
+import os
+import queue
+import random
+import sqlite3
+import tempfile
+import threading
+import time
+from typing import Dict, List
+
+import numpy as np
+
+from database_manager import OptiGradeDatabase
+from database_setup import create_database
+
+SOAK_DB_PATH = 'data/soak/optigrade_soak.db'
+OPTIONS = 'ABCDE'
+
+# Reader operation -> weight, overridden with --mix
+DEFAULT_READ_MIX = {'stats': 5, 'student': 4, 'export': 1}
+
+
+class SoakStats:
+    """Latencies and lock counters collected by one worker"""
+
+    def __init__(self):
+        self.latencies = {}
+        self.failures = {}
+        self.lock_waits = 0
+        self.lock_wait_seconds = 0.0
+        self.locked_errors = 0
+
+    def record(self, op: str, seconds: float, failed: bool):
+        self.latencies.setdefault(op, []).append(seconds)
+        if failed:
+            self.failures[op] = self.failures.get(op, 0) + 1
+
+    def merge(self, other: 'SoakStats'):
+        for op, latencies in other.latencies.items():
+            self.latencies.setdefault(op, []).extend(latencies)
+        for op, count in other.failures.items():
+            self.failures[op] = self.failures.get(op, 0) + count
+        self.lock_waits += other.lock_waits
+        self.lock_wait_seconds += other.lock_wait_seconds
+        self.locked_errors += other.locked_errors
+
+
+class InstrumentedCursor(sqlite3.Cursor):
+    """Cursor whose statements wait for locks through the connection's retry loop"""
+
+    def execute(self, *args):
+        return self.connection.retry_busy(super().execute, *args)
+
+    def executemany(self, *args):
+        return self.connection.retry_busy(super().executemany, *args)
+
+
+class InstrumentedConnection(sqlite3.Connection):
+    """Connection that replaces SQLite's busy timeout with a counted retry loop"""
+
+    stats = None
+    busy_timeout = 5.0
+
+    def retry_busy(self, call, *args):
+        waited = 0.0
+        delay = 0.001
+        while True:
+            try:
+                return call(*args)
+            except sqlite3.OperationalError as e:
+                if 'locked' not in str(e) and 'busy' not in str(e):
+                    raise
+                if waited >= self.busy_timeout:
+                    self.stats.locked_errors += 1
+                    raise
+                if waited == 0.0:
+                    self.stats.lock_waits += 1
+                time.sleep(delay)
+                waited += delay
+                self.stats.lock_wait_seconds += delay
+                delay = min(delay * 2, 0.05)
+
+    def cursor(self, factory=InstrumentedCursor):
+        return super().cursor(factory)
+
+    def execute(self, *args):
+        return self.cursor().execute(*args)
+
+    def executemany(self, *args):
+        return self.cursor().executemany(*args)
+
+    def commit(self):
+        return self.retry_busy(super().commit)
+
+
+class InstrumentedDatabase(OptiGradeDatabase):
+    """OptiGradeDatabase whose connections count lock waits into a SoakStats"""
+
+    def __init__(self, db_path: str, stats: SoakStats, busy_timeout: float):
+        self.stats = stats
+        self.busy_timeout = busy_timeout
+        super().__init__(db_path)
+
+    def _get_connection(self):
+        conn = sqlite3.connect(self.db_path, timeout=0, factory=InstrumentedConnection)
+        conn.stats = self.stats
+        conn.busy_timeout = self.busy_timeout
+        conn.row_factory = sqlite3.Row
+        return conn
+
+
+def random_answers(rng: random.Random, num_questions: int) -> List[str]:
+    return [rng.choice(OPTIONS) for _ in range(num_questions)]
+
+
+def make_result(rng: random.Random, assignment_id: int, answer_key: List[str], student_no: int) -> Dict:
+    """One plausible grading result in save_grading_result's keyword format"""
+    # Students answer most questions correctly, the rest at random
+    skill = rng.uniform(0.4, 0.95)
+    detected = [key if rng.random() < skill else rng.choice(OPTIONS + 'X') for key in answer_key]
+    detailed = [{'question_number': q, 'correct_answer': key, 'student_answer': answer,
+                 'is_correct': answer == key}
+                for q, (key, answer) in enumerate(zip(answer_key, detected), 1)]
+    correct = sum(row['is_correct'] for row in detailed)
+    return {
+        'assignment_id': assignment_id,
+        'student_name': f"Soak Student {student_no}",
+        'student_id': f"SOAK_{student_no:06d}",
+        'score': correct / len(answer_key) * 100,
+        'correct_answers': correct,
+        'total_questions': len(answer_key),
+        'detailed_results': detailed,
+    }
+
+
+def build_soak_database(db_path: str, sessions: int, assignments: int, questions: int,
+                        students: int, seed: int = 0):
+    """Create a synthetic database with the given number of graded sessions"""
+    rng = random.Random(seed)
+    if os.path.exists(db_path):
+        os.remove(db_path)
+    create_database(db_path, verbose=False)
+    db = OptiGradeDatabase(db_path)
+
+    keys = {}
+    for number in range(1, assignments + 1):
+        answer_key = random_answers(rng, questions)
+        key_dict = {q: answer for q, answer in enumerate(answer_key)}
+        keys[db.save_assignment(f"Soak Assignment {number}", questions, key_dict)] = answer_key
+
+    started = time.perf_counter()
+    batch = []
+    for _ in range(sessions):
+        assignment_id = rng.choice(list(keys))
+        batch.append(make_result(rng, assignment_id, keys[assignment_id], rng.randrange(students)))
+        if len(batch) >= 1000:
+            db.save_grading_results(batch)
+            batch = []
+    if batch:
+        db.save_grading_results(batch)
+    return time.perf_counter() - started
+
+
+def run_worker(role: str, worker_no: int, config: Dict, results):
+    """Run one writer or reader until the deadline and put its SoakStats on results"""
+    stats = SoakStats()
+    try:
+        run_operations(role, worker_no, config, stats)
+    finally:
+        # Always report, a crashed worker must not leave the run waiting
+        results.put(stats)
+
+
+def run_operations(role: str, worker_no: int, config: Dict, stats: SoakStats):
+    """Operation loop of one worker"""
+    db = InstrumentedDatabase(config['db_path'], stats, config['busy_timeout'])
+    rng = random.Random(config['seed'] * 1000 + worker_no)
+    assignments = {}
+    for assignment in db.get_assignments():
+        answer_key = db.get_assignment(assignment['id'])['answer_key']
+        assignments[assignment['id']] = [answer_key[q] for q in sorted(answer_key, key=int)]
+    assignment_ids = list(assignments)
+    read_ops = list(config['read_mix'])
+    read_weights = [config['read_mix'][op] for op in read_ops]
+    export_dir = tempfile.mkdtemp(prefix='optigrade_soak_')
+
+    while time.time() < config['start_at']:
+        time.sleep(0.01)
+
+    # Methods report errors by printing; keep the report readable (threads share the run's redirect)
+    quiet = config['mode'] == 'process' and not config['verbose']
+    with contextlib.redirect_stdout(io.StringIO()) if quiet else contextlib.nullcontext():
+        while time.time() < config['stop_at']:
+            assignment_id = rng.choice(assignment_ids)
+            if role == 'writer':
+                op = 'save'
+                result = make_result(rng, assignment_id, assignments[assignment_id],
+                                     rng.randrange(config['students']))
+            else:
+                op = rng.choices(read_ops, read_weights)[0]
+
+            errors_before = stats.locked_errors
+            started = time.perf_counter()
+            if op == 'save':
+                ok = db.save_grading_result(**result) is not None
+            elif op == 'stats':
+                ok = bool(db.get_statistics(assignment_id))
+            elif op == 'student':
+                db.get_student_results(f"SOAK_{rng.randrange(config['students']):06d}")
+                ok = True
+            else:
+                ok = db.export_results_csv(
+                    assignment_id, os.path.join(export_dir, f"worker_{worker_no}.csv")) is not None
+            stats.record(op, time.perf_counter() - started,
+                         failed=not ok or stats.locked_errors > errors_before)
+
+            if role == 'writer' and config['write_pause']:
+                time.sleep(config['write_pause'])
+
+
+def parse_mix(text: str) -> Dict[str, float]:
+    """Parse 'stats=5,student=4,export=1' into a weight per reader operation"""
+    mix = {}
+    for part in text.split(','):
+        op, _, weight = part.partition('=')
+        if op.strip() not in DEFAULT_READ_MIX:
+            raise argparse.ArgumentTypeError(f"unknown operation '{op}' (use {', '.join(DEFAULT_READ_MIX)})")
+        mix[op.strip()] = float(weight or 1)
+    return mix
+
+
+def run_soak(config: Dict, writers: int, readers: int, mode: str) -> SoakStats:
+    """Start all workers, wait for them and merge their statistics"""
+    results = mp.Queue() if mode == 'process' else queue.Queue()
+    worker_class = mp.Process if mode == 'process' else threading.Thread
+
+    config['start_at'] = time.time() + 1.0
+    config['stop_at'] = config['start_at'] + config['duration']
+    workers = [worker_class(target=run_worker, args=(role, number, config, results))
+               for number, role in enumerate(['writer'] * writers + ['reader'] * readers)]
+    quiet = mode == 'thread' and not config['verbose']
+    total = SoakStats()
+    with contextlib.redirect_stdout(io.StringIO()) if quiet else contextlib.nullcontext():
+        for worker in workers:
+            worker.start()
+        for _ in workers:
+            total.merge(results.get())
+        for worker in workers:
+            worker.join()
+    return total
+
+
+def print_report(stats: SoakStats, duration: float):
+    """Throughput and latency percentiles per operation, then lock counters"""
+    print(f"\n{'operation':<10}{'count':>8}{'ops/s':>9}{'p50 ms':>9}{'p95 ms':>9}"
+          f"{'p99 ms':>9}{'max ms':>9}{'failed':>8}")
+    for op, latencies in sorted(stats.latencies.items()):
+        ms = np.array(latencies) * 1000
+        p50, p95, p99 = np.percentile(ms, [50, 95, 99])
+        print(f"{op:<10}{len(ms):>8}{len(ms) / duration:>9.1f}{p50:>9.1f}{p95:>9.1f}"
+              f"{p99:>9.1f}{ms.max():>9.1f}{stats.failures.get(op, 0):>8}")
+
+    total_ops = sum(len(latencies) for latencies in stats.latencies.values())
+    print(f"\nTotal: {total_ops} operations, {total_ops / duration:.1f} ops/s")
+    print(f"Lock waits: {stats.lock_waits} statements waited {stats.lock_wait_seconds:.2f}s in total")
+    print(f"'database is locked' failures: {stats.locked_errors}")
+
+
+def main():
+    """Command line entry point"""
+    parser = argparse.ArgumentParser(description='Soak test OptiGradeDatabase with concurrent readers and writers')
+    parser.add_argument('--db', default=SOAK_DB_PATH, help='synthetic database path')
+    parser.add_argument('--rebuild', action='store_true', help='recreate the synthetic database')
+    parser.add_argument('--sessions', type=int, default=50000, help='sessions in the synthetic database')
+    parser.add_argument('--assignments', type=int, default=20)
+    parser.add_argument('--questions', type=int, default=50)
+    parser.add_argument('--students', type=int, default=2000)
+    parser.add_argument('--writers', type=int, default=2)
+    parser.add_argument('--readers', type=int, default=4)
+    parser.add_argument('--mode', choices=('thread', 'process'), default='thread')
+    parser.add_argument('--duration', type=float, default=30.0, help='seconds to run')
+    parser.add_argument('--mix', type=parse_mix, default=dict(DEFAULT_READ_MIX),
+                        help='reader operation weights, e.g. stats=5,student=4,export=1')
+    parser.add_argument('--write-pause', type=float, default=0.0, help='seconds between writes per writer')
+    parser.add_argument('--busy-timeout', type=float, default=5.0, help='seconds a statement waits for a lock')
+    parser.add_argument('--wal', action='store_true', help='switch the database to WAL journaling first')
+    parser.add_argument('--seed', type=int, default=0)
+    parser.add_argument('--verbose', action='store_true', help='show errors printed by the database methods')
+    args = parser.parse_args()
+
+    if args.rebuild or not os.path.exists(args.db):
+        print(f"Building synthetic database with {args.sessions} sessions...")
+        with contextlib.redirect_stdout(io.StringIO()):
+            elapsed = build_soak_database(args.db, args.sessions, args.assignments, args.questions,
+                                          args.students, args.seed)
+        print(f"Built {args.db} in {elapsed:.1f}s")
+
+    conn = sqlite3.connect(args.db)
+    journal_mode = conn.execute(f"PRAGMA journal_mode = {'WAL' if args.wal else 'DELETE'}").fetchone()[0]
+    conn.close()
+
+    config = {
+        'db_path': args.db,
+        'busy_timeout': args.busy_timeout,
+        'duration': args.duration,
+        'read_mix': args.mix,
+        'students': args.students,
+        'write_pause': args.write_pause,
+        'seed': args.seed,
+        'verbose': args.verbose,
+        'mode': args.mode,
+    }
+    print(f"Running {args.writers} writer(s) and {args.readers} reader(s) as {args.mode} workers "
+          f"for {args.duration:.0f}s (journal mode {journal_mode})...")
+    stats = run_soak(config, args.writers, args.readers, args.mode)
+    print_report(stats, args.duration)
+
+
+if __name__ == "__main__":
+    main()
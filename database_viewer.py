@@ -4,7 +4,6 @@ Database Viewer for OptiGrade
 A utility to explore and query the OptiGrade database
 """
 
-import sqlite3
 import json
 from datetime import datetime
 from database_manager import OptiGradeDatabase
@@ -20,32 +19,20 @@ def view_all_assignments(db):
     print_separator()
     
     try:
-        conn = sqlite3.connect(db.db_path)
-        cursor = conn.cursor()
-        
-        cursor.execute('''
-            SELECT id, assignment_name, num_questions, created_at, 
-                   (SELECT COUNT(*) FROM grading_sessions WHERE assignment_id = assignments.id) as session_count
-            FROM assignments 
-            ORDER BY created_at DESC
-        ''')
-        
-        assignments = cursor.fetchall()
+        assignments = db.get_assignments()
         
         if not assignments:
             print("No assignments found in database.")
             return
         
         for assignment in assignments:
-            print(f"ID: {assignment[0]}")
-            print(f"Name: {assignment[1]}")
-            print(f"Questions: {assignment[2]}")
-            print(f"Created: {assignment[3]}")
-            print(f"Sessions: {assignment[4]}")
+            print(f"ID: {assignment['id']}")
+            print(f"Name: {assignment['assignment_name']}")
+            print(f"Questions: {assignment['num_questions']}")
+            print(f"Created: {assignment['created_at']}")
+            print(f"Sessions: {assignment['session_count']}")
             print("-" * 40)
         
-        conn.close()
-        
     except Exception as e:
         print(f"Error viewing assignments: {e}")
 
@@ -67,8 +54,9 @@ def view_assignment_details(db, assignment_id):
         print(f"Updated: {assignment['updated_at']}")
         
         print(f"\nAnswer Key:")
-        for q_num, ans_idx in assignment['answer_key'].items():
-            print(f"  Q{q_num + 1}: {chr(65 + ans_idx)}")  # Convert 0-4 to A-E
+        # Keys come back from JSON as strings; answers are letters or 0-4 indexes
+        for q_num, answer in sorted(assignment['answer_key'].items(), key=lambda item: int(item[0])):
+            print(f"  Q{int(q_num) + 1}: {answer if isinstance(answer, str) else chr(65 + answer)}")
         
         # Get statistics
         stats = db.get_statistics(assignment_id)
@@ -79,6 +67,20 @@ def view_assignment_details(db, assignment_id):
             print(f"  Highest Score: {stats['max_score']:.2f}%")
             print(f"  Lowest Score: {stats['min_score']:.2f}%")
         
+        distribution = db.get_score_distribution(assignment_id)
+        if distribution:
+            print(f"\nPercentiles:")
+            print("  " + "  ".join(f"P{p}: {distribution.percentile(p):.1f}%" for p in (10, 25, 50, 75, 90)))
+            print(f"\nGrades:")
+            for grade, count in distribution.band_counts().items():
+                print(f"  {grade}: {count}")
+            print(f"\nScore Histogram:")
+            histogram = distribution.histogram()
+            largest = max(score_bin['count'] for score_bin in histogram) or 1
+            for score_bin in histogram:
+                bar = '#' * round(score_bin['count'] / largest * 40)
+                print(f"  {score_bin['start']:>5.0f}-{score_bin['end']:<5.0f} {score_bin['count']:>6} {bar}")
+        
     except Exception as e:
         print(f"Error viewing assignment details: {e}")
 
@@ -89,35 +91,20 @@ def view_recent_sessions(db, limit=10):
     print_separator()
     
     try:
-        conn = sqlite3.connect(db.db_path)
-        cursor = conn.cursor()
-        
-        cursor.execute('''
-            SELECT gs.id, gs.student_name, gs.student_id, gs.score, 
-                   gs.correct_answers, gs.total_questions, gs.processed_at,
-                   a.assignment_name
-            FROM grading_sessions gs
-            JOIN assignments a ON gs.assignment_id = a.id
-            ORDER BY gs.processed_at DESC
-            LIMIT ?
-        ''', (limit,))
-        
-        sessions = cursor.fetchall()
+        sessions = db.get_recent_sessions(limit)
         
         if not sessions:
             print("No grading sessions found.")
             return
         
         for session in sessions:
-            print(f"Session ID: {session[0]}")
-            print(f"Student: {session[1]} (ID: {session[2]})")
-            print(f"Assignment: {session[7]}")
-            print(f"Score: {session[3]:.2f}% ({session[4]}/{session[5]} correct)")
-            print(f"Processed: {session[6]}")
+            print(f"Session ID: {session['id']}")
+            print(f"Student: {session['student_name']} (ID: {session['student_id']})")
+            print(f"Assignment: {session['assignment_name']}")
+            print(f"Score: {session['score']:.2f}% ({session['correct_answers']}/{session['total_questions']} correct)")
+            print(f"Processed: {session['processed_at']}")
             print("-" * 40)
         
-        conn.close()
-        
     except Exception as e:
         print(f"Error viewing recent sessions: {e}")
 
@@ -128,25 +115,33 @@ def view_student_performance(db, student_id):
     print_separator()
     
     try:
-        results = db.get_student_results(student_id)
+        rollup = db.get_student_rollup(student_id)
         
-        if not results:
+        if not rollup:
             print(f"No results found for student {student_id}")
             return
         
-        # Group by student name
-        student_name = results[0]['student_name']
-        print(f"Student Name: {student_name}")
+        print(f"Student Name: {rollup['student_name']}")
         print(f"Student ID: {student_id}")
-        print(f"Total Assignments: {len(results)}")
-        
-        total_score = sum(r['score'] for r in results)
-        avg_score = total_score / len(results)
-        print(f"Average Score: {avg_score:.2f}%")
-        
-        print(f"\nAssignment History:")
-        for result in results:
-            print(f"  {result['assignment_name']}: {result['score']:.2f}% ({result['processed_at']})")
+        print(f"Total Assignments: {rollup['attempt_count']}")
+        print(f"Average Score: {rollup['mean_score']:.2f}%")
+        print(f"Best Score: {rollup['best_score']:.2f}%")
+        print(f"Worst Score: {rollup['worst_score']:.2f}%")
+        if rollup['rank']:
+            print(f"Rank: {rollup['rank']} of {rollup['ranked_students']}")
+        print(f"Recent Scores: {', '.join(f'{score:.0f}' for score in rollup['recent_scores'])}")
+        
+        trend = db.get_student_trend(student_id)
+        print(f"\nAssignment History (last {min(len(trend), 10)}, 3-attempt moving average):")
+        for result in trend[-10:]:
+            change = f"{result['change']:+.2f}" if result['change'] is not None else "  -"
+            print(f"  {result['assignment_name']}: {result['score']:.2f}% "
+                  f"(avg {result['moving_average']:.2f}%, change {change}) ({result['processed_at']})")
+        
+        print(f"\nMonthly Summary:")
+        for period in db.get_student_period_summary(student_id, 'month'):
+            print(f"  {period['period']}: {period['attempts']} attempts, "
+                  f"average {period['average_score']:.2f}%")
         
     except Exception as e:
         print(f"Error viewing student performance: {e}")
@@ -169,6 +164,11 @@ def view_session_details(db, session_id):
         print(f"Correct Answers: {session['correct_answers']}/{session['total_questions']}")
         print(f"Processed: {session['processed_at']}")
         
+        standing = db.get_session_standing(session_id)
+        if standing:
+            print(f"Rank: {standing['rank']} of {standing['out_of']} "
+                  f"(percentile {standing['percentile_rank']:.1f}, grade {standing['grade']})")
+        
         if session['image_path']:
             print(f"Image: {session['image_path']}")
         
@@ -184,6 +184,189 @@ def view_session_details(db, session_id):
     except Exception as e:
         print(f"Error viewing session details: {e}")
 
+def view_item_analysis(db, assignment_id):
+    """View per-question statistics for an assignment"""
+    print_separator()
+    print(f"ITEM ANALYSIS - Assignment ID: {assignment_id}")
+    print_separator()
+    
+    try:
+        analysis = db.get_item_analysis(assignment_id)
+        if not analysis:
+            print(f"Assignment with ID {assignment_id} not found.")
+            return
+        if analysis['num_students'] == 0:
+            print("No question-level results recorded for this assignment.")
+            return
+        
+        print(f"Assignment: {analysis['assignment_name']}")
+        print(f"Students: {analysis['num_students']}")
+        print(f"Average Correct: {analysis['mean_correct']:.2f}/{analysis['num_questions']}")
+        print(f"Reliability (KR-20): {analysis['kr20']:.3f}")
+        
+        print(f"\n{'Q':>4} {'Key':>4} {'Difficulty':>11} {'Discrim.':>9}  Option counts")
+        for item in analysis['items']:
+            options = ' '.join(f"{letter}:{count}" for letter, count in item['option_counts'].items())
+            print(f"{item['question_number']:>4} {item['correct_answer'] or '-':>4} "
+                  f"{item['difficulty']:>11.2f} {item['discrimination']:>9.2f}  "
+                  f"{options} blank:{item['blank_count']}")
+        
+    except Exception as e:
+        print(f"Error viewing item analysis: {e}")
+
+def view_answer_similarity(db, assignment_id):
+    """View pairs of students with suspiciously similar wrong answers"""
+    print_separator()
+    print(f"ANSWER SIMILARITY - Assignment ID: {assignment_id}")
+    print_separator()
+    
+    try:
+        pairs = db.get_similar_answer_pairs(assignment_id, top=20)
+        if not pairs:
+            print("No suspicious pairs found.")
+            return
+        
+        print("Pairs ranked by how rare their shared wrong answers are:")
+        print(f"{'Student A':<22} {'Student B':<22} {'Shared wrong':>14} {'Identical':>10} {'Rarity':>8}")
+        print("-" * 80)
+        for pair in pairs:
+            shared = f"{pair['shared_wrong']} of {min(pair['wrong_a'], pair['wrong_b'])}"
+            print(f"{pair['student_a']:<22} {pair['student_b']:<22} {shared:>14} "
+                  f"{pair['identical_answers']:>10} {pair['rarity']:>8.1f}")
+        
+    except Exception as e:
+        print(f"Error viewing answer similarity: {e}")
+
+def parse_corrections(text, num_questions=None, valid_answers=None):
+    """
+    Parse corrections like '3=B, 7=X' into {question_number: answer}.
+    Raises ValueError for questions outside 1..num_questions or answers not in valid_answers.
+    """
+    corrections = {}
+    for part in text.replace(' ', '').split(','):
+        if not part:
+            continue
+        question, answer = part.split('=')
+        question, answer = int(question), answer.upper() or 'X'
+        if num_questions is not None and not 1 <= question <= num_questions:
+            raise ValueError(f"question {question} is not on the sheet")
+        if valid_answers is not None and answer not in valid_answers:
+            raise ValueError(f"'{answer}' is not a valid answer for question {question}")
+        corrections[question] = answer
+    return corrections
+
+def review_queue_menu(db):
+    """Work through sheets that were graded with low confidence"""
+    print_separator()
+    print("REVIEW QUEUE")
+    print_separator()
+    
+    try:
+        entries = db.get_review_queue()
+        if not entries:
+            print("No sheets waiting for review.")
+            return
+        
+        print(f"{'Session':<12} {'Student':<22} {'Score':<8} {'Reasons':<28} Questions")
+        print("-" * 80)
+        for entry in entries:
+            questions = ', '.join(str(q) for q in entry['questions']) or '-'
+            print(f"{entry['session_id']:<12} {entry['student_id']:<22} {entry['score']:<8.1f} "
+                  f"{', '.join(entry['reasons']):<28} {questions}")
+        
+        session_id = input("\nEnter session ID to review (or press Enter to go back): ").strip()
+        if not session_id:
+            return
+        entry = next((e for e in entries if str(e['session_id']) == session_id), None)
+        if not entry:
+            print("Session is not in the review queue.")
+            return
+        
+        view_session_details(db, entry['session_id'])
+        if entry['crop_path']:
+            print(f"\nCropped sheet: {entry['crop_path']}")
+            if input("Show cropped sheet? (y/N): ").strip().lower() == 'y':
+                import cv2
+                crop = cv2.imread(entry['crop_path'])
+                if crop is not None:
+                    cv2.imshow('OptiGrade Review', crop)
+                    cv2.waitKey(0)
+                    cv2.destroyAllWindows()
+        
+        text = input("\nCorrections as question=answer, e.g. '3=B, 7=X' (Enter to accept as graded): ").strip()
+        assignment = db.get_assignment(entry['assignment_id']) or {}
+        letters = [chr(65 + i) for i in range(assignment.get('num_options') or 26)]
+        try:
+            corrections = parse_corrections(text, assignment.get('num_questions'), letters + ['X'])
+        except ValueError as e:
+            print(f"Invalid corrections ({e}), nothing changed.")
+            return
+        note = input("Note (optional): ").strip() or None
+        
+        session = db.resolve_review(entry['session_id'], corrections, note)
+        if session:
+            print(f"Review resolved. Score: {session['score']:.2f}% "
+                  f"({session['correct_answers']}/{session['total_questions']})")
+        else:
+            print("Could not resolve the review.")
+        
+    except Exception as e:
+        print(f"Error in review queue: {e}")
+
+def correct_answer_key_menu(db):
+    """Correct an assignment's answer key and regrade its sessions"""
+    print_separator()
+    print("CORRECT ANSWER KEY")
+    print_separator()
+    
+    try:
+        assignment_id = input("Enter assignment ID: ").strip()
+        if not assignment_id:
+            return
+        assignment = db.get_assignment(int(assignment_id))
+        if not assignment:
+            print(f"Assignment with ID {assignment_id} not found.")
+            return
+        
+        # Keys are stored by 0-based question index, shown 1-based like everywhere else
+        answer_key = {int(q): answer for q, answer in assignment['answer_key'].items()}
+        print(f"Assignment: {assignment['assignment_name']}")
+        print("Current key: " + ', '.join(f"{q + 1}={answer_key[q]}" for q in sorted(answer_key)))
+        
+        for entry in db.get_answer_key_history(assignment['id']):
+            print(f"  {entry['created_at']}: questions {entry['changed_questions']} corrected, "
+                  f"{entry['sessions_changed']}/{entry['sessions_regraded']} sessions changed"
+                  + (f" ({entry['reason']})" if entry['reason'] else ''))
+        
+        text = input("\nCorrections as question=answer, e.g. '3=B, 7=D' (Enter to cancel): ").strip()
+        if not text:
+            return
+        # A key answer has to be one of the sheet's options; blanks ('X') are not allowed
+        letters = [chr(65 + i) for i in range(assignment['num_options'])]
+        try:
+            corrections = parse_corrections(text, assignment['num_questions'], letters)
+        except ValueError as e:
+            print(f"Invalid corrections ({e}), nothing changed. Answers must be {letters[0]}-{letters[-1]}.")
+            return
+        for question, answer in corrections.items():
+            answer_key[question - 1] = answer
+        reason = input("Reason (optional): ").strip() or None
+        
+        summary = db.update_answer_key(assignment['id'], answer_key, reason)
+        if summary:
+            print(f"Regraded {summary['sessions_regraded']} sessions in {summary['seconds']:.2f}s, "
+                  f"{summary['sessions_changed']} scores changed.")
+            if summary['sessions_not_regraded']:
+                print(f"{summary['sessions_not_regraded']} sessions have no stored answers "
+                      f"and kept their old score.")
+        else:
+            print("Could not update the answer key.")
+        
+    except ValueError:
+        print("Invalid assignment ID.")
+    except Exception as e:
+        print(f"Error correcting answer key: {e}")
+
 def export_data_menu(db):
     """Menu for data export options"""
     print_separator()
@@ -191,12 +374,8 @@ def export_data_menu(db):
     print_separator()
     
     try:
-        conn = sqlite3.connect(db.db_path)
-        cursor = conn.cursor()
-        
         # Get all assignments
-        cursor.execute('SELECT id, assignment_name FROM assignments ORDER BY assignment_name')
-        assignments = cursor.fetchall()
+        assignments = sorted(db.get_assignments(), key=lambda a: a['assignment_name'])
         
         if not assignments:
             print("No assignments available for export.")
@@ -204,7 +383,7 @@ def export_data_menu(db):
         
         print("Available assignments for export:")
         for assignment in assignments:
-            print(f"  {assignment[0]}: {assignment[1]}")
+            print(f"  {assignment['id']}: {assignment['assignment_name']}")
         
         assignment_id = input("\nEnter assignment ID to export (or press Enter to cancel): ").strip()
         if not assignment_id:
@@ -220,8 +399,6 @@ def export_data_menu(db):
         except ValueError:
             print("Invalid assignment ID.")
         
-        conn.close()
-        
     except Exception as e:
         print(f"Error in export menu: {e}")
 
@@ -244,9 +421,13 @@ def main():
         print("5. View Session Details")
         print("6. Export Data to CSV")
         print("7. View Database Statistics")
-        print("8. Exit")
+        print("8. View Item Analysis")
+        print("9. Review Queue")
+        print("10. Correct Answer Key and Regrade")
+        print("11. View Answer Similarity")
+        print("12. Exit")
         
-        choice = input("\nSelect an option (1-8): ").strip()
+        choice = input("\nSelect an option (1-12): ").strip()
         
         if choice == '1':
             view_all_assignments(db)
@@ -304,11 +485,33 @@ def main():
                 print("No data available for statistics.")
         
         elif choice == '8':
+            assignment_id = input("Enter assignment ID: ").strip()
+            if assignment_id:
+                try:
+                    view_item_analysis(db, int(assignment_id))
+                except ValueError:
+                    print("Invalid assignment ID.")
+        
+        elif choice == '9':
+            review_queue_menu(db)
+        
+        elif choice == '10':
+            correct_answer_key_menu(db)
+        
+        elif choice == '11':
+            assignment_id = input("Enter assignment ID: ").strip()
+            if assignment_id:
+                try:
+                    view_answer_similarity(db, int(assignment_id))
+                except ValueError:
+                    print("Invalid assignment ID.")
+        
+        elif choice == '12':
             print("Thank you for using the OptiGrade Database Viewer!")
             break
         
         else:
-            print("Invalid option. Please select 1-8.")
+            print("Invalid option. Please select 1-12.")
 
 if __name__ == "__main__":
     main() 
\ No newline at end of file
@@ -0,0 +1,192 @@
+#!/usr/bin/env python3
+"""
+OptiGrade Detection Tuner
+Searches the bubble detection parameters for the values that read a labeled
+set of sheet images best, and saves them as a detection profile.
+
+The labeled directory holds the sheet images plus a labels.json mapping each
+file name to its true answers, e.g. {"sheet_01.jpg": "ABDCA", "sheet_02.jpg": ["B", "X", "C"]}
+('X' for a question left blank).
+
+Grayscale and threshold images do not depend on the parameters, so every
+worker prepares them once and each configuration only repeats the bubble
+search. Configurations are ranked by answer accuracy, then per-sheet latency.
+
+Usage:
+    python detection_tuner.py sheets/ --search random --trials 300 --assignment-id 3
+    python detection_tuner.py sheets/ --search grid --camera 0 --workers 8
+"""
+
+import argparse
+import itertools
+import json
+import os
+import random
+import time
+from concurrent.futures import ProcessPoolExecutor
+from typing import Dict, List
+
+import cv2
+
+from database_manager import OptiGradeDatabase
+from omr_detector import DEFAULT_DETECTION_PARAMS, read_marked_answers
+
+LABELS_FILE = 'labels.json'
+
+# Values tried for every parameter (the defaults are always included). The
+# ambiguity_margin is left out on purpose: it only decides which sheets go to
+# review and never changes the detected answers, so it is not tuned or saved.
+SEARCH_SPACE = {
+    'min_area': [50, 100, 200, 400],
+    'max_area': [3000, 5000, 8000],
+    'min_aspect': [0.7, 0.8, 0.9],
+    'max_aspect': [1.1, 1.2, 1.3],
+    'row_bucket': [30, 50, 70],
+    'row_band': [20, 30, 40],
+    'min_bubble_fraction': [0.6, 0.8, 0.9],
+    'mark_threshold': [80, 100, 120, 140],
+}
+
+# Sheets prepared once per worker process: (gray, thresh, true answers)
+_sheets = []
+_prepare_ms = 0.0
+
+
+def load_labels(sheet_dir: str) -> Dict[str, List[str]]:
+    """Read labels.json and normalise every entry to a list of answer letters"""
+    with open(os.path.join(sheet_dir, LABELS_FILE)) as labels_file:
+        labels = json.load(labels_file)
+    return {name: [answer.strip().upper() or 'X' for answer in answers]
+            for name, answers in labels.items()}
+
+
+def _init_worker(sheet_dir: str, labels: Dict[str, List[str]]):
+    """Decode and threshold the labeled sheets once per worker process"""
+    global _prepare_ms
+    started = time.perf_counter()
+    for name, answers in sorted(labels.items()):
+        frame = cv2.imread(os.path.join(sheet_dir, name))
+        if frame is None:
+            continue
+        gray = cv2.cvtColor(frame, cv2.COLOR_BGR2GRAY)
+        blurred = cv2.GaussianBlur(gray, (5, 5), 0)
+        _, thresh = cv2.threshold(blurred, 0, 255, cv2.THRESH_BINARY_INV + cv2.THRESH_OTSU)
+        _sheets.append((gray, thresh, answers))
+    if _sheets:
+        _prepare_ms = (time.perf_counter() - started) * 1000 / len(_sheets)
+
+
+def evaluate_params(params: Dict, num_options: int) -> Dict:
+    """Score one parameter set on every labeled sheet (runs in a worker process)"""
+    correct = total = detected = exact = 0
+    started = time.perf_counter()
+    for gray, thresh, answers in _sheets:
+        found = read_marked_answers(gray, thresh, len(answers), num_options, params)
+        total += len(answers)
+        if not found:
+            continue
+        detected += 1
+        matches = sum(1 for got, expected in zip(found, answers) if got == expected)
+        correct += matches
+        exact += matches == len(answers)
+    elapsed_ms = (time.perf_counter() - started) * 1000
+
+    sheets = len(_sheets) or 1
+    return {
+        'params': params,
+        'accuracy': correct / total if total else 0.0,
+        'detected_rate': detected / sheets,
+        'exact_rate': exact / sheets,
+        'ms_per_sheet': _prepare_ms + elapsed_ms / sheets,
+    }
+
+
+def generate_configs(search: str, trials: int, seed: int = 0) -> List[Dict]:
+    """Parameter sets to try: the full grid, or random samples from it; defaults come first"""
+    names = list(SEARCH_SPACE)
+    configs = [{name: DEFAULT_DETECTION_PARAMS[name] for name in names}]
+    if search == 'grid':
+        combinations = itertools.product(*(SEARCH_SPACE[name] for name in names))
+        configs.extend(dict(zip(names, values)) for values in combinations)
+    else:
+        rng = random.Random(seed)
+        configs.extend({name: rng.choice(SEARCH_SPACE[name]) for name in names} for _ in range(trials))
+
+    # Skip impossible ranges and duplicates
+    unique = {}
+    for config in configs:
+        if config['min_area'] < config['max_area'] and config['min_aspect'] < config['max_aspect']:
+            unique.setdefault(tuple(sorted(config.items())), config)
+    return list(unique.values())
+
+
+def tune(sheet_dir: str, num_options: int = 5, search: str = 'random', trials: int = 200,
+         workers: int = None, seed: int = 0) -> List[Dict]:
+    """Evaluate the search space over a process pool; returns results best first"""
+    labels = load_labels(sheet_dir)
+    configs = generate_configs(search, trials, seed)
+    workers = workers or os.cpu_count() or 1
+    print(f"Evaluating {len(configs)} configurations on {len(labels)} sheets with {workers} workers...")
+
+    started = time.perf_counter()
+    with ProcessPoolExecutor(max_workers=workers, initializer=_init_worker,
+                             initargs=(sheet_dir, labels)) as pool:
+        chunksize = max(1, len(configs) // (workers * 4))
+        results = list(pool.map(evaluate_params, configs, itertools.repeat(num_options),
+                                chunksize=chunksize))
+    print(f"Search finished in {time.perf_counter() - started:.1f}s")
+
+    for result in results:
+        result['is_default'] = result['params'] == DEFAULT_DETECTION_PARAMS
+    results.sort(key=lambda r: (-r['accuracy'], -r['exact_rate'], r['ms_per_sheet']))
+    return results
+
+
+def print_ranking(results: List[Dict], top: int = 10):
+    """Show the best configurations and where the current defaults rank"""
+    print(f"\n{'rank':<6}{'accuracy':>10}{'exact':>8}{'detected':>10}{'ms/sheet':>10}  parameters")
+    for rank, result in enumerate(results, 1):
+        if rank > top and not result['is_default']:
+            continue
+        label = ' (defaults)' if result['is_default'] else ''
+        params = ', '.join(f"{k}={v}" for k, v in result['params'].items())
+        print(f"{rank:<6}{result['accuracy']:>10.2%}{result['exact_rate']:>8.0%}"
+              f"{result['detected_rate']:>10.0%}{result['ms_per_sheet']:>10.2f}  {params}{label}")
+
+
+def main():
+    """Command line entry point"""
+    parser = argparse.ArgumentParser(description='Tune OptiGrade detection parameters on labeled sheets')
+    parser.add_argument('sheet_dir', help=f'directory with sheet images and {LABELS_FILE}')
+    parser.add_argument('--options', type=int, default=5, help='options per question')
+    parser.add_argument('--search', choices=('grid', 'random'), default='random')
+    parser.add_argument('--trials', type=int, default=200, help='configurations for random search')
+    parser.add_argument('--workers', type=int, default=None, help='processes (default: CPU count)')
+    parser.add_argument('--seed', type=int, default=0)
+    parser.add_argument('--top', type=int, default=10, help='configurations to show')
+    parser.add_argument('--db', default='data/optigrade.db', help='database path')
+    parser.add_argument('--assignment-id', type=int, help='save the best set as this assignment\'s profile')
+    parser.add_argument('--camera', help='save the best set as this camera\'s profile (index or URL)')
+    args = parser.parse_args()
+
+    results = tune(args.sheet_dir, num_options=args.options, search=args.search,
+                   trials=args.trials, workers=args.workers, seed=args.seed)
+    if not results:
+        print("No configurations evaluated.")
+        return
+    print_ranking(results, args.top)
+
+    best = results[0]
+    if args.assignment_id is None and args.camera is None:
+        print("\nUse --assignment-id or --camera to save the best configuration.")
+        return
+
+    db = OptiGradeDatabase(args.db)
+    for scope, scope_key in (('assignment', args.assignment_id), ('camera', args.camera)):
+        if scope_key is not None and db.save_detection_profile(scope, scope_key, best['params'],
+                                                               best['accuracy'], best['ms_per_sheet']):
+            print(f"Saved best configuration as {scope} profile '{scope_key}'.")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,475 @@
+#!/usr/bin/env python3
+"""
+OptiGrade Grading Service
+A small asyncio HTTP server that grades uploaded OMR sheet images.
+
+Endpoints:
+    POST /assignments/<id>/sheets   Grade one image (raw body) or several
+                                    (multipart/form-data). Add ?wait=0 to get a
+                                    job ID back immediately instead of results.
+                                    Optional: ?options=<n>, ?student_id=, ?student_name=
+    GET  /jobs/<job_id>             Status and results of an asynchronous job
+    GET  /metrics                   Throughput, latency and queue statistics
+    GET  /health                    Liveness check
+
+Detection and grading run in a process pool; results are written to the
+database in batches by a single writer task.
+"""
+
+import argparse
+import asyncio
+import json
+import os
+import re
+import time
+import uuid
+from collections import deque
+from concurrent.futures import ProcessPoolExecutor
+from datetime import datetime
+from email import policy
+from email.parser import BytesParser
+from typing import Dict, List, Optional
+from urllib.parse import parse_qs, urlsplit
+
+from database_manager import OptiGradeDatabase
+from omr_detector import assess_confidence, build_detailed_results, detect_answers, grade_answers, save_review_crop
+
+MAX_BODY_BYTES = 64 * 1024 * 1024
+MAX_FINISHED_JOBS = 1000
+LATENCY_SAMPLES = 2000
+
+HTTP_REASONS = {200: 'OK', 202: 'Accepted', 400: 'Bad Request', 404: 'Not Found',
+                405: 'Method Not Allowed', 411: 'Length Required', 413: 'Payload Too Large',
+                500: 'Internal Server Error', 503: 'Service Unavailable'}
+
+
+def grade_sheet_image(image_bytes: bytes, answer_key: List[str], num_options: int,
+                      image_path: Optional[str] = None, detection_params: Optional[Dict] = None) -> Dict:
+    """Decode, detect and grade one sheet image (runs in a worker process)"""
+    import cv2
+    import numpy as np
+
+    frame = cv2.imdecode(np.frombuffer(image_bytes, dtype=np.uint8), cv2.IMREAD_COLOR)
+    if frame is None:
+        return {'status': 'invalid_image'}
+
+    confidence = {}
+    detected_answers = detect_answers(frame, len(answer_key), num_options, detection_params, confidence)
+    if not detected_answers:
+        return {'status': 'not_detected'}
+
+    score, correct = grade_answers(detected_answers, answer_key)
+    if image_path:
+        os.makedirs(os.path.dirname(image_path) or '.', exist_ok=True)
+        with open(image_path, 'wb') as image_file:
+            image_file.write(image_bytes)
+
+    # Doubtful sheets are still graded but also go to the review queue
+    review = None
+    assessment = assess_confidence(detected_answers, confidence, detection_params)
+    if assessment['needs_review']:
+        crop_path = None
+        if image_path:
+            crop_path = save_review_crop(frame, confidence['bounds'],
+                                         os.path.splitext(os.path.basename(image_path))[0],
+                                         os.path.join(os.path.dirname(image_path), 'review'))
+        review = {'reasons': assessment['reasons'], 'questions': assessment['ambiguous_questions'],
+                  'crop_path': crop_path}
+
+    return {
+        'status': 'graded',
+        'detected_answers': detected_answers,
+        'score': score,
+        'correct_answers': correct,
+        'total_questions': len(answer_key),
+        'image_path': image_path,
+        'detailed_results': build_detailed_results(detected_answers, answer_key),
+        'review': review,
+    }
+
+
+def upload_image_path(image_dir: str, student_id: str) -> str:
+    """
+    Unique path under image_dir for an uploaded sheet. The client-supplied student ID is
+    reduced to safe characters and a random suffix keeps sheets of the same second apart.
+    """
+    safe_id = re.sub(r'[^A-Za-z0-9_-]', '_', student_id)[:64]
+    timestamp = datetime.now().strftime('%Y%m%d_%H%M%S')
+    image_path = os.path.join(image_dir, f"omr_upload_{safe_id}_{timestamp}_{uuid.uuid4().hex[:8]}.jpg")
+    root = os.path.realpath(image_dir)
+    if os.path.commonpath([root, os.path.realpath(image_path)]) != root:
+        raise ValueError(f"image path {image_path} is outside {image_dir}")
+    return image_path
+
+
+class ServiceBusy(Exception):
+    """Raised when accepting more sheets would exceed the pending limit"""
+
+
+class GradingService:
+    """Asynchronous HTTP grading service with a worker pool and batched database writes"""
+
+    def __init__(self, db: OptiGradeDatabase, host: str = '127.0.0.1', port: int = 8080,
+                 workers: int = None, max_pending: int = 64, batch_size: int = 50,
+                 batch_interval: float = 0.5, image_dir: Optional[str] = 'images'):
+        self.db = db
+        self.host = host
+        self.port = port
+        self.workers = workers or os.cpu_count() or 1
+        self.max_pending = max_pending
+        self.batch_size = batch_size
+        self.batch_interval = batch_interval
+        self.image_dir = image_dir
+
+        self.pool = None
+        self.server = None
+        self._writer_task = None
+        self._write_queue = None
+        self._slots = None
+        self._pending = 0
+        self._student_counter = 0
+        self._run_token = datetime.now().strftime('%H%M%S')  # keeps IDs unique across restarts
+        self.jobs = {}
+
+        self.started_at = time.time()
+        self.counters = {'requests': 0, 'sheets_received': 0, 'graded': 0, 'not_detected': 0,
+                         'invalid_image': 0, 'failed': 0, 'rejected_busy': 0,
+                         'batches_written': 0, 'rows_written': 0}
+        self.latencies = deque(maxlen=LATENCY_SAMPLES)
+        self.completions = deque(maxlen=LATENCY_SAMPLES)
+
+    async def start(self):
+        """Start the worker pool, the database writer and the HTTP listener"""
+        self.pool = ProcessPoolExecutor(max_workers=self.workers)
+        self._write_queue = asyncio.Queue()
+        self._slots = asyncio.Semaphore(self.workers)
+        self._writer_task = asyncio.create_task(self._database_writer())
+        self.server = await asyncio.start_server(self._handle_connection, self.host, self.port)
+        self.port = self.server.sockets[0].getsockname()[1]
+        print(f"OptiGrade grading service listening on http://{self.host}:{self.port} "
+              f"({self.workers} workers, max {self.max_pending} pending sheets)")
+
+    async def stop(self):
+        """Stop accepting requests, flush pending writes and shut down the pool"""
+        if self.server:
+            self.server.close()
+            await self.server.wait_closed()
+        if self._writer_task:
+            await self._write_queue.join()
+            self._writer_task.cancel()
+        if self.pool:
+            self.pool.shutdown(wait=True)
+
+    async def serve_forever(self):
+        """Run until cancelled"""
+        await self.start()
+        try:
+            await self.server.serve_forever()
+        finally:
+            await self.stop()
+
+    # ------------------------------------------------------------------
+    # Grading pipeline
+    # ------------------------------------------------------------------
+
+    def _reserve(self, count: int):
+        """Admit count sheets or raise ServiceBusy (backpressure)"""
+        if self._pending + count > self.max_pending:
+            self.counters['rejected_busy'] += count
+            raise ServiceBusy()
+        self._pending += count
+        self.counters['sheets_received'] += count
+
+    def _next_student(self):
+        """Allocate an automatic student name and ID like the scanner does"""
+        self._student_counter += 1
+        return (f"Student_{self._student_counter:03d}",
+                f"STU_{datetime.now().strftime('%Y%m%d')}_{self._run_token}_{self._student_counter:03d}")
+
+    async def _grade_one(self, assignment: Dict, answer_key: List[str], num_options: int,
+                         sheet: Dict, detection_params: Optional[Dict] = None) -> Dict:
+        """Grade one sheet in the pool and wait for its database write"""
+        started = time.perf_counter()
+        loop = asyncio.get_running_loop()
+        try:
+            student_name, student_id = sheet.get('student_name'), sheet.get('student_id')
+            if not student_id:
+                auto_name, student_id = self._next_student()
+                student_name = student_name or auto_name
+
+            image_path = upload_image_path(self.image_dir, student_id) if self.image_dir else None
+
+            async with self._slots:
+                graded = await loop.run_in_executor(self.pool, grade_sheet_image, sheet['data'],
+                                                    answer_key, num_options, image_path, detection_params)
+
+            result = {'filename': sheet.get('filename'), 'student_id': student_id,
+                      'student_name': student_name, **graded}
+            self.counters[graded['status']] += 1
+            if graded['status'] != 'graded':
+                return result
+
+            saved = loop.create_future()
+            await self._write_queue.put(({
+                'assignment_id': assignment['id'],
+                'student_name': student_name,
+                'student_id': student_id,
+                'score': graded['score'],
+                'correct_answers': graded['correct_answers'],
+                'total_questions': graded['total_questions'],
+                'image_path': graded['image_path'],
+                'detailed_results': graded['detailed_results'],
+                'review': graded['review'],
+            }, saved))
+            result['session_id'] = await saved
+            result.pop('detailed_results')
+            return result
+
+        except Exception as e:
+            self.counters['failed'] += 1
+            return {'filename': sheet.get('filename'), 'status': 'error', 'error': str(e)}
+
+        finally:
+            self._pending -= 1
+            self.latencies.append(time.perf_counter() - started)
+            self.completions.append(time.time())
+
+    async def _grade_sheets(self, assignment: Dict, answer_key: List[str], num_options: int,
+                            sheets: List[Dict], detection_params: Optional[Dict] = None) -> List[Dict]:
+        """Grade a batch of sheets concurrently"""
+        return list(await asyncio.gather(*(self._grade_one(assignment, answer_key, num_options, sheet,
+                                                           detection_params)
+                                           for sheet in sheets)))
+
+    async def _database_writer(self):
+        """Coalesce graded results into batched database transactions"""
+        loop = asyncio.get_running_loop()
+        while True:
+            batch = [await self._write_queue.get()]
+            deadline = loop.time() + self.batch_interval
+            while len(batch) < self.batch_size:
+                timeout = deadline - loop.time()
+                if timeout <= 0:
+                    break
+                try:
+                    batch.append(await asyncio.wait_for(self._write_queue.get(), timeout))
+                except asyncio.TimeoutError:
+                    break
+
+            records = [record for record, _ in batch]
+            try:
+                # The database layer is synchronous; keep it off the event loop
+                session_ids = await loop.run_in_executor(None, self.db.save_grading_results, records)
+            except Exception as e:
+                print(f"Error writing batch: {e}")
+                session_ids = [None] * len(batch)
+
+            self.counters['batches_written'] += 1
+            self.counters['rows_written'] += sum(1 for s in session_ids if s)
+            for (_, saved), session_id in zip(batch, session_ids):
+                if not saved.done():
+                    saved.set_result(session_id)
+                self._write_queue.task_done()
+
+    async def _run_job(self, job_id: str, coroutine):
+        """Run a grading coroutine in the background and record its outcome"""
+        job = self.jobs[job_id]
+        try:
+            job['results'] = await coroutine
+            job['status'] = 'done'
+        except Exception as e:
+            job['status'] = 'error'
+            job['error'] = str(e)
+        job['finished_at'] = time.time()
+
+        finished = [j for j, info in self.jobs.items() if info['status'] != 'running']
+        for old_job in finished[:max(0, len(finished) - MAX_FINISHED_JOBS)]:
+            del self.jobs[old_job]
+
+    # ------------------------------------------------------------------
+    # HTTP handling
+    # ------------------------------------------------------------------
+
+    async def _handle_connection(self, reader, writer):
+        """Serve one HTTP request per connection"""
+        try:
+            status, body, headers = await self._handle_request(reader)
+        except Exception as e:
+            status, body, headers = 500, {'error': str(e)}, {}
+
+        payload = json.dumps(body).encode()
+        head = [f"HTTP/1.1 {status} {HTTP_REASONS.get(status, '')}",
+                'Content-Type: application/json',
+                f'Content-Length: {len(payload)}',
+                'Connection: close']
+        head += [f'{name}: {value}' for name, value in headers.items()]
+        writer.write(('\r\n'.join(head) + '\r\n\r\n').encode() + payload)
+        try:
+            await writer.drain()
+        finally:
+            writer.close()
+
+    async def _handle_request(self, reader):
+        """Parse a request and dispatch it; returns (status, json body, extra headers)"""
+        request_line = (await reader.readline()).decode('latin-1').strip()
+        if not request_line:
+            return 400, {'error': 'empty request'}, {}
+        method, target, _ = request_line.split(' ', 2)
+
+        headers = {}
+        while True:
+            line = (await reader.readline()).decode('latin-1')
+            if line in ('\r\n', '\n', ''):
+                break
+            name, _, value = line.partition(':')
+            headers[name.strip().lower()] = value.strip()
+
+        body = b''
+        if method == 'POST':
+            if 'content-length' not in headers:
+                return 411, {'error': 'Content-Length required'}, {}
+            length = int(headers['content-length'])
+            if length > MAX_BODY_BYTES:
+                return 413, {'error': 'upload too large'}, {}
+            body = await reader.readexactly(length)
+
+        self.counters['requests'] += 1
+        url = urlsplit(target)
+        query = {key: values[-1] for key, values in parse_qs(url.query).items()}
+        path = url.path.rstrip('/').split('/')[1:]
+
+        if method == 'GET' and path == ['health']:
+            return 200, {'status': 'ok'}, {}
+        if method == 'GET' and path == ['metrics']:
+            return 200, self.get_metrics(), {}
+        if method == 'GET' and len(path) == 2 and path[0] == 'jobs':
+            job = self.jobs.get(path[1])
+            if not job:
+                return 404, {'error': 'unknown job'}, {}
+            return 200, {'job_id': path[1], **job}, {}
+        if len(path) == 3 and path[0] == 'assignments' and path[2] == 'sheets':
+            if method != 'POST':
+                return 405, {'error': 'use POST'}, {}
+            return await self._handle_upload(path[1], query, headers, body)
+        return 404, {'error': 'not found'}, {}
+
+    async def _handle_upload(self, assignment_ref: str, query: Dict, headers: Dict, body: bytes):
+        """Accept one or more sheets for an assignment"""
+        try:
+            assignment_id = int(assignment_ref)
+            num_options = int(query['options']) if 'options' in query else None
+        except ValueError:
+            return 400, {'error': 'invalid assignment ID or options'}, {}
+
+        assignment = self.db.get_assignment(assignment_id)
+        if not assignment:
+            return 404, {'error': f'assignment {assignment_id} not found'}, {}
+        if num_options is None:
+            num_options = assignment['num_options']
+        answer_key = [chr(65 + int(option)) if option >= 0 else None
+                      for option in self.db.get_answer_key_array(assignment_id)]
+
+        content_type = headers.get('content-type', '')
+        if content_type.startswith('multipart/form-data'):
+            sheets = parse_multipart(content_type, body)
+        else:
+            sheets = [{'data': body, 'filename': query.get('filename'),
+                       'student_id': query.get('student_id'), 'student_name': query.get('student_name')}]
+        sheets = [sheet for sheet in sheets if sheet['data']]
+        if not sheets:
+            return 400, {'error': 'no sheet images in request'}, {}
+
+        try:
+            self._reserve(len(sheets))
+        except ServiceBusy:
+            return 503, {'error': 'grading queue full, retry later'}, {'Retry-After': '1'}
+
+        detection_params = self.db.get_detection_profile(assignment_id)
+        work = self._grade_sheets(assignment, answer_key, num_options, sheets, detection_params)
+        if query.get('wait', '1') == '0':
+            job_id = uuid.uuid4().hex
+            self.jobs[job_id] = {'status': 'running', 'assignment_id': assignment_id,
+                                 'sheets': len(sheets), 'created_at': time.time()}
+            asyncio.create_task(self._run_job(job_id, work))
+            return 202, {'job_id': job_id, 'status_url': f'/jobs/{job_id}'}, {}
+
+        return 200, {'assignment_id': assignment_id, 'results': await work}, {}
+
+    def get_metrics(self) -> Dict:
+        """Throughput, latency percentiles and queue state"""
+        now = time.time()
+        latencies = sorted(self.latencies)
+
+        def percentile(fraction):
+            if not latencies:
+                return None
+            return round(latencies[min(len(latencies) - 1, int(fraction * len(latencies)))] * 1000, 2)
+
+        recent = [t for t in self.completions if now - t <= 60]
+        uptime = now - self.started_at
+        completed = self.counters['graded'] + self.counters['not_detected'] + self.counters['invalid_image']
+        return {
+            'uptime_seconds': round(uptime, 1),
+            **self.counters,
+            'pending_sheets': self._pending,
+            'write_queue_depth': self._write_queue.qsize() if self._write_queue else 0,
+            'workers': self.workers,
+            'max_pending': self.max_pending,
+            'throughput_per_second': round(completed / uptime, 3) if uptime else 0.0,
+            'throughput_last_minute': round(len(recent) / 60, 3),
+            'latency_ms': {'p50': percentile(0.50), 'p95': percentile(0.95),
+                           'p99': percentile(0.99), 'max': percentile(1.0)},
+            'cache': self.db.get_cache_stats(),
+        }
+
+
+def parse_multipart(content_type: str, body: bytes) -> List[Dict]:
+    """Split a multipart/form-data body into sheets (file parts) with optional student fields"""
+    message = BytesParser(policy=policy.HTTP).parsebytes(
+        b'Content-Type: ' + content_type.encode('latin-1') + b'\r\n\r\n' + body)
+
+    sheets = []
+    fields = {}
+    for part in message.iter_parts():
+        name = part.get_param('name', header='content-disposition')
+        filename = part.get_filename()
+        payload = part.get_payload(decode=True) or b''
+        if filename or part.get_content_type().startswith('image/'):
+            sheets.append({'data': payload, 'filename': filename or name})
+        elif name:
+            fields[name] = payload.decode('utf-8', 'replace').strip()
+
+    # Optional comma-separated student_ids / student_names, in file order
+    student_ids = [s.strip() for s in fields.get('student_ids', '').split(',')] if fields.get('student_ids') else []
+    student_names = [s.strip() for s in fields.get('student_names', '').split(',')] if fields.get('student_names') else []
+    for index, sheet in enumerate(sheets):
+        sheet['student_id'] = student_ids[index] if index < len(student_ids) else None
+        sheet['student_name'] = student_names[index] if index < len(student_names) else None
+    return sheets
+
+
+def main():
+    """Command line entry point"""
+    parser = argparse.ArgumentParser(description='OptiGrade HTTP grading service')
+    parser.add_argument('--host', default='127.0.0.1')
+    parser.add_argument('--port', type=int, default=8080)
+    parser.add_argument('--db', default='data/optigrade.db', help='database path')
+    parser.add_argument('--workers', type=int, default=None, help='grading processes (default: CPU count)')
+    parser.add_argument('--max-pending', type=int, default=64, help='sheets accepted before answering 503')
+    parser.add_argument('--batch-size', type=int, default=50, help='results per database transaction')
+    parser.add_argument('--batch-interval', type=float, default=0.5, help='seconds to wait for a fuller batch')
+    parser.add_argument('--image-dir', default='images', help="where uploads are archived ('' to disable)")
+    args = parser.parse_args()
+
+    service = GradingService(OptiGradeDatabase(args.db), host=args.host, port=args.port,
+                             workers=args.workers, max_pending=args.max_pending,
+                             batch_size=args.batch_size, batch_interval=args.batch_interval,
+                             image_dir=args.image_dir or None)
+    try:
+        asyncio.run(service.serve_forever())
+    except KeyboardInterrupt:
+        print("\nGrading service stopped.")
+
+
+if __name__ == "__main__":
+    main()
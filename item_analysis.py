@@ -0,0 +1,133 @@
+"""
+Item analysis for OptiGrade assignments.
+
+Loads every response of an assignment into a students x questions matrix
+with a single query and computes classical test statistics on it with
+vectorized NumPy operations:
+
+- difficulty: proportion of students answering each question correctly (p-value)
+- discrimination: point-biserial correlation between each question and the
+  rest of the test (item-rest correlation)
+- distractor frequencies: how often each option (and blank) was chosen
+- KR-20 reliability of the whole assignment
+"""
+
+from typing import Dict, Tuple
+
+import numpy as np
+
+# Matrix value for an unanswered or unreadable question
+BLANK = -1
+
+# Answer the scanner stores for a question without a readable mark
+UNMARKED = 'X'
+
+# Width of one packed "QQQQc" answer record (question number + answer letter)
+RECORD_WIDTH = 5
+
+
+def load_response_matrix(conn, assignment_id: int, num_questions: int,
+                         after_session_id: int = 0, num_options: int = None) -> Tuple[np.ndarray, np.ndarray]:
+    """
+    Load an assignment's answers as (session_ids, choices), ordered by session ID.
+    choices[i, j] is the option index (0 = A) student i picked for question j,
+    or BLANK when nothing valid was recorded: the unmarked marker 'X' and letters
+    beyond the sheet's num_options count as blank. Only sessions with an ID above
+    after_session_id are loaded.
+    """
+    # One row per session with its answers packed as fixed-width "QQQQc" records.
+    # Aggregating in SQL avoids materialising a Python tuple per answer, and the
+    # fixed width lets NumPy decode everything in one pass whatever the order.
+    rows = conn.execute('''
+        SELECT gs.id,
+               group_concat(printf('%04d%s', dr.question_number,
+                                   CASE WHEN length(dr.student_answer) = 1
+                                             AND dr.student_answer BETWEEN 'A' AND char(64 + :num_options)
+                                             AND dr.student_answer != :unmarked
+                                        THEN dr.student_answer ELSE '-' END), '')
+        FROM grading_sessions gs
+        JOIN detailed_results dr ON dr.session_id = gs.id
+        WHERE gs.assignment_id = :assignment_id AND gs.id > :after_session_id
+        GROUP BY gs.id
+        ORDER BY gs.id
+    ''', {'assignment_id': assignment_id, 'after_session_id': after_session_id,
+          'num_options': num_options or 26, 'unmarked': UNMARKED}).fetchall()
+
+    session_ids = np.fromiter((row[0] for row in rows), dtype=np.int64, count=len(rows))
+    choices = np.full((len(rows), num_questions), BLANK, dtype=np.int8)
+    if not rows:
+        return session_ids, choices
+
+    packed = [row[1] for row in rows]
+    answers_per_row = np.fromiter((len(p) for p in packed), dtype=np.int64, count=len(packed)) // RECORD_WIDTH
+    records = np.frombuffer(''.join(packed).encode('ascii'), dtype=np.uint8).reshape(-1, RECORD_WIDTH)
+
+    questions = (records[:, :4].astype(np.int64) - ord('0')) @ np.array([1000, 100, 10, 1]) - 1
+    options = records[:, 4].astype(np.int64) - ord('A')
+    rows_index = np.repeat(np.arange(len(rows)), answers_per_row)
+
+    in_range = (questions >= 0) & (questions < num_questions)
+    choices[rows_index[in_range], questions[in_range]] = np.where(options[in_range] >= 0, options[in_range], BLANK)
+    return session_ids, choices
+
+
+def analyze_responses(choices: np.ndarray, answer_key: np.ndarray, num_options: int = None) -> Dict:
+    """Compute difficulty, discrimination, distractor counts and KR-20 for a response matrix"""
+    num_students, num_questions = choices.shape
+    if num_options is None:
+        num_options = int(max(choices.max(initial=0), answer_key.max(initial=0))) + 1
+
+    # Options beyond the sheet layout (e.g. stray letters) count as blank
+    choices = np.where(choices < num_options, choices, BLANK)
+    correct = (choices == answer_key[np.newaxis, :]) & (answer_key[np.newaxis, :] >= 0)
+    scored = correct.astype(np.float32)
+
+    totals = scored.sum(axis=1, dtype=np.float64)
+    difficulty = scored.mean(axis=0, dtype=np.float64)
+
+    # Item-rest correlation without materialising a rest-score matrix:
+    # cov(x, total - x) = cov(x, total) - var(x), var(total - x) = var(total) + var(x) - 2 cov(x, total)
+    if num_students:
+        cov_total = (scored.T @ totals) / num_students - difficulty * totals.mean()
+    else:
+        cov_total = np.zeros(num_questions)
+    var_item = difficulty * (1 - difficulty)
+    var_total = totals.var() if num_students else 0.0
+    cov_rest = cov_total - var_item
+    var_rest = var_total + var_item - 2 * cov_total
+    denominator = np.sqrt(np.clip(var_item * var_rest, 0, None))
+    discrimination = np.divide(cov_rest, denominator, out=np.full(num_questions, np.nan),
+                               where=denominator > 1e-12)
+
+    # Option frequencies per question; column 0 is blank, column k + 1 is option k
+    codes = choices.astype(np.int64) + 1
+    codes += (num_options + 1) * np.arange(num_questions)[np.newaxis, :]
+    option_counts = np.bincount(codes.ravel(), minlength=num_questions * (num_options + 1))
+    option_counts = option_counts.reshape(num_questions, num_options + 1)
+
+    if num_questions > 1 and var_total > 0:
+        kr20 = (num_questions / (num_questions - 1)) * (1 - var_item.sum() / var_total)
+    else:
+        kr20 = float('nan')
+
+    letters = [chr(65 + i) for i in range(num_options)]
+    items = []
+    for q in range(num_questions):
+        key_index = int(answer_key[q])
+        items.append({
+            'question_number': q + 1,
+            'correct_answer': letters[key_index] if 0 <= key_index < num_options else None,
+            'difficulty': float(difficulty[q]),
+            'discrimination': float(discrimination[q]),
+            'option_counts': dict(zip(letters, option_counts[q, 1:].tolist())),
+            'blank_count': int(option_counts[q, 0]),
+        })
+
+    return {
+        'num_students': num_students,
+        'num_questions': num_questions,
+        'num_options': num_options,
+        'mean_correct': float(totals.mean()) if num_students else 0.0,
+        'kr20': float(kr20),
+        'items': items,
+    }
@@ -0,0 +1,214 @@
+#!/usr/bin/env python3
+"""
+Memory-mappable response matrix export for OptiGrade.
+
+Every assignment gets a directory of plain .npy files that analytics code can
+open without SQL and without copying, e.g. np.load(path, mmap_mode='r'):
+
+    responses.npy  int8  (students, questions)  option index, 0 = A, -1 = blank
+    scored.npy     bool  (students, questions)  answer matches the key
+    scores.npy     float32 (students,)          session score in percent
+    index.npy      (session_id int64, student_id S64) per row
+    meta.json      row count, last exported session, answer key and scores_version snapshot
+
+The export is incremental: each update appends only sessions newer than the
+last exported one. The .npy headers are written with a fixed size, so adding
+rows only means appending data and rewriting the shape in place. meta.json is
+replaced last and is the commit point; rows beyond its count (left by an
+interrupted update) are cut off on the next run. A changed answer key, a new
+assignments.scores_version (regrade, re-detection, review corrections,
+archiving) or a review resolved after the last update triggers a full rebuild.
+
+Usage:
+    python matrix_export.py                    # update every assignment once
+    python matrix_export.py --assignment 3 --watch 10
+"""
+
+import argparse
+import json
+import os
+import time
+from datetime import datetime, timezone
+from typing import Dict, Optional
+
+import numpy as np
+
+from item_analysis import load_response_matrix
+
+MATRIX_EXPORT_DIR = 'data/matrices'
+META_FILE = 'meta.json'
+
+# Fixed .npy header size, leaves room for shapes with many digits
+NPY_HEADER_SIZE = 128
+NPY_MAGIC = b'\x93NUMPY\x01\x00'
+
+STUDENT_ID_BYTES = 64
+INDEX_DTYPE = np.dtype([('session_id', '<i8'), ('student_id', f'S{STUDENT_ID_BYTES}')])
+
+
+def _matrix_specs(num_questions: int) -> Dict[str, tuple]:
+    """File name -> (dtype, shape of one row) for every exported array"""
+    return {
+        'responses.npy': (np.dtype(np.int8), (num_questions,)),
+        'scored.npy': (np.dtype(np.bool_), (num_questions,)),
+        'scores.npy': (np.dtype(np.float32), ()),
+        'index.npy': (INDEX_DTYPE, ()),
+    }
+
+
+def _npy_header(dtype: np.dtype, shape: tuple) -> bytes:
+    """Version 1.0 .npy header padded to NPY_HEADER_SIZE bytes"""
+    header = repr({'descr': np.lib.format.dtype_to_descr(dtype), 'fortran_order': False, 'shape': shape})
+    header_len = NPY_HEADER_SIZE - len(NPY_MAGIC) - 2
+    header = header.ljust(header_len - 1) + '\n'
+    if len(header) != header_len:
+        raise ValueError(f"Shape {shape} does not fit in the .npy header")
+    return NPY_MAGIC + header_len.to_bytes(2, 'little') + header.encode('latin1')
+
+
+def _prepare_file(path: str, dtype: np.dtype, row_shape: tuple, rows: int):
+    """Create the file if needed and cut it back to the committed number of rows"""
+    if not os.path.exists(path):
+        with open(path, 'wb') as npy_file:
+            npy_file.write(_npy_header(dtype, (0, *row_shape)))
+    row_bytes = dtype.itemsize * int(np.prod(row_shape, dtype=np.int64))
+    with open(path, 'r+b') as npy_file:
+        npy_file.truncate(NPY_HEADER_SIZE + rows * row_bytes)
+        npy_file.seek(0)
+        npy_file.write(_npy_header(dtype, (rows, *row_shape)))
+
+
+def _append_rows(path: str, array: np.ndarray, rows_before: int):
+    """Append rows after the existing data and update the shape in the header"""
+    with open(path, 'r+b') as npy_file:
+        npy_file.seek(0, os.SEEK_END)
+        npy_file.write(np.ascontiguousarray(array).tobytes())
+        npy_file.seek(0)
+        npy_file.write(_npy_header(array.dtype, (rows_before + len(array), *array.shape[1:])))
+
+
+def read_export_meta(export_path: str) -> Optional[Dict]:
+    """Read meta.json of an assignment export (None if it has not been exported yet)"""
+    try:
+        with open(os.path.join(export_path, META_FILE)) as meta_file:
+            return json.load(meta_file)
+    except (OSError, ValueError):
+        return None
+
+
+def _write_meta(export_path: str, meta: Dict):
+    """Replace meta.json atomically"""
+    temp_path = os.path.join(export_path, META_FILE + '.tmp')
+    with open(temp_path, 'w') as meta_file:
+        json.dump(meta, meta_file, indent=2)
+    os.replace(temp_path, os.path.join(export_path, META_FILE))
+
+
+def _needs_rebuild(conn, meta: Optional[Dict], assignment: Dict, answer_key: np.ndarray,
+                   scores_version: int) -> bool:
+    """A new key, a different layout, changed scores or reviews resolved since the last update invalidate the export"""
+    if meta is None:
+        return True
+    if meta['num_questions'] != assignment['num_questions'] or meta['answer_key'] != answer_key.tolist():
+        return True
+    if meta.get('scores_version') != scores_version:
+        return True
+    row = conn.execute('''
+        SELECT 1 FROM review_queue rq
+        JOIN grading_sessions gs ON gs.id = rq.session_id
+        WHERE gs.assignment_id = ? AND rq.session_id <= ? AND rq.resolved_at >= ?
+        LIMIT 1
+    ''', (assignment['id'], meta['last_session_id'], meta['updated_at'])).fetchone()
+    return row is not None
+
+
+def update_matrix_export(conn, assignment: Dict, answer_key: np.ndarray,
+                         export_dir: str = MATRIX_EXPORT_DIR) -> Dict:
+    """Append sessions that arrived since the last update; returns the new meta data"""
+    assignment_id = assignment['id']
+    num_questions = assignment['num_questions']
+    export_path = os.path.join(export_dir, f"assignment_{assignment_id}")
+    os.makedirs(export_path, exist_ok=True)
+
+    meta = read_export_meta(export_path)
+    started_at = datetime.now(timezone.utc).strftime('%Y-%m-%d %H:%M:%S')  # same format as SQLite
+    # Read from the database rather than the (possibly cached) assignment dict
+    scores_version = conn.execute('SELECT scores_version FROM assignments WHERE id = ?',
+                                  (assignment_id,)).fetchone()[0]
+    if _needs_rebuild(conn, meta, assignment, answer_key, scores_version):
+        meta = {'assignment_id': assignment_id, 'num_questions': num_questions,
+                'answer_key': answer_key.tolist(), 'scores_version': scores_version,
+                'rows': 0, 'last_session_id': 0}
+
+    specs = _matrix_specs(num_questions)
+    for name, (dtype, row_shape) in specs.items():
+        _prepare_file(os.path.join(export_path, name), dtype, row_shape, meta['rows'])
+
+    # Unmarked questions and letters outside the sheet's options are exported as -1 (blank)
+    session_ids, choices = load_response_matrix(conn, assignment_id, num_questions, meta['last_session_id'],
+                                                num_options=assignment.get('num_options'))
+    if len(session_ids):
+        sessions = conn.execute('''
+            SELECT id, student_id, score FROM grading_sessions
+            WHERE assignment_id = ? AND id > ? AND id <= ?
+            ORDER BY id
+        ''', (assignment_id, meta['last_session_id'], int(session_ids[-1]))).fetchall()
+        by_id = {row[0]: row for row in sessions}
+
+        index = np.zeros(len(session_ids), dtype=INDEX_DTYPE)
+        index['session_id'] = session_ids
+        index['student_id'] = [(by_id[s][1] or '').encode('utf-8')[:STUDENT_ID_BYTES] for s in session_ids.tolist()]
+        arrays = {
+            'responses.npy': choices,
+            'scored.npy': (choices == answer_key[np.newaxis, :]) & (answer_key[np.newaxis, :] >= 0),
+            'scores.npy': np.array([by_id[s][2] for s in session_ids.tolist()], dtype=np.float32),
+            'index.npy': index,
+        }
+        for name, array in arrays.items():
+            _append_rows(os.path.join(export_path, name), array, meta['rows'])
+
+        meta['rows'] += len(session_ids)
+        meta['last_session_id'] = int(session_ids[-1])
+
+    meta['updated_at'] = started_at
+    _write_meta(export_path, meta)
+    return meta
+
+
+def open_response_matrices(export_path: str, mmap_mode: str = 'r') -> Dict:
+    """Open an assignment export as memory-mapped arrays (rows beyond meta.json are ignored)"""
+    meta = read_export_meta(export_path)
+    if meta is None:
+        raise FileNotFoundError(f"No matrix export in {export_path}")
+    arrays = {'meta': meta}
+    for name in _matrix_specs(meta['num_questions']):
+        arrays[name[:-len('.npy')]] = np.load(os.path.join(export_path, name), mmap_mode=mmap_mode)[:meta['rows']]
+    return arrays
+
+
+def main():
+    """Command line entry point"""
+    from database_manager import OptiGradeDatabase
+
+    parser = argparse.ArgumentParser(description='Export OptiGrade response matrices as .npy files')
+    parser.add_argument('--db', default='data/optigrade.db', help='database path')
+    parser.add_argument('--export-dir', default=MATRIX_EXPORT_DIR, help='where matrices are written')
+    parser.add_argument('--assignment', type=int, action='append', help='assignment to export (default: all)')
+    parser.add_argument('--watch', type=float, metavar='SECONDS', help='keep updating at this interval')
+    args = parser.parse_args()
+
+    db = OptiGradeDatabase(args.db)
+    while True:
+        assignment_ids = args.assignment or [a['id'] for a in db.get_assignments()]
+        for assignment_id in assignment_ids:
+            meta = db.export_response_matrices(assignment_id, args.export_dir)
+            if meta:
+                print(f"Assignment {assignment_id}: {meta['rows']} rows "
+                      f"(last session {meta['last_session_id']})")
+        if not args.watch:
+            break
+        time.sleep(args.watch)
+
+
+if __name__ == "__main__":
+    main()
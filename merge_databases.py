@@ -0,0 +1,288 @@
+#!/usr/bin/env python3
+"""
+OptiGrade Database Merge
+Consolidates the databases of offline scanning stations into one central database.
+
+Every station numbers its assignments and sessions from 1, so rows cannot be
+copied as they are. Each station database is attached to the central one and
+merged in a single transaction:
+
+- assignments are matched by name, number of questions and answer key;
+  unknown ones are added under a new ID
+- sessions are matched by their natural key (assignment, student ID,
+  processing time, image path, score) and their answers; the others get a
+  block of new central IDs and are copied with INSERT ... SELECT together
+  with their detailed results and review queue entries
+- the rollups of the affected students are recomputed
+
+Stations number their automatically generated student IDs (STU_<date>_<n>)
+independently, so two stations scanning on the same day hand out the same
+IDs to different students. A new session whose generated ID is already used
+by other central sessions is stored as <id>@<station tag> (the tag defaults
+to the station file name); the renamed IDs are reported. Manually entered IDs
+name real students and are kept as they are.
+
+Because sessions that are already present are recognised (under their plain
+or tagged student ID), merging the same station again (or a station copied
+twice) adds nothing. Station-local
+bookkeeping (journal, detection profiles, answer-key history) is not
+merged; image paths are kept as recorded on the station.
+
+Usage:
+    python merge_databases.py stations/station1.db stations/station2.db
+    python merge_databases.py stations/*.db --into data/optigrade.db
+"""
+
+import argparse
+import json
+import os
+import sqlite3
+import time
+from typing import Dict, List
+
+from database_setup import create_database, refresh_student_rollups
+
+SESSION_COLUMNS = ('student_name, score, correct_answers, total_questions, image_path, '
+                   'processed_at')
+DETAILED_COLUMNS = 'question_number, correct_answer, student_answer, is_correct'
+
+# Student IDs generated by the scanners (see OptiGrade.student_id_prefix), unique per station only
+GENERATED_STUDENT_ID_GLOB = 'STU_[0-9][0-9][0-9][0-9][0-9][0-9][0-9][0-9]_[0-9]*'
+
+
+def station_tag(station_path: str) -> str:
+    """Default tag of a station: its file name without extension"""
+    return os.path.splitext(os.path.basename(station_path))[0]
+
+
+def canonical_answer_key(answer_key: str) -> str:
+    """Answer key JSON with question order and formatting normalised, for comparing assignments"""
+    try:
+        key = json.loads(answer_key)
+    except (TypeError, ValueError):
+        return answer_key
+    if isinstance(key, dict):
+        return json.dumps(sorted((int(q), a) for q, a in key.items()))
+    return json.dumps(key)
+
+
+def _station_columns(conn, table: str) -> List[str]:
+    return [row[1] for row in conn.execute(f'PRAGMA station.table_info({table})')]
+
+
+def _map_assignments(conn, stats: Dict):
+    """Fill temp.assignment_map with the central ID of every station assignment"""
+    central = {}
+    for row in conn.execute('SELECT id, assignment_name, num_questions, answer_key FROM main.assignments ORDER BY id'):
+        central.setdefault((row[1], row[2], canonical_answer_key(row[3])), row[0])
+
+    optional = [c for c in ('created_at', 'updated_at', 'closed_at', 'num_options')
+                if c in _station_columns(conn, 'assignments')]
+    columns = ', '.join(['assignment_name', 'num_questions', 'answer_key'] + optional)
+    conn.execute('CREATE TEMP TABLE IF NOT EXISTS assignment_map (station_id INTEGER PRIMARY KEY, central_id INTEGER)')
+    conn.execute('DELETE FROM assignment_map')
+
+    for row in conn.execute(f'SELECT id, {columns} FROM station.assignments ORDER BY id').fetchall():
+        natural_key = (row[1], row[2], canonical_answer_key(row[3]))
+        if natural_key in central:
+            stats['assignments_matched'] += 1
+        else:
+            cursor = conn.execute(f"INSERT INTO main.assignments ({columns}) VALUES ({', '.join('?' * (len(row) - 1))})",
+                                  tuple(row[1:]))
+            central[natural_key] = cursor.lastrowid
+            stats['assignments_added'] += 1
+        conn.execute('INSERT INTO assignment_map VALUES (?, ?)', (row[0], central[natural_key]))
+
+
+def _map_sessions(conn, tag: str):
+    """
+    Fill temp.session_map: sessions already in the central database keep their ID,
+    the others are numbered after the highest central session ID.
+    """
+    next_id = conn.execute('''
+        SELECT MAX(COALESCE((SELECT seq FROM main.sqlite_sequence WHERE name = 'grading_sessions'), 0),
+                   COALESCE((SELECT MAX(id) FROM main.grading_sessions), 0))
+    ''').fetchone()[0]
+
+    conn.execute('''
+        CREATE TEMP TABLE IF NOT EXISTS session_map (
+            station_id INTEGER PRIMARY KEY,
+            central_id INTEGER NOT NULL,
+            assignment_id INTEGER,
+            is_new INTEGER NOT NULL,
+            student_id TEXT
+        )
+    ''')
+    conn.execute('DELETE FROM session_map')
+    # Existing sessions are looked up by student and time (the planner would otherwise pick the far
+    # less selective assignment/score index); the answers are only compared for such candidates
+    conn.execute('''
+        INSERT INTO session_map (station_id, central_id, assignment_id, is_new, student_id)
+        SELECT station_id,
+               COALESCE(existing_id, :next_id + ROW_NUMBER() OVER (PARTITION BY existing_id IS NULL
+                                                                   ORDER BY station_id)),
+               assignment_id,
+               existing_id IS NULL,
+               student_id
+        FROM (
+            SELECT s.id AS station_id, m.central_id AS assignment_id, s.student_id,
+                   (SELECT c.id FROM main.grading_sessions c INDEXED BY idx_sessions_student_time
+                    WHERE (c.student_id IN (s.student_id, s.student_id || '@' || :tag)
+                           OR (c.student_id IS NULL AND s.student_id IS NULL))
+                      AND c.processed_at IS s.processed_at
+                      AND c.assignment_id IS m.central_id AND c.image_path IS s.image_path
+                      AND c.score = s.score AND c.correct_answers = s.correct_answers
+                      AND (SELECT group_concat(question_number || student_answer) FROM (
+                               SELECT question_number, student_answer FROM main.detailed_results
+                               WHERE session_id = c.id ORDER BY question_number))
+                       IS (SELECT group_concat(question_number || student_answer) FROM (
+                               SELECT question_number, student_answer FROM station.detailed_results
+                               WHERE session_id = s.id ORDER BY question_number))
+                    ORDER BY c.id LIMIT 1) AS existing_id
+            FROM station.grading_sessions s
+            LEFT JOIN assignment_map m ON m.station_id = s.assignment_id
+        )
+    ''', {'next_id': next_id, 'tag': tag})
+
+
+def _rename_clashing_students(conn, tag: str) -> List[str]:
+    """
+    Give new sessions whose generated student ID already belongs to other central
+    sessions (another station's student) the ID '<id>@<tag>'; returns the renamed IDs.
+    """
+    clashes = [row[0] for row in conn.execute('''
+        SELECT DISTINCT m.student_id FROM session_map m
+        WHERE m.is_new AND m.student_id GLOB ?
+          AND EXISTS (SELECT 1 FROM main.grading_sessions c
+                      WHERE c.student_id = m.student_id
+                        AND c.id NOT IN (SELECT central_id FROM session_map WHERE NOT is_new))
+        ORDER BY m.student_id
+    ''', (GENERATED_STUDENT_ID_GLOB,))]
+    conn.executemany("UPDATE session_map SET student_id = student_id || '@' || ? WHERE is_new AND student_id = ?",
+                     [(tag, student_id) for student_id in clashes])
+    return clashes
+
+
+def merge_station(conn, station_path: str, tag: str = None) -> Dict:
+    """
+    Merge one station database into the open central database in one transaction.
+    tag (default: the file name) namespaces generated student IDs that clash with other stations.
+    """
+    tag = tag or station_tag(station_path)
+    stats = {'station': station_path, 'tag': tag, 'assignments_added': 0, 'assignments_matched': 0,
+             'sessions_added': 0, 'sessions_matched': 0, 'detailed_results': 0, 'reviews': 0,
+             'renamed_students': []}
+    started = time.perf_counter()
+
+    conn.execute('ATTACH DATABASE ? AS station', (f"file:{os.path.abspath(station_path)}?mode=ro",))
+    try:
+        conn.execute('BEGIN IMMEDIATE')
+        _map_assignments(conn, stats)
+        _map_sessions(conn, tag)
+        stats['renamed_students'] = _rename_clashing_students(conn, tag)
+
+        conn.execute(f'''
+            INSERT INTO main.grading_sessions (id, assignment_id, student_id, {SESSION_COLUMNS})
+            SELECT m.central_id, m.assignment_id, m.student_id,
+                   {', '.join('s.' + c.strip() for c in SESSION_COLUMNS.split(','))}
+            FROM session_map m
+            JOIN station.grading_sessions s ON s.id = m.station_id
+            WHERE m.is_new
+            ORDER BY m.central_id
+        ''')
+        stats['sessions_added'] = conn.execute('SELECT changes()').fetchone()[0]
+        stats['sessions_matched'] = conn.execute('SELECT COUNT(*) FROM session_map WHERE NOT is_new').fetchone()[0]
+
+        # Detailed results are read in station order, which keeps them grouped by session
+        conn.execute(f'''
+            INSERT INTO main.detailed_results (session_id, {DETAILED_COLUMNS})
+            SELECT m.central_id, {', '.join('d.' + c.strip() for c in DETAILED_COLUMNS.split(','))}
+            FROM station.detailed_results d
+            JOIN session_map m ON m.station_id = d.session_id
+            WHERE m.is_new
+            ORDER BY d.id
+        ''')
+        stats['detailed_results'] = conn.execute('SELECT changes()').fetchone()[0]
+
+        has_reviews = conn.execute("SELECT 1 FROM station.sqlite_master WHERE type = 'table' AND name = 'review_queue'")
+        if has_reviews.fetchone():
+            conn.execute('''
+                INSERT OR IGNORE INTO main.review_queue
+                (session_id, reasons, questions, crop_path, status, resolution_note, created_at, resolved_at)
+                SELECT m.central_id, r.reasons, r.questions, r.crop_path, r.status, r.resolution_note,
+                       r.created_at, r.resolved_at
+                FROM station.review_queue r
+                JOIN session_map m ON m.station_id = r.session_id
+                WHERE m.is_new
+            ''')
+            stats['reviews'] = conn.execute('SELECT changes()').fetchone()[0]
+
+        student_ids = [row[0] for row in conn.execute('''
+            SELECT DISTINCT student_id FROM session_map
+            WHERE is_new AND student_id IS NOT NULL
+        ''')]
+        refresh_student_rollups(conn.cursor(), student_ids)
+
+        conn.execute('COMMIT')
+    except Exception:
+        conn.execute('ROLLBACK')
+        raise
+    finally:
+        conn.execute('DETACH DATABASE station')
+
+    stats['seconds'] = time.perf_counter() - started
+    return stats
+
+
+def merge_databases(station_paths: List[str], central_path: str = 'data/optigrade.db') -> List[Dict]:
+    """Merge station databases into the central database one after another; returns per-station statistics"""
+    create_database(central_path, verbose=False)
+
+    # Autocommit mode so every station controls its own transaction
+    conn = sqlite3.connect(central_path, timeout=30, isolation_level=None)
+    conn.execute('PRAGMA temp_store = MEMORY')
+    conn.execute('PRAGMA cache_size = -262144')  # 256 MB page cache for the bulk copy
+
+    results = []
+    try:
+        for station_path in station_paths:
+            if os.path.abspath(station_path) == os.path.abspath(central_path):
+                print(f"Skipping {station_path}: it is the central database")
+                continue
+            if not os.path.exists(station_path):
+                print(f"Skipping {station_path}: file not found")
+                continue
+            try:
+                stats = merge_station(conn, station_path)
+                results.append(stats)
+                print(f"{station_path}: {stats['sessions_added']} sessions added, "
+                      f"{stats['sessions_matched']} already present, "
+                      f"{stats['assignments_added']} new assignments ({stats['seconds']:.1f}s)")
+                if stats['renamed_students']:
+                    print(f"  {len(stats['renamed_students'])} generated student IDs were already used by "
+                          f"another station and were stored as <id>@{stats['tag']}: "
+                          f"{', '.join(stats['renamed_students'][:10])}"
+                          + (' ...' if len(stats['renamed_students']) > 10 else ''))
+            except Exception as e:
+                print(f"Error merging {station_path}: {e}")
+        return results
+
+    finally:
+        conn.close()
+
+
+def main():
+    """Command line entry point"""
+    parser = argparse.ArgumentParser(description='Merge scanning station databases into a central database')
+    parser.add_argument('stations', nargs='+', help='station database files')
+    parser.add_argument('--into', default='data/optigrade.db', help='central database path')
+    args = parser.parse_args()
+
+    results = merge_databases(args.stations, args.into)
+    print(f"\nMerged {len(results)} of {len(args.stations)} station databases: "
+          f"{sum(r['sessions_added'] for r in results)} sessions and "
+          f"{sum(r['detailed_results'] for r in results)} question results added")
+
+
+if __name__ == "__main__":
+    main()
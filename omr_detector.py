@@ -0,0 +1,317 @@
+"""
+OMR sheet detection and grading used by the scanner, the grading service
+and the batch tools. Kept free of camera and database state so the
+functions can run in worker processes.
+"""
+
+import os
+from datetime import datetime
+
+import cv2
+import numpy as np
+
+# Detection constants; detection_tuner.py searches over these and stores the
+# best set as a per-assignment or per-camera profile
+DEFAULT_DETECTION_PARAMS = {
+    'min_area': 100,              # Bubble contour area range (pixels)
+    'max_area': 5000,
+    'min_aspect': 0.8,            # Bounding box width / height range
+    'max_aspect': 1.2,
+    'row_bucket': 50,             # Vertical bucket used to sort bubbles into rows
+    'row_band': 30,               # Max vertical distance of a question's options
+    'min_bubble_fraction': 0.8,   # Share of expected bubbles needed to accept a sheet
+    'mark_threshold': 100,        # Mean intensity below which a bubble counts as marked
+    'ambiguity_margin': 15,       # Marks this close to the threshold are sent for review
+}
+
+# Sheets with fewer answered questions than this are sent for review
+MIN_ANSWERED_FRACTION = 0.5
+
+
+def resolve_detection_params(params=None):
+    """Fill in missing detection parameters with the defaults"""
+    if not params:
+        return DEFAULT_DETECTION_PARAMS
+    return {**DEFAULT_DETECTION_PARAMS, **params}
+
+
+def detect_answers(frame, num_questions, num_options, params=None, confidence=None):
+    """
+    Process OMR sheet to detect marked answers.
+    Returns list of detected answers (A, B, C, D, E, etc.) or None if failed.
+    params overrides entries of DEFAULT_DETECTION_PARAMS; pass a dict as
+    confidence to receive the measurements used by assess_confidence.
+    """
+    # Convert to grayscale
+    gray = cv2.cvtColor(frame, cv2.COLOR_BGR2GRAY)
+
+    # Apply Gaussian blur to reduce noise
+    blurred = cv2.GaussianBlur(gray, (5, 5), 0)
+
+    # Apply threshold to get binary image
+    _, thresh = cv2.threshold(blurred, 0, 255, cv2.THRESH_BINARY_INV + cv2.THRESH_OTSU)
+
+    return read_marked_answers(gray, thresh, num_questions, num_options, params, confidence)
+
+
+def read_marked_answers(gray, thresh, num_questions, num_options, params=None, confidence=None):
+    """Find the bubbles in a thresholded sheet and read the marked option of every question"""
+    params = resolve_detection_params(params)
+    min_area, max_area = params['min_area'], params['max_area']
+    min_aspect, max_aspect = params['min_aspect'], params['max_aspect']
+    row_bucket, row_band = params['row_bucket'], params['row_band']
+
+    # Find contours
+    contours, _ = cv2.findContours(thresh, cv2.RETR_EXTERNAL, cv2.CHAIN_APPROX_SIMPLE)
+
+    # Filter contours to find potential bubbles
+    bubbles = []
+    for contour in contours:
+        area = cv2.contourArea(contour)
+        # Adjust these values based on your OMR sheet and camera setup
+        if min_area < area < max_area:
+            x, y, w, h = cv2.boundingRect(contour)
+            aspect_ratio = w / float(h)
+            if min_aspect < aspect_ratio < max_aspect:  # Roughly circular
+                bubbles.append((x, y, w, h, area))
+
+    # Check if we found enough bubbles. Allow some tolerance.
+    expected_min_bubbles = int(num_questions * num_options * params['min_bubble_fraction']) # 80% of expected by default
+    if len(bubbles) < expected_min_bubbles:
+        # print(f"Warning: Found {len(bubbles)} bubbles, expected at least {expected_min_bubbles}")
+        return None
+
+    # Sort bubbles by position (top to bottom, then left to right)
+    # This is crucial for grouping bubbles into questions
+    bubbles.sort(key=lambda b: (b[1] // row_bucket, b[0])) # Group by approximate row (y // 50) then x
+
+    # Group bubbles by questions
+    detected_answers = []
+    intensities = []  # (darkest, second darkest) mean intensity per question
+    question_boxes = []  # (x, y, w, h) of every option per question, None if not found
+    options_chars = [chr(65 + i) for i in range(num_options)]
+
+    for q_idx in range(num_questions):
+        # Attempt to get bubbles for the current question
+        # This is a simplified approach and might need refinement for complex layouts
+        question_bubbles_candidates = []
+
+        # Heuristic: Find bubbles that are roughly on the same 'row' as the first bubble of the question
+        # This part is a simplification and might need to be more robust
+        if q_idx * num_options < len(bubbles):
+            first_bubble_y = bubbles[q_idx * num_options][1]
+            # Collect bubbles that are within a certain vertical range (30 pixels by default)
+            question_bubbles_candidates = [
+                b for b in bubbles if abs(b[1] - first_bubble_y) < row_band
+            ]
+            # Sort these candidates by x-coordinate to get options in order (A, B, C, D, E)
+            question_bubbles_candidates.sort(key=lambda b: b[0])
+
+        # Take only the first 'num_options' bubbles for this question
+        question_bubbles = question_bubbles_candidates[:num_options]
+
+        if len(question_bubbles) < num_options:
+            detected_answers.append('X')  # Not enough options detected for this question
+            intensities.append((None, None))
+            question_boxes.append(None)
+            continue
+
+        # Find the bubble with the most filled area (darkest) for the current question
+        max_filled_intensity = 256 # Initialize with a value higher than max pixel intensity (255)
+        second_intensity = 256
+        selected_option_char = 'X'
+
+        for i, (x, y, w, h, area) in enumerate(question_bubbles):
+            if i < len(options_chars):
+                roi = gray[y:y+h, x:x+w]
+                if roi.size > 0:
+                    # Calculate the average intensity in the bubble region
+                    # Lower intensity means darker (more filled)
+                    avg_intensity = cv2.mean(roi)[0]
+                    if avg_intensity < max_filled_intensity:
+                        second_intensity = max_filled_intensity
+                        max_filled_intensity = avg_intensity
+                        selected_option_char = options_chars[i]
+                    elif avg_intensity < second_intensity:
+                        second_intensity = avg_intensity
+
+        # A simple threshold to decide if a bubble is truly marked (avg intensity below 100 by default)
+        if max_filled_intensity < params['mark_threshold']:
+            detected_answers.append(selected_option_char)
+        else:
+            detected_answers.append('X') # Considered unmarked
+        intensities.append((max_filled_intensity, second_intensity))
+        question_boxes.append([b[:4] for b in question_bubbles])
+
+    if confidence is not None:
+        confidence['intensities'] = intensities
+        confidence['question_boxes'] = question_boxes
+        confidence['bounds'] = (min(b[0] for b in bubbles), min(b[1] for b in bubbles),
+                                max(b[0] + b[2] for b in bubbles), max(b[1] + b[3] for b in bubbles))
+
+    return detected_answers
+
+
+def assess_confidence(detected_answers, confidence, params=None):
+    """
+    Decide whether a detected sheet needs a human look. Returns
+    {'needs_review', 'reasons', 'ambiguous_questions' (1-based), 'answered_fraction'}.
+    A question is ambiguous when a second bubble is also marked or the mark is
+    within ambiguity_margin of the threshold.
+    """
+    params = resolve_detection_params(params)
+    threshold, margin = params['mark_threshold'], params['ambiguity_margin']
+
+    ambiguous = []
+    for number, (darkest, second) in enumerate(confidence.get('intensities', []), 1):
+        if darkest is None:
+            continue
+        if second < threshold or abs(darkest - threshold) < margin:
+            ambiguous.append(number)
+
+    answered = sum(1 for answer in detected_answers if answer != 'X')
+    answered_fraction = answered / len(detected_answers) if detected_answers else 0.0
+
+    reasons = []
+    if answered_fraction < MIN_ANSWERED_FRACTION:
+        reasons.append('few_answers')
+    if ambiguous:
+        reasons.append('ambiguous_marks')
+
+    return {
+        'needs_review': bool(reasons),
+        'reasons': reasons,
+        'ambiguous_questions': ambiguous,
+        'answered_fraction': answered_fraction,
+    }
+
+
+class FrameProcessor:
+    """
+    Runs detect_answers on a video stream without allocating new images per frame.
+    The capture frame and the grayscale, blurred and threshold images are kept
+    as buffers sized to the stream resolution and reused through OpenCV's dst
+    arguments; they are reallocated only if the resolution changes.
+    The bubble coordinates found by detect end up in the confidence dict
+    ('question_boxes'), which PreviewRenderer uses to mark the graded sheet.
+    """
+
+    def __init__(self, num_questions, num_options, params=None):
+        self.num_questions = num_questions
+        self.num_options = num_options
+        self.params = resolve_detection_params(params)
+        self.frame = None
+        self.gray = None
+        self.blurred = None
+        self.thresh = None
+
+    def _ensure_buffers(self, shape):
+        """(Re)allocate the intermediate images for frames of the given shape"""
+        if self.gray is None or self.gray.shape != shape[:2]:
+            self.gray = np.empty(shape[:2], dtype=np.uint8)
+            self.blurred = np.empty_like(self.gray)
+            self.thresh = np.empty_like(self.gray)
+
+    def read(self, cap):
+        """Read the next frame from a capture into the reused frame buffer"""
+        ret, frame = cap.read(self.frame)
+        if ret:
+            self.frame = frame
+        return ret, frame
+
+    def detect(self, frame, confidence=None):
+        """Same result as detect_answers(frame, ...), computed in the reused buffers"""
+        self._ensure_buffers(frame.shape)
+        cv2.cvtColor(frame, cv2.COLOR_BGR2GRAY, dst=self.gray)
+        cv2.GaussianBlur(self.gray, (5, 5), 0, dst=self.blurred)
+        cv2.threshold(self.blurred, 0, 255, cv2.THRESH_BINARY_INV + cv2.THRESH_OTSU, dst=self.thresh)
+        return read_marked_answers(self.gray, self.thresh, self.num_questions, self.num_options,
+                                   self.params, confidence)
+
+
+def grade_answers(detected_answers, answer_key):
+    """
+    Grade the detected answers against the answer key (a list of answer letters).
+    Returns score as percentage and number of correct answers.
+    """
+    correct_count = 0
+    total_questions = len(answer_key) # Use the length of the answer key as total questions
+
+    # Ensure detected_answers has enough elements to compare
+    min_len = min(len(detected_answers), total_questions)
+
+    for i in range(min_len):
+        # Access answer key by index, as it's a list of characters
+        if detected_answers[i] == answer_key[i]:
+            correct_count += 1
+
+    if total_questions == 0:
+        score = 0.0
+    else:
+        score = (correct_count / float(total_questions)) * 100
+
+    return score, correct_count
+
+
+def build_detailed_results(detected_answers, answer_key):
+    """
+    Build the question-by-question rows stored in detailed_results.
+    Question numbers are 1-based; unmarked questions keep the 'X' marker.
+    Questions without a key entry (None) are stored with an empty correct answer.
+    """
+    detailed_results = []
+    for i, correct_answer in enumerate(answer_key):
+        student_answer = detected_answers[i] if i < len(detected_answers) else 'X'
+        detailed_results.append({
+            'question_number': i + 1,
+            'correct_answer': correct_answer if correct_answer is not None else '',
+            'student_answer': student_answer,
+            'is_correct': correct_answer is not None and student_answer == correct_answer,
+        })
+    return detailed_results
+
+
+def save_result_image(frame, score, student_id, image_dir='images'):
+    """Save the result image with score overlay"""
+    try:
+        # Create images directory if it doesn't exist
+        os.makedirs(image_dir, exist_ok=True)
+
+        # Create a copy to draw on
+        display_image = frame.copy()
+
+        # Add score text to image
+        cv2.putText(display_image, f"Score: {score:.2f}%", (10, 30), cv2.FONT_HERSHEY_SIMPLEX, 0.9, (0, 0, 255), 2)
+        cv2.putText(display_image, f"Student ID: {student_id}", (10, 70), cv2.FONT_HERSHEY_SIMPLEX, 0.7, (0, 0, 255), 2)
+
+        # Save image with timestamp and student ID
+        timestamp = datetime.now().strftime('%Y%m%d_%H%M%S')
+        image_path = f"{image_dir}/omr_result_{student_id}_{timestamp}.jpg"
+        cv2.imwrite(image_path, display_image)
+
+        return image_path
+
+    except Exception as e:
+        print(f"Error saving image: {e}")
+        return None
+
+
+def save_review_crop(frame, bounds, student_id, image_dir='images/review', padding=20):
+    """Save the bubble area of a sheet that needs review; returns the image path"""
+    try:
+        os.makedirs(image_dir, exist_ok=True)
+
+        height, width = frame.shape[:2]
+        x0, y0, x1, y1 = bounds
+        crop = frame[max(0, y0 - padding):min(height, y1 + padding),
+                     max(0, x0 - padding):min(width, x1 + padding)]
+
+        timestamp = datetime.now().strftime('%Y%m%d_%H%M%S')
+        image_path = f"{image_dir}/review_{student_id}_{timestamp}.jpg"
+        cv2.imwrite(image_path, crop)
+
+        return image_path
+
+    except Exception as e:
+        print(f"Error saving review crop: {e}")
+        return None
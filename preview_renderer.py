@@ -0,0 +1,114 @@
+"""
+Live preview for the OptiGrade scanners.
+
+Detection needs full-resolution frames, the preview window does not.
+PreviewRenderer shrinks frames into one reused buffer, redraws the window at
+most max_fps times per second and keeps the last graded sheet on screen as
+an overlay for a few seconds while capture and detection go on. The overlay
+(marked bubbles, right/wrong colors, score text) is drawn once per result
+from the bubble coordinates the detector recorded and then copied onto each
+preview frame through a mask.
+"""
+
+import time
+from typing import List, Optional, Sequence
+
+import cv2
+import numpy as np
+
+DEFAULT_MAX_WIDTH = 640  # Preview width in pixels; smaller frames are shown as they are
+DEFAULT_MAX_FPS = 15
+DEFAULT_RESULT_SECONDS = 3.0  # How long a graded sheet stays on screen
+
+CORRECT_COLOR = (0, 200, 0)
+WRONG_COLOR = (0, 0, 255)
+MISSED_COLOR = (0, 200, 255)  # Right option of a question answered wrong or left blank
+TEXT_COLOR = (0, 0, 255)
+STATUS_COLOR = (255, 255, 0)
+
+
+class PreviewRenderer:
+    """Downscaled, rate-limited scanner window with a non-blocking result overlay"""
+
+    def __init__(self, window_name: str, max_width: int = DEFAULT_MAX_WIDTH, max_fps: float = DEFAULT_MAX_FPS,
+                 result_seconds: float = DEFAULT_RESULT_SECONDS):
+        self.window_name = window_name
+        self.max_width = max_width
+        self.min_interval = 1.0 / max_fps if max_fps else 0.0
+        self.result_seconds = result_seconds
+        self.preview = None  # Reused downscaled frame
+        self.scale = 1.0
+        self.overlay = None
+        self.overlay_mask = None
+        self.result_until = 0.0
+        self.last_render = 0.0
+
+    def _ensure_buffer(self, shape):
+        """(Re)allocate the preview for frames of the given shape"""
+        height, width = shape[:2]
+        scale = min(1.0, self.max_width / width)
+        size = (max(1, round(height * scale)), max(1, round(width * scale)))
+        if self.preview is None or self.preview.shape[:2] != size:
+            self.scale = scale
+            self.preview = np.empty((*size, 3), dtype=np.uint8)
+            self.overlay = None  # Drawn for the previous size
+
+    def result_active(self, now: float = None) -> bool:
+        """Whether the last result is still on screen"""
+        return self.overlay is not None and (now or time.time()) < self.result_until
+
+    def show_result(self, frame_shape, question_boxes: Optional[List], detected_answers: Sequence[str],
+                    answer_key: Sequence[str], lines: Sequence[str]):
+        """Draw the overlay of a graded sheet; render shows it on live frames for result_seconds"""
+        self._ensure_buffer(frame_shape)
+        overlay = np.zeros_like(self.preview)
+
+        for q_idx, boxes in enumerate(question_boxes or []):
+            if not boxes:
+                continue
+            answer = detected_answers[q_idx] if q_idx < len(detected_answers) else 'X'
+            correct = answer_key[q_idx] if q_idx < len(answer_key) else None
+            for option, (x, y, w, h) in enumerate(boxes):
+                letter = chr(65 + option)
+                center = (round((x + w / 2) * self.scale), round((y + h / 2) * self.scale))
+                radius = max(2, round(max(w, h) * self.scale / 2))
+                if letter == answer:
+                    cv2.circle(overlay, center, radius, CORRECT_COLOR if answer == correct else WRONG_COLOR, 2)
+                elif letter == correct:
+                    cv2.circle(overlay, center, radius, MISSED_COLOR, 1)
+
+        for i, line in enumerate(lines):
+            cv2.putText(overlay, line, (10, 25 + 25 * i), cv2.FONT_HERSHEY_SIMPLEX, 0.6, TEXT_COLOR, 2)
+
+        self.overlay = overlay
+        self.overlay_mask = overlay.any(axis=2)[:, :, np.newaxis]
+        self.result_until = time.time() + self.result_seconds
+
+    def render(self, frame, status: str = None) -> int:
+        """
+        Show a frame unless the window was refreshed less than 1 / max_fps ago.
+        Returns the key pressed (as cv2.waitKey) or -1.
+        """
+        now = time.time()
+        if now - self.last_render < self.min_interval:
+            return -1
+        self.last_render = now
+
+        self._ensure_buffer(frame.shape)
+        cv2.resize(frame, (self.preview.shape[1], self.preview.shape[0]), dst=self.preview,
+                   interpolation=cv2.INTER_AREA)
+        if self.result_active(now):
+            np.copyto(self.preview, self.overlay, where=self.overlay_mask)
+        elif status:
+            cv2.putText(self.preview, status, (10, 25), cv2.FONT_HERSHEY_SIMPLEX, 0.6, STATUS_COLOR, 2)
+
+        cv2.imshow(self.window_name, self.preview)
+        return cv2.waitKey(1)
+
+    def close(self):
+        """Close the window (if it was ever shown) and drop the preview buffers"""
+        if self.last_render:
+            cv2.destroyWindow(self.window_name)
+            cv2.waitKey(1)  # Let the GUI backend process the close
+        self.preview = self.overlay = self.overlay_mask = None
+        self.last_render = 0.0
@@ -0,0 +1,301 @@
+#!/usr/bin/env python3
+"""
+OptiGrade Image Reprocessing
+Runs the current detector over the archived sheet images of graded sessions.
+
+Sessions of the selected assignments and/or date range are streamed from the
+database assignment by assignment in ID order (through the assignment's own
+connection, so sharded layouts work too), their images are re-read across a
+process pool and the answers are detected and graded again. Every session is written to a CSV
+diff report (changed questions with old -> new answers, old and new score).
+With --apply the changed answers and scores are stored in batched
+transactions and the students' rollups are refreshed; sessions saved without
+per-question results get them inserted.
+
+Progress is checkpointed after every chunk in data/reprocess/<job>.json, so an
+interrupted job continues where it stopped when started again with the same
+--job name (use --restart to begin anew).
+
+Usage:
+    python reprocess_images.py --assignment 3 --workers 8
+    python reprocess_images.py --since 2025-09-01 --until 2025-12-31 --apply --job fall_redetect
+"""
+
+import argparse
+import csv
+import json
+import os
+import time
+from concurrent.futures import ProcessPoolExecutor
+from typing import Dict, List, Optional
+
+import cv2
+
+from database_manager import OptiGradeDatabase
+from omr_detector import build_detailed_results, detect_answers, grade_answers
+
+REPROCESS_DIR = 'data/reprocess'
+DEFAULT_CHUNK_SIZE = 500  # Sessions fetched, re-detected and checkpointed at a time
+
+REPORT_FIELDS = ['session_id', 'assignment_id', 'student_id', 'image_path', 'status',
+                 'old_score', 'new_score', 'changed_questions']
+
+
+def redetect_image(task: tuple) -> tuple:
+    """Re-read one archived sheet image (runs in a worker process)"""
+    session_id, image_path, num_questions, num_options, params = task
+    frame = cv2.imread(image_path) if image_path else None
+    if frame is None:
+        return session_id, 'missing_image', None
+    answers = detect_answers(frame, num_questions, num_options, params)
+    if not answers:
+        return session_id, 'not_detected', None
+    return session_id, 'ok', answers
+
+
+def session_filter(assignment_ids: List[int] = None, since: str = None, until: str = None):
+    """WHERE clause and parameters selecting the sessions to reprocess"""
+    conditions = []
+    params = []
+    if assignment_ids:
+        conditions.append(f"assignment_id IN ({', '.join('?' * len(assignment_ids))})")
+        params.extend(assignment_ids)
+    if since:
+        conditions.append('processed_at >= ?')
+        params.append(since)
+    if until:
+        conditions.append("processed_at < date(?, '+1 day')")
+        params.append(until)
+    return ' AND '.join(conditions) or '1', params
+
+
+class ReprocessJob:
+    """Streams sessions, re-detects their images and records or applies the differences"""
+
+    def __init__(self, db: OptiGradeDatabase, job: str, assignment_ids: List[int] = None,
+                 since: str = None, until: str = None, num_options: int = None,
+                 apply: bool = False, chunk_size: int = DEFAULT_CHUNK_SIZE, workers: int = None,
+                 state_dir: str = REPROCESS_DIR):
+        self.db = db
+        self.assignment_ids = assignment_ids
+        self.where, self.where_params = session_filter(None, since, until)
+        self.num_options = num_options  # Overrides every assignment's own option count when set
+        self.apply = apply
+        self.chunk_size = chunk_size
+        self.workers = workers or os.cpu_count() or 1
+        self.filters = {'assignments': assignment_ids, 'since': since, 'until': until,
+                        'options': num_options, 'apply': apply}
+        os.makedirs(state_dir, exist_ok=True)
+        self.state_path = os.path.join(state_dir, f"{job}.json")
+        self.report_path = os.path.join(state_dir, f"{job}.csv")
+        self._assignments = {}
+
+    def load_state(self, restart: bool = False) -> Dict:
+        """Resume a job with the same filters, otherwise start from the beginning"""
+        if not restart and os.path.exists(self.state_path):
+            with open(self.state_path) as state_file:
+                state = json.load(state_file)
+            if state['filters'] == self.filters and 'assignment_id' in state:
+                return state
+            print("[INFO] Filters differ from the saved job, starting over")
+        state = {'filters': self.filters, 'assignment_id': 0, 'last_session_id': 0, 'processed': 0, 'changed': 0,
+                 'applied': 0, 'missing_image': 0, 'not_detected': 0}
+        with open(self.report_path, 'w', newline='') as report_file:
+            csv.DictWriter(report_file, fieldnames=REPORT_FIELDS).writeheader()
+        return state
+
+    def save_state(self, state: Dict):
+        temp_path = self.state_path + '.tmp'
+        with open(temp_path, 'w') as state_file:
+            json.dump(state, state_file, indent=2)
+        os.replace(temp_path, self.state_path)
+
+    def job_assignments(self) -> List[int]:
+        """IDs of the assignments to go through, in order"""
+        assignment_ids = self.assignment_ids or [a['id'] for a in self.db.get_assignments()]
+        return sorted(set(assignment_ids))
+
+    def count_remaining(self, state: Dict) -> int:
+        """Sessions not processed yet, resuming from the checkpoint in state"""
+        count = 0
+        for assignment_id in self.job_assignments():
+            if assignment_id < state['assignment_id']:
+                continue
+            after_session_id = state['last_session_id'] if assignment_id == state['assignment_id'] else 0
+            try:
+                conn = self.db._connection_for_assignment(assignment_id)
+            except LookupError:
+                continue
+            count += conn.execute(f'''
+                SELECT COUNT(*) FROM grading_sessions WHERE assignment_id = ? AND id > ? AND {self.where}
+            ''', (assignment_id, after_session_id, *self.where_params)).fetchone()[0]
+            conn.close()
+        return count
+
+    def fetch_chunk(self, assignment_id: int, after_session_id: int) -> List[Dict]:
+        """Next sessions of an assignment by ID together with their stored answers"""
+        try:
+            conn = self.db._connection_for_assignment(assignment_id)
+        except LookupError:
+            return []
+        sessions = [dict(row) for row in conn.execute(f'''
+            SELECT id, assignment_id, student_id, score, correct_answers, total_questions, image_path
+            FROM grading_sessions
+            WHERE assignment_id = ? AND id > ? AND {self.where}
+            ORDER BY id LIMIT ?
+        ''', (assignment_id, after_session_id, *self.where_params, self.chunk_size))]
+        if sessions:
+            answers = {}
+            for row in conn.execute('''
+                SELECT session_id, question_number, student_answer FROM detailed_results
+                WHERE session_id IN (SELECT value FROM json_each(?))
+            ''', (json.dumps([session['id'] for session in sessions]),)):
+                answers.setdefault(row[0], {})[row[1]] = row[2]
+            for session in sessions:
+                session['answers'] = answers.get(session['id'], {})
+        conn.close()
+        return sessions
+
+    def assignment_setup(self, assignment_id: int) -> Optional[tuple]:
+        """(answer key letters, detection params, options per question) of an assignment, looked up once"""
+        if assignment_id not in self._assignments:
+            assignment = self.db.get_assignment(assignment_id)
+            key_array = self.db.get_answer_key_array(assignment_id)
+            self._assignments[assignment_id] = None if assignment is None or key_array is None else (
+                [chr(65 + int(option)) if option >= 0 else None for option in key_array],
+                self.db.get_detection_profile(assignment_id=assignment_id),
+                self.num_options or assignment['num_options'])
+        return self._assignments[assignment_id]
+
+    def compare(self, session: Dict, status: str, answers: Optional[List[str]]) -> tuple:
+        """Diff report row and, if anything changed, the update to apply"""
+        row = {'session_id': session['id'], 'assignment_id': session['assignment_id'],
+               'student_id': session['student_id'], 'image_path': session['image_path'],
+               'status': status, 'old_score': f"{session['score']:.2f}", 'new_score': '',
+               'changed_questions': ''}
+        if status != 'ok':
+            return row, None
+
+        answer_key = self.assignment_setup(session['assignment_id'])[0]
+        score, correct = grade_answers(answers, answer_key)
+        detailed = build_detailed_results(answers, answer_key)
+        # A question without a stored row ('?') is always written, so the session gets its full results
+        changed = [result for result in detailed
+                   if session['answers'].get(result['question_number']) != result['student_answer']]
+        row['new_score'] = f"{score:.2f}"
+        row['changed_questions'] = ';'.join(
+            f"{r['question_number']}:{session['answers'].get(r['question_number'], '?')}->{r['student_answer']}"
+            for r in changed)
+        if not changed:
+            row['status'] = 'unchanged'
+            return row, None
+
+        row['status'] = 'changed'
+        return row, {'assignment_id': session['assignment_id'], 'session_id': session['id'],
+                     'student_id': session['student_id'], 'score': score,
+                     'correct_answers': correct, 'detailed_results': changed}
+
+    def run(self, restart: bool = False) -> Dict:
+        """Process all remaining sessions; returns the final job state"""
+        state = self.load_state(restart)
+        total = self.count_remaining(state)
+        print(f"{total} sessions to reprocess with {self.workers} workers"
+              + (f" (resuming after session {state['last_session_id']})" if state['last_session_id'] else ''))
+
+        started = time.perf_counter()
+        done = 0
+        with ProcessPoolExecutor(max_workers=self.workers) as pool:
+            for assignment_id in self.job_assignments():
+                if assignment_id < state['assignment_id']:
+                    continue
+                if assignment_id > state['assignment_id']:
+                    state['assignment_id'], state['last_session_id'] = assignment_id, 0
+                done += self.run_assignment(pool, state, total, started, done)
+        return state
+
+    def run_assignment(self, pool, state: Dict, total: int, started: float, done: int) -> int:
+        """Process the remaining sessions of state['assignment_id']; returns how many there were"""
+        processed = 0
+        while True:
+            sessions = self.fetch_chunk(state['assignment_id'], state['last_session_id'])
+            if not sessions:
+                break
+
+            tasks = []
+            for session in sessions:
+                setup = self.assignment_setup(session['assignment_id'])
+                if setup:
+                    tasks.append((session['id'], session['image_path'], session['total_questions'], setup[2],
+                                  setup[1]))
+                else:
+                    tasks.append((session['id'], None, session['total_questions'], None, None))
+            chunksize = max(1, len(tasks) // (self.workers * 4))
+            results = pool.map(redetect_image, tasks, chunksize=chunksize)
+
+            rows, updates = [], []
+            for session, (_, status, answers) in zip(sessions, results):
+                row, update = self.compare(session, status, answers)
+                rows.append(row)
+                if update:
+                    updates.append(update)
+
+            # Changes are stored before the report and the checkpoint move past them; a chunk that
+            # could not be stored stops the job, which then resumes with this chunk
+            if self.apply and updates:
+                applied = self.db.apply_redetected_answers(updates)
+                if applied != len(updates):
+                    raise RuntimeError(f"could not store the changes of sessions {sessions[0]['id']}-"
+                                       f"{sessions[-1]['id']}; the job stopped before them")
+                state['applied'] += applied
+
+            with open(self.report_path, 'a', newline='') as report_file:
+                csv.DictWriter(report_file, fieldnames=REPORT_FIELDS).writerows(rows)
+            for row in rows:
+                if row['status'] in ('missing_image', 'not_detected'):
+                    state[row['status']] += 1
+            state['changed'] += len(updates)
+            state['processed'] += len(sessions)
+            state['last_session_id'] = sessions[-1]['id']
+            self.save_state(state)
+
+            processed += len(sessions)
+            elapsed = time.perf_counter() - started
+            print(f"[PROGRESS] {done + processed}/{total} sessions ({(done + processed) / elapsed:.1f}/s), "
+                  f"{state['changed']} changed, {state['missing_image']} missing images")
+        return processed
+
+
+def main():
+    """Command line entry point"""
+    parser = argparse.ArgumentParser(description='Re-run OMR detection over archived sheet images')
+    parser.add_argument('--db', default='data/optigrade.db', help='database path')
+    parser.add_argument('--assignment', type=int, action='append', help='assignment to reprocess (repeatable)')
+    parser.add_argument('--since', help='first processing date (YYYY-MM-DD)')
+    parser.add_argument('--until', help='last processing date (YYYY-MM-DD)')
+    parser.add_argument('--options', type=int, default=None,
+                        help="options per question (default: each assignment's own)")
+    parser.add_argument('--workers', type=int, default=None, help='processes (default: CPU count)')
+    parser.add_argument('--chunk-size', type=int, default=DEFAULT_CHUNK_SIZE, help='sessions per chunk')
+    parser.add_argument('--apply', action='store_true', help='store changed answers and scores')
+    parser.add_argument('--job', default='reprocess', help='job name for the report and checkpoint')
+    parser.add_argument('--restart', action='store_true', help='ignore the saved checkpoint')
+    args = parser.parse_args()
+
+    job = ReprocessJob(OptiGradeDatabase(args.db), args.job, assignment_ids=args.assignment,
+                       since=args.since, until=args.until, num_options=args.options, apply=args.apply,
+                       chunk_size=args.chunk_size, workers=args.workers)
+    try:
+        state = job.run(restart=args.restart)
+    except RuntimeError as e:
+        print(f"Error: {e}. Run the same command again to resume.")
+        return
+
+    print(f"\nProcessed {state['processed']} sessions: {state['changed']} changed, "
+          f"{state['not_detected']} not detected, {state['missing_image']} missing images")
+    if args.apply:
+        print(f"Applied changes to {state['applied']} sessions.")
+    print(f"Report: {job.report_path}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,312 @@
+#!/usr/bin/env python3
+"""
+Crash-safe result journal for OptiGrade.
+
+The scanner appends every graded sheet to a local append-only journal instead
+of committing it to SQLite in the scan loop. A background JournalIngester
+batch-loads new records into the database and checkpoints the byte offset it
+has reached. Each record carries a unique ID, so replaying records after a
+crash (between the insert and the checkpoint) never duplicates a session.
+
+Record layout: 4-byte payload length, 4-byte CRC32 of the payload (both
+little-endian), then the JSON payload. A record cut short by a crash, or one
+whose checksum does not match, ends the readable journal; the writer cuts such
+a tail off when it reopens the file.
+
+A record the database keeps rejecting would hold the checkpoint back forever.
+After MAX_RECORD_ATTEMPTS failed attempts it is moved to a quarantine journal
+next to the original (<journal>.quarantine) and ingestion carries on; once the
+cause is fixed it can be loaded with --journal <journal>.quarantine.
+
+fsync policies:
+    always    fsync after every record (a confirmed sheet survives power loss)
+    interval  fsync at most every fsync_interval seconds
+    never     leave flushing to the operating system (survives process crashes only)
+
+Usage:
+    python result_journal.py                   # ingest whatever is left in the journal
+    python result_journal.py --status
+"""
+
+import argparse
+import json
+import os
+import struct
+import threading
+import time
+import uuid
+import zlib
+from datetime import datetime, timezone
+from typing import Dict, Iterator, Tuple
+
+JOURNAL_PATH = 'data/journal/results.journal'
+RECORD_HEADER = struct.Struct('<II')
+FSYNC_POLICIES = ('always', 'interval', 'never')
+
+# Records larger than this are treated as corruption rather than allocated
+MAX_RECORD_BYTES = 16 * 1024 * 1024
+
+MAX_RECORD_ATTEMPTS = 5  # Failed save attempts before a record is quarantined
+QUARANTINE_SUFFIX = '.quarantine'
+
+
+def read_records(path: str, offset: int = 0) -> Iterator[Tuple[int, Dict]]:
+    """Yield (end offset, record) for every complete record from offset on"""
+    try:
+        journal_file = open(path, 'rb')
+    except FileNotFoundError:
+        return
+    with journal_file:
+        journal_file.seek(offset)
+        while True:
+            header = journal_file.read(RECORD_HEADER.size)
+            if len(header) < RECORD_HEADER.size:
+                return
+            length, checksum = RECORD_HEADER.unpack(header)
+            if length > MAX_RECORD_BYTES:
+                return
+            payload = journal_file.read(length)
+            if len(payload) < length or zlib.crc32(payload) != checksum:
+                return
+            try:
+                record = json.loads(payload)
+            except ValueError:
+                return
+            offset += RECORD_HEADER.size + length
+            yield offset, record
+
+
+def max_student_number(path: str, prefix: str, offset: int = 0) -> int:
+    """Highest number of the auto-generated student IDs '<prefix><number>' in a journal (0 if none)"""
+    highest = 0
+    for _, record in read_records(path, offset):
+        student_id = record.get('student_id') or ''
+        number = student_id[len(prefix):]
+        if student_id.startswith(prefix) and number.isdigit():
+            highest = max(highest, int(number))
+    return highest
+
+
+def valid_length(path: str) -> int:
+    """Byte length of the readable part of a journal"""
+    end = 0
+    for end, _ in read_records(path):
+        pass
+    return end
+
+
+class ResultJournal:
+    """Append-only, length-prefixed journal of grading results"""
+
+    def __init__(self, path: str = JOURNAL_PATH, fsync: str = 'interval', fsync_interval: float = 1.0):
+        if fsync not in FSYNC_POLICIES:
+            raise ValueError(f"fsync must be one of {', '.join(FSYNC_POLICIES)}")
+        self.path = os.path.abspath(path)
+        self.fsync = fsync
+        self.fsync_interval = fsync_interval
+        self.lock = threading.Lock()
+        self._last_sync = time.monotonic()
+
+        os.makedirs(os.path.dirname(self.path), exist_ok=True)
+        # A torn record left by a crash would hide everything appended after it
+        if os.path.exists(self.path):
+            readable = valid_length(self.path)
+            if os.path.getsize(self.path) > readable:
+                print(f"[JOURNAL] Discarding torn tail of {self.path} after byte {readable}")
+                os.truncate(self.path, readable)
+        self._file = open(self.path, 'ab')
+
+    def append(self, record: Dict) -> str:
+        """Append one result (save_grading_results format); returns its journal uid"""
+        record = dict(record)
+        record.setdefault('journal_uid', uuid.uuid4().hex)
+        record.setdefault('processed_at', datetime.now(timezone.utc).strftime('%Y-%m-%d %H:%M:%S'))
+        payload = json.dumps(record, separators=(',', ':')).encode('utf-8')
+
+        with self.lock:
+            self._file.write(RECORD_HEADER.pack(len(payload), zlib.crc32(payload)) + payload)
+            self._file.flush()
+            now = time.monotonic()
+            if self.fsync == 'always' or (self.fsync == 'interval' and now - self._last_sync >= self.fsync_interval):
+                os.fsync(self._file.fileno())
+                self._last_sync = now
+        return record['journal_uid']
+
+    def size(self) -> int:
+        """Current journal size in bytes"""
+        return os.path.getsize(self.path)
+
+    def sync(self):
+        """Force everything appended so far to disk"""
+        with self.lock:
+            self._file.flush()
+            os.fsync(self._file.fileno())
+            self._last_sync = time.monotonic()
+
+    def truncate_if_consumed(self, offset: int, before_truncate=None) -> bool:
+        """Empty the journal if offset is its end; before_truncate runs first under the append lock"""
+        with self.lock:
+            self._file.flush()
+            if self.size() != offset:
+                return False
+            if before_truncate and not before_truncate():
+                return False
+            self._file.truncate(0)
+            os.fsync(self._file.fileno())
+            return True
+
+    def close(self):
+        """Sync and close the journal file"""
+        if not self._file.closed:
+            self.sync()
+            self._file.close()
+
+
+class JournalIngester:
+    """Background thread loading new journal records into the database in batches"""
+
+    def __init__(self, db, journal: ResultJournal, batch_size: int = 100, interval: float = 0.5,
+                 compact_bytes: int = 1024 * 1024, max_attempts: int = MAX_RECORD_ATTEMPTS):
+        self.db = db
+        self.journal = journal
+        self.batch_size = batch_size
+        self.interval = interval
+        self.compact_bytes = compact_bytes
+        self.max_attempts = max_attempts
+        self.quarantine_path = journal.path + QUARANTINE_SUFFIX
+        self.ingested = 0
+        self.quarantined = 0
+        self.offset = 0
+        self._attempts = {}  # journal uid -> failed save attempts
+        self._stop = threading.Event()
+        self._thread = None
+
+    def load_checkpoint(self):
+        """Resume from the saved offset (a journal shorter than that was emptied meanwhile)"""
+        self.offset = self.db.get_journal_checkpoint(self.journal.path)
+        if self.offset > self.journal.size():
+            self.offset = 0
+
+    def ingest_once(self) -> int:
+        """Ingest one batch of new records; returns how many were loaded"""
+        batch = []
+        end = self.offset
+        for end, record in read_records(self.journal.path, self.offset):
+            batch.append(record)
+            if len(batch) >= self.batch_size:
+                break
+        if not batch:
+            return 0
+
+        # Already ingested records are skipped by uid, so a failed batch is simply retried
+        session_ids = self.db.save_grading_results(batch)
+        failed = [record for record, session_id in zip(batch, session_ids) if session_id is None]
+        if failed:
+            # One bad record fails its whole assignment; save the others on their own
+            failed = [record for record in failed if self.db.save_grading_results([record])[0] is None]
+        for record in failed:
+            uid = record.get('journal_uid')
+            self._attempts[uid] = self._attempts.get(uid, 0) + 1
+        if any(self._attempts[record.get('journal_uid')] < self.max_attempts for record in failed):
+            return 0
+        if failed and not self._quarantine(failed):
+            return 0
+        if not self.db.save_journal_checkpoint(self.journal.path, end):
+            return 0
+        for record in failed:
+            self._attempts.pop(record.get('journal_uid'), None)
+        self.offset = end
+        self.ingested += len(batch) - len(failed)
+        return len(batch)
+
+    def _quarantine(self, records) -> bool:
+        """Move records that keep failing to the quarantine journal so the checkpoint can advance"""
+        try:
+            quarantine = ResultJournal(self.quarantine_path, fsync='always')
+            for record in records:
+                quarantine.append(record)
+            quarantine.close()
+        except OSError as e:
+            print(f"[JOURNAL] Could not quarantine {len(records)} record(s): {e}")
+            return False
+        self.quarantined += len(records)
+        print(f"[JOURNAL] {len(records)} record(s) failed {self.max_attempts} times and were moved to "
+              f"{self.quarantine_path}")
+        return True
+
+    def compact(self) -> bool:
+        """Empty the journal once everything in it has been ingested"""
+        def reset_checkpoint():
+            return self.db.save_journal_checkpoint(self.journal.path, 0)
+
+        if self.journal.truncate_if_consumed(self.offset, reset_checkpoint):
+            self.offset = 0
+            return True
+        return False
+
+    def drain(self) -> int:
+        """Ingest until the journal is caught up"""
+        total = 0
+        while True:
+            loaded = self.ingest_once()
+            if not loaded:
+                return total
+            total += loaded
+
+    def _run(self):
+        while not self._stop.is_set():
+            if not self.ingest_once():
+                if self.offset >= self.compact_bytes:
+                    self.compact()
+                self._stop.wait(self.interval)
+        self.drain()
+        self.compact()
+
+    def start(self):
+        """Replay anything left from an earlier run, then keep ingesting in the background"""
+        self.load_checkpoint()
+        replayed = self.drain()
+        if replayed:
+            print(f"[JOURNAL] Replayed {replayed} result(s) left from an earlier run")
+        self._thread = threading.Thread(target=self._run, name='journal-ingester', daemon=True)
+        self._thread.start()
+
+    def stop(self):
+        """Stop the background thread after a final drain"""
+        self._stop.set()
+        if self._thread:
+            self._thread.join()
+            self._thread = None
+
+
+def main():
+    """Command line entry point"""
+    from database_manager import OptiGradeDatabase
+
+    parser = argparse.ArgumentParser(description='Ingest the OptiGrade result journal into the database')
+    parser.add_argument('--journal', default=JOURNAL_PATH, help='journal file')
+    parser.add_argument('--db', default='data/optigrade.db', help='database path')
+    parser.add_argument('--batch-size', type=int, default=100)
+    parser.add_argument('--status', action='store_true', help='only show how much is waiting')
+    args = parser.parse_args()
+
+    db = OptiGradeDatabase(args.db)
+    journal = ResultJournal(args.journal)
+    ingester = JournalIngester(db, journal, batch_size=args.batch_size)
+    ingester.load_checkpoint()
+
+    if args.status:
+        pending = sum(1 for _ in read_records(journal.path, ingester.offset))
+        print(f"{journal.path}: {journal.size()} bytes, checkpoint at {ingester.offset}, "
+              f"{pending} record(s) waiting")
+        quarantined = sum(1 for _ in read_records(ingester.quarantine_path))
+        if quarantined:
+            print(f"{ingester.quarantine_path}: {quarantined} quarantined record(s)")
+    else:
+        print(f"Ingested {ingester.drain()} record(s).")
+        ingester.compact()
+    journal.close()
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,93 @@
+"""
+Score distributions for OptiGrade assignments.
+
+A ScoreDistribution keeps an assignment's scores as a sorted list, so the
+rank or percentile of any score, grade band counts and histograms are
+answered with binary searches instead of queries over grading_sessions.
+OptiGradeDatabase.get_score_distribution keeps one per assignment and only
+adds sessions inserted since its last refresh.
+"""
+
+import bisect
+import heapq
+from typing import Dict, Iterable, List, Sequence, Tuple
+
+# (grade, minimum score) from best to worst, same cutoffs as get_statistics
+DEFAULT_GRADE_BANDS = [('A', 90.0), ('B', 80.0), ('C', 70.0), ('D', 60.0), ('F', 0.0)]
+
+
+class ScoreDistribution:
+    """Sorted scores of one assignment"""
+
+    def __init__(self, assignment_id: int, scores: Iterable[float] = (), last_session_id: int = 0,
+                 version: int = 0):
+        self.assignment_id = assignment_id
+        self.scores = sorted(scores)
+        self.total = sum(self.scores)
+        self.last_session_id = last_session_id  # Highest session ID included
+        self.version = version  # assignments.scores_version the scores were read at
+
+    def __len__(self) -> int:
+        return len(self.scores)
+
+    def add(self, scores: Iterable[float], last_session_id: int):
+        """Merge newly inserted scores (the list is replaced, so readers never see it half-updated)"""
+        new_scores = sorted(scores)
+        if new_scores:
+            self.scores = list(heapq.merge(self.scores, new_scores))
+            self.total += sum(new_scores)
+        self.last_session_id = max(self.last_session_id, last_session_id)
+
+    @property
+    def mean(self) -> float:
+        return self.total / len(self.scores) if self.scores else 0.0
+
+    def rank(self, score: float) -> int:
+        """Competition rank of a score, 1 = best (ties share a rank)"""
+        return len(self.scores) - bisect.bisect_right(self.scores, score) + 1
+
+    def percentile_rank(self, score: float) -> float:
+        """Percentage of scores below this one, counting ties as half"""
+        if not self.scores:
+            return 0.0
+        below = bisect.bisect_left(self.scores, score)
+        equal = bisect.bisect_right(self.scores, score) - below
+        return (below + 0.5 * equal) / len(self.scores) * 100
+
+    def percentile(self, percent: float) -> float:
+        """Score at the given percentile, interpolating between neighbouring scores"""
+        if not self.scores:
+            return 0.0
+        position = min(max(percent, 0.0), 100.0) / 100 * (len(self.scores) - 1)
+        lower = int(position)
+        upper = min(lower + 1, len(self.scores) - 1)
+        return self.scores[lower] + (self.scores[upper] - self.scores[lower]) * (position - lower)
+
+    def grade_for(self, score: float, bands: Sequence[Tuple[str, float]] = DEFAULT_GRADE_BANDS) -> str:
+        """Grade of a score under the given bands"""
+        for grade, minimum in sorted(bands, key=lambda band: -band[1]):
+            if score >= minimum:
+                return grade
+        return sorted(bands, key=lambda band: band[1])[0][0]
+
+    def band_counts(self, bands: Sequence[Tuple[str, float]] = DEFAULT_GRADE_BANDS) -> Dict[str, int]:
+        """Number of scores per grade; the lowest band also takes scores below its minimum"""
+        ordered = sorted(bands, key=lambda band: -band[1])
+        counts = {}
+        upper = len(self.scores)
+        for index, (grade, minimum) in enumerate(ordered):
+            lower = 0 if index == len(ordered) - 1 else bisect.bisect_left(self.scores, minimum)
+            counts[grade] = max(upper - lower, 0)
+            upper = min(upper, lower)
+        return counts
+
+    def histogram(self, bins: int = 10, low: float = 0.0, high: float = 100.0) -> List[Dict]:
+        """Equal-width bins between low and high (the last bin includes high)"""
+        width = (high - low) / bins
+        edges = [low + width * i for i in range(bins)] + [high]
+        histogram = []
+        for i in range(bins):
+            start = bisect.bisect_left(self.scores, edges[i])
+            end = (bisect.bisect_right if i == bins - 1 else bisect.bisect_left)(self.scores, edges[i + 1])
+            histogram.append({'start': edges[i], 'end': edges[i + 1], 'count': end - start})
+        return histogram
@@ -0,0 +1,423 @@
+"""
+Sharded storage layout for OptiGrade.
+
+Instead of a single ever-growing data/optigrade.db, assignments are spread
+over several SQLite files ("shards"), one per term or per N assignments,
+with a small catalog database that records where each shard lives.
+
+Each shard reserves its own block of row IDs (shard_no * SHARD_ID_SPAN), so
+an assignment or session ID alone is enough to find the shard holding it.
+Grading sessions are always written to the shard of their assignment, so
+per-assignment queries only ever open a single file. Student and overall
+queries fan out over the shards in parallel and merge the results.
+"""
+
+import json
+import os
+import re
+import sqlite3
+from concurrent.futures import ThreadPoolExecutor
+from typing import Callable, Dict, List, Optional
+
+from database_manager import (OptiGradeDatabase, DEFAULT_ASSIGNMENT_CACHE_SIZE, DEFAULT_CACHE_REVALIDATE_SECONDS,
+                              MAX_STUDENT_NUMBER_SQL, PERIOD_FORMATS, REVIEW_QUEUE_SQL, STUDENT_PERIOD_SQL,
+                              STUDENT_TREND_SQL, decode_review_row)
+from database_setup import (ROLLUP_RECENT_SCORES, create_database, create_detection_profiles_table,
+                            create_journal_tables, refresh_student_rollups)
+
+# Size of the ID block reserved for every shard
+SHARD_ID_SPAN = 1_000_000_000
+
+# Columns of get_statistics() that are plain counts and can be summed
+_COUNT_COLUMNS = ('total_sessions', 'a_grades', 'b_grades', 'c_grades', 'd_grades', 'f_grades')
+
+
+def merge_statistics(partials: List[Dict]) -> Dict:
+    """Combine get_statistics() results computed on separate shards"""
+    partials = [p for p in partials if p and p.get('total_sessions')]
+    if not partials:
+        return {'total_sessions': 0, 'average_score': None, 'min_score': None, 'max_score': None,
+                'a_grades': 0, 'b_grades': 0, 'c_grades': 0, 'd_grades': 0, 'f_grades': 0}
+
+    merged = {column: sum(p[column] for p in partials) for column in _COUNT_COLUMNS}
+    merged['average_score'] = sum(p['average_score'] * p['total_sessions'] for p in partials) / merged['total_sessions']
+    merged['min_score'] = min(p['min_score'] for p in partials)
+    merged['max_score'] = max(p['max_score'] for p in partials)
+    return merged
+
+
+class ShardedOptiGradeDatabase(OptiGradeDatabase):
+    """OptiGradeDatabase that stores assignments in per-term or size-capped shards"""
+
+    def __init__(self, shard_dir: str = 'data/shards', term: str = None,
+                 assignments_per_shard: int = None, max_readers: int = 4,
+                 cache_size: int = DEFAULT_ASSIGNMENT_CACHE_SIZE,
+                 cache_revalidate_seconds: float = DEFAULT_CACHE_REVALIDATE_SECONDS):
+        self.shard_dir = shard_dir
+        self.term = term
+        self.assignments_per_shard = assignments_per_shard
+        self.max_readers = max_readers
+        self._shards = {}  # shard_no -> shard row from the catalog
+
+        # The catalog takes the place of the single database file
+        super().__init__(os.path.join(shard_dir, 'catalog.db'), cache_size=cache_size,
+                         cache_revalidate_seconds=cache_revalidate_seconds)
+        self._load_catalog()
+
+    def _ensure_database_exists(self):
+        """Ensure the shard directory and catalog exist"""
+        os.makedirs(self.shard_dir, exist_ok=True)
+
+        conn = sqlite3.connect(self.db_path)
+        conn.execute('''
+            CREATE TABLE IF NOT EXISTS shards (
+                shard_no INTEGER PRIMARY KEY,
+                term TEXT,
+                path TEXT NOT NULL,
+                assignment_count INTEGER NOT NULL DEFAULT 0,
+                created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
+            )
+        ''')
+        conn.execute('CREATE INDEX IF NOT EXISTS idx_shards_term ON shards(term)')
+        # Detection profiles and journal checkpoints are shared by all shards and live in the catalog
+        create_detection_profiles_table(conn.cursor())
+        create_journal_tables(conn.cursor())
+        conn.commit()
+        conn.close()
+
+    def _load_catalog(self):
+        """Refresh the in-memory copy of the shard catalog"""
+        conn = self._get_connection()
+        rows = conn.execute('SELECT * FROM shards ORDER BY shard_no').fetchall()
+        conn.close()
+        self._shards = {row['shard_no']: dict(row) for row in rows}
+
+    def _create_shard(self, term: Optional[str]) -> Dict:
+        """Create a new shard file, reserve its ID block and register it in the catalog"""
+        conn = self._get_connection()
+        try:
+            conn.execute('BEGIN IMMEDIATE')
+            shard_no = conn.execute('SELECT COALESCE(MAX(shard_no), 0) + 1 FROM shards').fetchone()[0]
+            slug = re.sub(r'[^A-Za-z0-9_-]+', '_', term) if term else 'default'
+            path = os.path.join(self.shard_dir, f"shard_{shard_no:04d}_{slug}.db")
+
+            create_database(path, verbose=False)
+            shard_conn = sqlite3.connect(path)
+            id_base = shard_no * SHARD_ID_SPAN
+            shard_conn.executemany('INSERT INTO sqlite_sequence (name, seq) VALUES (?, ?)',
+                                   [('assignments', id_base), ('grading_sessions', id_base)])
+            shard_conn.commit()
+            shard_conn.close()
+
+            conn.execute('INSERT INTO shards (shard_no, term, path) VALUES (?, ?, ?)',
+                         (shard_no, term, path))
+            conn.commit()
+        finally:
+            conn.close()
+
+        self._load_catalog()
+        print(f"Created shard {shard_no} for term '{term or 'default'}': {path}")
+        return self._shards[shard_no]
+
+    def _active_shard(self) -> Dict:
+        """Get the shard that new assignments are written to"""
+        candidates = [s for s in self._shards.values() if s['term'] == self.term]
+        if candidates:
+            shard = max(candidates, key=lambda s: s['shard_no'])
+            if not self.assignments_per_shard or shard['assignment_count'] < self.assignments_per_shard:
+                return shard
+        return self._create_shard(self.term)
+
+    def _shard_for_id(self, row_id: int) -> Optional[Dict]:
+        """Get the shard owning an assignment or session ID"""
+        shard_no = row_id // SHARD_ID_SPAN
+        if shard_no not in self._shards:
+            # Another process may have created the shard since we last looked
+            self._load_catalog()
+        return self._shards.get(shard_no)
+
+    def _shard_connection(self, shard: Dict):
+        """Open a connection to one shard"""
+        conn = sqlite3.connect(shard['path'])
+        conn.row_factory = sqlite3.Row
+        return conn
+
+    def _connection_for_assignment(self, assignment_id: int):
+        """Get a connection to the shard holding the given assignment"""
+        shard = self._shard_for_id(assignment_id)
+        if shard is None:
+            raise LookupError(f"No shard holds assignment {assignment_id}")
+        return self._shard_connection(shard)
+
+    def _connection_for_session(self, session_id: int):
+        """Get a connection to the shard holding the given grading session"""
+        shard = self._shard_for_id(session_id)
+        if shard is None:
+            raise LookupError(f"No shard holds grading session {session_id}")
+        return self._shard_connection(shard)
+
+    def get_shards(self, term: str = None) -> List[Dict]:
+        """Get catalog entries, optionally restricted to one term"""
+        self._load_catalog()
+        shards = list(self._shards.values())
+        if term is not None:
+            shards = [s for s in shards if s['term'] == term]
+        return shards
+
+    def _fan_out(self, query: Callable, term: str = None) -> List:
+        """Run query(cursor) against every shard of a term in parallel"""
+        def run(shard):
+            conn = self._shard_connection(shard)
+            try:
+                return query(conn.cursor())
+            finally:
+                conn.close()
+
+        shards = self.get_shards(term)
+        if len(shards) <= 1:
+            return [run(shard) for shard in shards]
+        with ThreadPoolExecutor(max_workers=min(self.max_readers, len(shards))) as pool:
+            return list(pool.map(run, shards))
+
+    def save_assignment(self, assignment_name: str, num_questions: int, answer_key: Dict[int, int],
+                        num_options: int = 5) -> int:
+        """Save a new assignment into the active shard"""
+        try:
+            shard = self._active_shard()
+            conn = self._shard_connection(shard)
+            cursor = conn.cursor()
+
+            cursor.execute('''
+                INSERT INTO assignments (assignment_name, num_questions, answer_key, num_options)
+                VALUES (?, ?, ?, ?)
+            ''', (assignment_name, num_questions, json.dumps(answer_key), num_options))
+
+            assignment_id = cursor.lastrowid
+            conn.commit()
+            conn.close()
+
+            catalog = self._get_connection()
+            catalog.execute('UPDATE shards SET assignment_count = assignment_count + 1 WHERE shard_no = ?',
+                            (shard['shard_no'],))
+            catalog.commit()
+            catalog.close()
+            shard['assignment_count'] += 1
+
+            print(f"Assignment '{assignment_name}' saved with ID: {assignment_id}")
+            return assignment_id
+
+        except Exception as e:
+            print(f"Error saving assignment: {e}")
+            return None
+
+    def get_student_results(self, student_id: str, term: str = None) -> List[Dict]:
+        """Get all results for a student across shards (or only one term's shards)"""
+        def query(cursor):
+            cursor.execute('''
+                SELECT gs.*, a.assignment_name
+                FROM grading_sessions gs
+                JOIN assignments a ON gs.assignment_id = a.id
+                WHERE gs.student_id = ?
+            ''', (student_id,))
+            return [dict(row) for row in cursor.fetchall()]
+
+        try:
+            results = [row for rows in self._fan_out(query, term) for row in rows]
+            results.sort(key=lambda r: r['processed_at'], reverse=True)
+            return results
+
+        except Exception as e:
+            print(f"Error retrieving student results: {e}")
+            return []
+
+    def get_assignments(self, term: str = None) -> List[Dict]:
+        """Get all assignments across shards"""
+        def query(cursor):
+            cursor.execute('''
+                SELECT id, assignment_name, num_questions, created_at,
+                       (SELECT COUNT(*) FROM grading_sessions WHERE assignment_id = assignments.id) as session_count
+                FROM assignments
+            ''')
+            return [dict(row) for row in cursor.fetchall()]
+
+        try:
+            results = [row for rows in self._fan_out(query, term) for row in rows]
+            results.sort(key=lambda r: r['created_at'], reverse=True)
+            return results
+
+        except Exception as e:
+            print(f"Error retrieving assignments: {e}")
+            return []
+
+    def get_recent_sessions(self, limit: int = 10, term: str = None) -> List[Dict]:
+        """Get the most recently processed sessions across shards"""
+        def query(cursor):
+            cursor.execute('''
+                SELECT gs.*, a.assignment_name
+                FROM grading_sessions gs
+                JOIN assignments a ON gs.assignment_id = a.id
+                ORDER BY gs.processed_at DESC
+                LIMIT ?
+            ''', (limit,))
+            return [dict(row) for row in cursor.fetchall()]
+
+        try:
+            results = [row for rows in self._fan_out(query, term) for row in rows]
+            results.sort(key=lambda r: r['processed_at'], reverse=True)
+            return results[:limit]
+
+        except Exception as e:
+            print(f"Error retrieving recent sessions: {e}")
+            return []
+
+    def get_max_student_number(self, prefix: str) -> int:
+        """Get the highest auto-generated student number across all shards"""
+        def query(cursor):
+            return cursor.execute(MAX_STUDENT_NUMBER_SQL, {'prefix': prefix}).fetchone()[0] or 0
+
+        try:
+            return max(self._fan_out(query), default=0)
+
+        except Exception as e:
+            print(f"Error retrieving student numbers: {e}")
+            return 0
+
+    def get_review_queue(self, status: str = 'pending', limit: int = 50, term: str = None) -> List[Dict]:
+        """Get review queue entries (oldest first) across shards"""
+        def query(cursor):
+            cursor.execute(REVIEW_QUEUE_SQL, (status, limit))
+            return [decode_review_row(row) for row in cursor.fetchall()]
+
+        try:
+            results = [row for rows in self._fan_out(query, term) for row in rows]
+            results.sort(key=lambda r: (r['created_at'], r['session_id']))
+            return results[:limit]
+
+        except Exception as e:
+            print(f"Error retrieving review queue: {e}")
+            return []
+
+    def get_statistics(self, assignment_id: int = None, term: str = None) -> Dict:
+        """Get grading statistics for one assignment, one term or all shards"""
+        if assignment_id:
+            return super().get_statistics(assignment_id)
+
+        def query(cursor):
+            cursor.execute('''
+                SELECT
+                    COUNT(*) as total_sessions,
+                    AVG(score) as average_score,
+                    MIN(score) as min_score,
+                    MAX(score) as max_score,
+                    COUNT(CASE WHEN score >= 90 THEN 1 END) as a_grades,
+                    COUNT(CASE WHEN score >= 80 AND score < 90 THEN 1 END) as b_grades,
+                    COUNT(CASE WHEN score >= 70 AND score < 80 THEN 1 END) as c_grades,
+                    COUNT(CASE WHEN score >= 60 AND score < 70 THEN 1 END) as d_grades,
+                    COUNT(CASE WHEN score < 60 THEN 1 END) as f_grades
+                FROM grading_sessions
+            ''')
+            return dict(cursor.fetchone())
+
+        try:
+            return merge_statistics(self._fan_out(query, term))
+
+        except Exception as e:
+            print(f"Error retrieving statistics: {e}")
+            return {}
+
+    def rebuild_student_rollups(self, student_ids: List[str] = None) -> bool:
+        """Recompute rollups in every shard"""
+        try:
+            for shard in self.get_shards():
+                conn = self._shard_connection(shard)
+                refresh_student_rollups(conn.cursor(), student_ids)
+                conn.commit()
+                conn.close()
+            return True
+
+        except Exception as e:
+            print(f"Error rebuilding student rollups: {e}")
+            return False
+
+    def get_student_rollup(self, student_id: str, term: str = None) -> Optional[Dict]:
+        """Merge a student's per-shard rollups into one summary"""
+        def query(cursor):
+            cursor.execute('SELECT * FROM student_rollups WHERE student_id = ?', (student_id,))
+            row = cursor.fetchone()
+            return dict(row) if row else None
+
+        try:
+            partials = [p for p in self._fan_out(query, term) if p]
+            if not partials:
+                return None
+
+            # Newest shard first so recent scores stay in time order
+            partials.reverse()
+            partials.sort(key=lambda p: p['last_processed_at'] or '', reverse=True)
+            attempts = sum(p['attempt_count'] for p in partials)
+            recent_scores = [score for p in partials for score in json.loads(p['recent_scores'])]
+            return {
+                'student_id': student_id,
+                'student_name': partials[0]['student_name'],
+                'attempt_count': attempts,
+                'mean_score': sum(p['mean_score'] * p['attempt_count'] for p in partials) / attempts,
+                'best_score': max(p['best_score'] for p in partials),
+                'worst_score': min(p['worst_score'] for p in partials),
+                'recent_scores': recent_scores[:ROLLUP_RECENT_SCORES],
+                'last_processed_at': partials[0]['last_processed_at'],
+                # A school-wide rank would need every student's merged mean,
+                # which defeats the point of sharding
+                'rank': None,
+                'ranked_students': None,
+            }
+
+        except Exception as e:
+            print(f"Error retrieving student rollup: {e}")
+            return None
+
+    def _student_sessions_connection(self, student_id: str, term: str = None):
+        """Collect a student's sessions from all shards into an in-memory student_sessions table"""
+        def query(cursor):
+            cursor.execute('''
+                SELECT gs.id, gs.assignment_id, a.assignment_name, gs.score, gs.processed_at
+                FROM grading_sessions gs
+                JOIN assignments a ON gs.assignment_id = a.id
+                WHERE gs.student_id = ?
+            ''', (student_id,))
+            return cursor.fetchall()
+
+        conn = sqlite3.connect(':memory:')
+        conn.row_factory = sqlite3.Row
+        conn.execute('''
+            CREATE TABLE student_sessions (
+                id INTEGER, assignment_id INTEGER, assignment_name TEXT,
+                score REAL, processed_at TIMESTAMP
+            )
+        ''')
+        for rows in self._fan_out(query, term):
+            conn.executemany('INSERT INTO student_sessions VALUES (?, ?, ?, ?, ?)', [tuple(r) for r in rows])
+        return conn
+
+    def get_student_trend(self, student_id: str, window: int = 3, term: str = None) -> List[Dict]:
+        """Get a student's cross-shard score trend with moving average"""
+        try:
+            conn = self._student_sessions_connection(student_id, term)
+            results = [dict(row) for row in conn.execute(STUDENT_TREND_SQL, (max(window, 1) - 1,))]
+            conn.close()
+            return results
+
+        except Exception as e:
+            print(f"Error retrieving student trend: {e}")
+            return []
+
+    def get_student_period_summary(self, student_id: str, period: str = 'month', term: str = None) -> List[Dict]:
+        """Get a student's cross-shard attempts and average score per period"""
+        try:
+            conn = self._student_sessions_connection(student_id, term)
+            results = [dict(row) for row in conn.execute(STUDENT_PERIOD_SQL, (PERIOD_FORMATS[period],))]
+            conn.close()
+            return results
+
+        except Exception as e:
+            print(f"Error retrieving student period summary: {e}")
+            return []
@@ -0,0 +1,268 @@
+#!/usr/bin/env python3
+"""
+OptiGrade Station Mode
+Grades sheets from several cameras on one workstation at the same time.
+
+Every camera gets its own capture process that detects, grades and saves the
+result image. Finished results are sent over a queue to a single writer
+process, the only one holding a database connection, which commits them in
+batches. Student numbers come from one shared counter seeded from the
+database, so stations never hand out the same ID twice.
+
+Usage:
+    python station_mode.py --assignment-id 3 --camera 0 --camera 1
+    python station_mode.py --assignment-id 3 --camera http://192.168.1.100:8080/video --headless
+"""
+
+import argparse
+import multiprocessing as mp
+import os
+import queue
+import sqlite3
+import time
+from datetime import datetime
+from typing import Dict, List, Optional
+
+from database_manager import OptiGradeDatabase
+from omr_detector import (FrameProcessor, assess_confidence, build_detailed_results, grade_answers,
+                          save_result_image, save_review_crop)
+from preview_renderer import PreviewRenderer
+from result_journal import ResultJournal
+
+DETECTION_COOLDOWN = 2.0  # Seconds between processing attempts per camera
+SHUTDOWN_RETRIES = 5  # Save attempts for leftover results once the stations have stopped
+UNSAVED_JOURNAL = 'data/journal/station_unsaved.journal'  # Where results go that still could not be saved
+
+
+def student_id_prefix() -> str:
+    """Prefix of automatically generated student IDs for today (shared with OptiGrade.py)"""
+    return f"STU_{datetime.now().strftime('%Y%m%d')}_"
+
+
+def parse_camera_source(source: str):
+    """Camera indexes are given as numbers, IP cameras as stream URLs"""
+    return int(source) if source.isdigit() else source
+
+
+def allocate_student_number(counter) -> int:
+    """Take the next student number from the counter shared by all stations"""
+    with counter.get_lock():
+        counter.value += 1
+        return counter.value
+
+
+def capture_station(camera: str, station_no: int, assignment: Dict, answer_key: List[str],
+                    num_options: int, counter, results, stop_event, headless: bool, image_dir: str,
+                    detection_params: Dict = None):
+    """Capture, detect and grade sheets from one camera (runs in its own process)"""
+    import cv2
+
+    cap = cv2.VideoCapture(parse_camera_source(camera))
+    if not cap.isOpened():
+        print(f"[ERROR] Station {station_no}: could not open camera {camera}")
+        return
+
+    window_name = f"OptiGrade Station {station_no} ({camera})"
+    num_questions = len(answer_key)
+    processor = FrameProcessor(num_questions, num_options, detection_params)
+    preview = None if headless else PreviewRenderer(window_name)
+    last_detection_time = 0
+    sheets = 0
+
+    try:
+        while not stop_event.is_set():
+            ret, frame = processor.read(cap)
+            if not ret:
+                print(f"[ERROR] Station {station_no}: failed to grab frame.")
+                break
+
+            current_time = time.time()
+            if current_time - last_detection_time > DETECTION_COOLDOWN and not (
+                    preview and preview.result_active(current_time)):
+                confidence = {}
+                detected_answers = processor.detect(frame, confidence)
+
+                # Every detected sheet is accepted; doubtful ones are also queued for review
+                if detected_answers:
+                    last_detection_time = current_time
+                    sheets += 1
+
+                    score, correct = grade_answers(detected_answers, answer_key)
+                    number = allocate_student_number(counter)
+                    student_name = f"Student_{number:03d}"
+                    student_id = f"{student_id_prefix()}{number:03d}"
+                    image_path = save_result_image(frame, score, student_id, image_dir)
+
+                    assessment = assess_confidence(detected_answers, confidence, processor.params)
+                    review = None
+                    if assessment['needs_review']:
+                        review = {
+                            'reasons': assessment['reasons'],
+                            'questions': assessment['ambiguous_questions'],
+                            'crop_path': save_review_crop(frame, confidence['bounds'], student_id,
+                                                          os.path.join(image_dir, 'review')),
+                        }
+
+                    results.put({
+                        'assignment_id': assignment['id'],
+                        'student_name': student_name,
+                        'student_id': student_id,
+                        'score': score,
+                        'correct_answers': correct,
+                        'total_questions': num_questions,
+                        'image_path': image_path,
+                        'detailed_results': build_detailed_results(detected_answers, answer_key),
+                        'review': review,
+                    })
+                    print(f"[Station {station_no}] {student_id}: {score:.2f}% ({correct}/{num_questions})"
+                          + (" - queued for review" if review else ""))
+                    if preview:
+                        preview.show_result(frame.shape, confidence.get('question_boxes'), detected_answers,
+                                            answer_key, [f"Score: {score:.2f}%", f"Student ID: {student_id}"])
+
+            if preview and preview.render(frame) & 0xFF == ord('q'):
+                stop_event.set()
+    except KeyboardInterrupt:
+        stop_event.set()
+    finally:
+        cap.release()
+        if preview:
+            preview.close()
+        print(f"[INFO] Station {station_no} stopped after {sheets} sheets.")
+
+
+def database_writer(db_path: str, results, batch_size: int, flush_interval: float,
+                    unsaved_journal: str = UNSAVED_JOURNAL):
+    """
+    Own the database connection and commit queued results in batches (runs in its own process).
+    Results that still fail SHUTDOWN_RETRIES times after the stop sentinel are written to
+    unsaved_journal, from where result_journal.py can load them later.
+    """
+    # WAL lets the viewer and other readers keep working while batches are committed
+    conn = sqlite3.connect(db_path)
+    conn.execute('PRAGMA journal_mode=WAL')
+    conn.close()
+
+    db = OptiGradeDatabase(db_path)
+    pending = []
+    saved = 0
+    last_flush = time.monotonic()
+    finished = False
+    shutdown_attempts = 0
+
+    while not finished or pending:
+        if not finished:
+            timeout = max(0.0, flush_interval - (time.monotonic() - last_flush))
+            try:
+                record = results.get(timeout=timeout)
+                if record is None:
+                    finished = True
+                else:
+                    pending.append(record)
+            except queue.Empty:
+                pass
+            except KeyboardInterrupt:
+                continue  # Keep draining; the main process sends the stop sentinel
+
+        if pending and (finished or len(pending) >= batch_size
+                        or time.monotonic() - last_flush >= flush_interval):
+            session_ids = db.save_grading_results(pending)
+            saved += sum(1 for session_id in session_ids if session_id)
+            # Keep anything that failed (e.g. a locked database) for the next batch
+            pending = [record for record, session_id in zip(pending, session_ids) if not session_id]
+            last_flush = time.monotonic()
+            if pending and finished:
+                shutdown_attempts += 1
+                if shutdown_attempts >= SHUTDOWN_RETRIES:
+                    break
+                print(f"[WARN] {len(pending)} results could not be saved yet, retrying.")
+                time.sleep(flush_interval)
+            elif pending:
+                print(f"[WARN] {len(pending)} results could not be saved yet, retrying.")
+
+    print(f"[INFO] Database writer saved {saved} results.")
+    if pending:
+        try:
+            journal = ResultJournal(unsaved_journal, fsync='always')
+            for record in pending:
+                journal.append(record)
+            journal.close()
+            print(f"[ERROR] {len(pending)} results could not be saved and were written to {unsaved_journal}. "
+                  f"Load them with: python result_journal.py --journal {unsaved_journal} --db {db_path}")
+        except Exception as e:
+            print(f"[ERROR] {len(pending)} results could not be saved or journaled ({e}):")
+            for record in pending:
+                print(f"  {record.get('student_id')}: {record.get('score', 0):.2f}% ({record.get('image_path')})")
+
+
+def run_station(db_path: str, assignment_id: int, cameras: List[str], num_options: Optional[int] = None,
+                batch_size: int = 20, flush_interval: float = 1.0, headless: bool = False,
+                image_dir: str = 'images'):
+    """Run one capture process per camera and a single database writer until stopped"""
+    db = OptiGradeDatabase(db_path)
+    assignment = db.get_assignment(assignment_id)
+    if not assignment:
+        print(f"Assignment {assignment_id} not found.")
+        return
+
+    if num_options is None:
+        num_options = assignment['num_options']
+    answer_key = [chr(65 + int(option)) if option >= 0 else None
+                  for option in db.get_answer_key_array(assignment_id)]
+    counter = mp.Value('i', db.get_max_student_number(student_id_prefix()))
+    results = mp.Queue()
+    stop_event = mp.Event()
+
+    writer = mp.Process(target=database_writer, name='optigrade-writer',
+                        args=(db_path, results, batch_size, flush_interval))
+    writer.start()
+
+    stations = []
+    for station_no, camera in enumerate(cameras, 1):
+        # Each camera may have its own tuned detection profile
+        detection_params = db.get_detection_profile(assignment_id, camera)
+        station = mp.Process(target=capture_station, name=f'optigrade-station-{station_no}',
+                             args=(camera, station_no, assignment, answer_key, num_options,
+                                   counter, results, stop_event, headless, image_dir, detection_params))
+        station.start()
+        stations.append(station)
+
+    print(f"Grading '{assignment['assignment_name']}' on {len(stations)} stations. "
+          f"Press 'q' in a camera window or Ctrl+C to stop.")
+    try:
+        for station in stations:
+            station.join()
+    except KeyboardInterrupt:
+        stop_event.set()
+        for station in stations:
+            station.join()
+    finally:
+        # All producers are gone; the sentinel tells the writer to flush and exit
+        results.put(None)
+        writer.join()
+
+    print(f"[INFO] Station mode finished. Last student number: {counter.value}")
+
+
+def main():
+    """Command line entry point"""
+    parser = argparse.ArgumentParser(description='OptiGrade multi-camera station mode')
+    parser.add_argument('--assignment-id', type=int, required=True, help='assignment to grade')
+    parser.add_argument('--camera', action='append', required=True,
+                        help='camera index or stream URL (repeat for every station)')
+    parser.add_argument('--options', type=int, default=None,
+                        help="options per question (default: the assignment's own)")
+    parser.add_argument('--db', default='data/optigrade.db', help='database path')
+    parser.add_argument('--batch-size', type=int, default=20, help='results per database transaction')
+    parser.add_argument('--flush-interval', type=float, default=1.0, help='seconds between batch commits')
+    parser.add_argument('--image-dir', default='images', help='where result images are saved')
+    parser.add_argument('--headless', action='store_true', help='do not open camera windows')
+    args = parser.parse_args()
+
+    run_station(args.db, args.assignment_id, args.camera, num_options=args.options,
+                batch_size=args.batch_size, flush_interval=args.flush_interval,
+                headless=args.headless, image_dir=args.image_dir)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,56 @@
+"""Tests for the .npy response matrix export"""
+
+import os
+import sys
+
+import numpy as np
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), '..'))
+
+from database_manager import OptiGradeDatabase  # noqa: E402
+from matrix_export import open_response_matrices  # noqa: E402
+
+
+def _detailed(answers, key):
+    return [{'question_number': q + 1, 'correct_answer': key[q], 'student_answer': answer,
+             'is_correct': answer == key[q]} for q, answer in enumerate(answers)]
+
+
+def test_blank_answers_are_exported_as_minus_one(tmp_path):
+    db = OptiGradeDatabase(str(tmp_path / 'optigrade.db'))
+    key = ['A', 'B', 'C', 'D']
+    assignment_id = db.save_assignment('Quiz', 4, dict(enumerate(key)), num_options=4)
+
+    # 'X' is the unmarked marker, 'E' lies outside a four-option sheet
+    for student, answers in (('S1', ['A', 'B', 'C', 'D']), ('S2', ['X', 'B', 'X', 'A']), ('S3', ['E', '', 'C', 'X'])):
+        correct = sum(a == k for a, k in zip(answers, key))
+        db.save_grading_result(assignment_id, student, student, 100.0 * correct / 4, correct, 4,
+                               detailed_results=_detailed(answers, key))
+
+    meta = db.export_response_matrices(assignment_id, str(tmp_path / 'matrices'))
+    assert meta['rows'] == 3
+
+    arrays = open_response_matrices(str(tmp_path / 'matrices' / f'assignment_{assignment_id}'))
+    assert arrays['responses'].tolist() == [[0, 1, 2, 3], [-1, 1, -1, 0], [-1, -1, 2, -1]]
+    assert arrays['scored'].tolist() == [[True] * 4, [False, True, False, False], [False, False, True, False]]
+
+
+def test_changed_scores_rebuild_the_export(tmp_path):
+    db = OptiGradeDatabase(str(tmp_path / 'optigrade.db'))
+    key = ['A', 'B', 'C']
+    assignment_id = db.save_assignment('Quiz', 3, dict(enumerate(key)), num_options=4)
+    session_id = db.save_grading_result(assignment_id, 'S1', 'S1', 100.0 / 3, 1, 3,
+                                        detailed_results=_detailed(['A', 'X', 'X'], key))
+    export_path = str(tmp_path / 'matrices' / f'assignment_{assignment_id}')
+    db.export_response_matrices(assignment_id, str(tmp_path / 'matrices'))
+
+    # Re-detection rewrites an exported session and bumps scores_version
+    db.apply_redetected_answers([{'assignment_id': assignment_id, 'session_id': session_id, 'student_id': 'S1',
+                                  'score': 100.0, 'correct_answers': 3,
+                                  'detailed_results': _detailed(['A', 'B', 'C'], key)[1:]}])
+    meta = db.export_response_matrices(assignment_id, str(tmp_path / 'matrices'))
+    assert meta['rows'] == 1
+
+    arrays = open_response_matrices(export_path)
+    np.testing.assert_array_equal(arrays['responses'], np.array([[0, 1, 2]], dtype=np.int8))
+    np.testing.assert_allclose(arrays['scores'], [100.0])